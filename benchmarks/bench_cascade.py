@@ -0,0 +1,44 @@
+"""Frames/sec of cat detection with the cascade reloaded per frame vs the preloaded cascade pool."""
+
+import argparse
+import os
+
+import cv2
+
+from benchmarks.common import measure_fps, setup_django, synthetic_frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--frames", type=int, default=100)
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+    from stream.detection import DETECT_PARAMS, get_cascade_pool
+
+    cascade_path = os.path.join(settings.BASE_DIR, "cascades", "haarcascade_frontalcatface.xml")
+
+    def reload_per_frame(frame):
+        # What gen_frames used to do: parse the XML from disk for every frame
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        cv2.CascadeClassifier(cascade_path).detectMultiScale(gray, **DETECT_PARAMS)
+
+    pool = get_cascade_pool()
+
+    def preloaded(frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        pool.detect(gray, "haarcascade_frontalcatface")
+
+    frames = list(synthetic_frames(args.frames, args.width, args.height))
+    before = measure_fps(reload_per_frame, frames)
+    after = measure_fps(preloaded, frames)
+    print(f"{args.frames} frames at {args.width}x{args.height}")
+    print(f"reload per frame: {before:8.1f} fps")
+    print(f"preloaded pool:   {after:8.1f} fps ({after / before:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
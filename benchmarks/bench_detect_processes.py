@@ -0,0 +1,68 @@
+"""Detections/sec of 1..16 synthetic cameras: cascades in the capture threads vs the multi-process detection engine."""
+
+import argparse
+import os
+import threading
+import time
+
+import cv2
+
+from benchmarks.common import setup_django, synthetic_frames
+
+
+def run_cameras(detect, cameras, frames, seconds):
+    """Run `cameras` threads that each detect on their frames back to back; return detections per second."""
+    counts = [0] * cameras
+    deadline = time.perf_counter() + seconds
+
+    def camera(index):
+        while time.perf_counter() < deadline:
+            detect(frames[counts[index] % len(frames)])
+            counts[index] += 1
+
+    threads = [threading.Thread(target=camera, args=(i,)) for i in range(cameras)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(counts) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--cameras", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--processes", type=int, default=None, help="Detector processes (default: one per core)")
+    parser.add_argument("--seconds", type=float, default=3.0, help="Measuring time per camera count")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--scale", type=float, default=0.5)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+    from stream.detection import get_cascade_pool
+    from stream.engine import DetectionEngine
+
+    pool = get_cascade_pool()
+    names = pool.names
+    # What the capture thread hands to detection: a downscaled grayscale frame
+    frames = [
+        cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), None, fx=args.scale, fy=args.scale, interpolation=cv2.INTER_AREA)
+        for frame in synthetic_frames(30, args.width, args.height)
+    ]
+    engine = DetectionEngine(os.path.join(settings.BASE_DIR, "cascades"), processes=args.processes)
+    try:
+        engine.detect_all(frames[0], names)  # Wait for the detector processes to load their cascades
+        print(f"{os.cpu_count()} cores, {engine.processes} detector processes, frames {frames[0].shape[1]}x{frames[0].shape[0]}")
+        print(f"{'cameras':>7} {'threads':>12} {'processes':>12} {'speedup':>8}")
+        for cameras in args.cameras:
+            threads = run_cameras(lambda frame: pool.detect_all(frame, names), cameras, frames, args.seconds)
+            processes = run_cameras(lambda frame: engine.detect_all(frame, names), cameras, frames, args.seconds)
+            print(f"{cameras:>7} {threads:>8.1f} d/s {processes:>8.1f} d/s {processes / threads:>7.2f}x")
+    finally:
+        engine.close()
+
+
+if __name__ == "__main__":
+    main()
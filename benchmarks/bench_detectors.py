@@ -0,0 +1,139 @@
+"""Accuracy and throughput of the detector backends on a fixed replay clip.
+
+Every backend sees the same first --frames frames of the clip. Accuracy is precision and
+recall at IoU >= 0.5 against --labels, a JSON file {"frame index": [[x, y, w, h], ...]},
+or against the first backend listed when there are no labels. Throughput runs 1..N camera
+threads that all detect on the clip at once, which is where the dnn backend's batching shows:
+
+    python -m benchmarks.bench_detectors --clip cats.mp4 --model MobileNetSSD.caffemodel \\
+        --config MobileNetSSD.prototxt --labels cats.json --cameras 1 2 4 8
+"""
+
+import argparse
+import json
+import threading
+import time
+
+import cv2
+
+from benchmarks.common import setup_django
+
+
+def read_clip(path, count):
+    capture = cv2.VideoCapture(path)
+    frames = []
+    while len(frames) < count:
+        success, frame = capture.read()
+        if not success:
+            break
+        frames.append(frame)
+    capture.release()
+    return frames
+
+
+def iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    w = min(ax + aw, bx + bw) - max(ax, bx)
+    h = min(ay + ah, by + bh) - max(ay, by)
+    if w <= 0 or h <= 0:
+        return 0.0
+    overlap = w * h
+    return overlap / (aw * ah + bw * bh - overlap)
+
+
+def match(found, expected, threshold=0.5):
+    """Greedy one-to-one matching; returns (true positives, found count, expected count) over all frames."""
+    hits = found_count = expected_count = 0
+    for frame_found, frame_expected in zip(found, expected):
+        found_count += len(frame_found)
+        expected_count += len(frame_expected)
+        left = list(frame_expected)
+        for box in frame_found:
+            best = max(left, key=lambda other: iou(box, other), default=None)
+            if best is not None and iou(box, best) >= threshold:
+                left.remove(best)
+                hits += 1
+    return hits, found_count, expected_count
+
+
+def throughput(detector, frames, cameras, seconds):
+    """Frames detected per second with `cameras` threads detecting on the clip at the same time."""
+    counts = [0] * cameras
+    deadline = time.perf_counter() + seconds
+
+    def camera(index):
+        while time.perf_counter() < deadline:
+            detector.detect(detector.prepare(frames[(counts[index] + index) % len(frames)]))
+            counts[index] += 1
+
+    threads = [threading.Thread(target=camera, args=(i,)) for i in range(cameras)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(counts) / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clip", required=True, help="Video file every backend is run on")
+    parser.add_argument("--frames", type=int, default=300, help="Frames of the clip to use")
+    parser.add_argument("--labels", help="JSON ground truth: frame index -> list of [x, y, w, h]")
+    parser.add_argument("--backends", nargs="+", default=["cascade", "dnn"])
+    parser.add_argument("--cameras", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--seconds", type=float, default=3.0, help="Measuring time per camera count")
+    parser.add_argument("--model", help="dnn backend: network weights (overrides STREAM_DNN)")
+    parser.add_argument("--config", help="dnn backend: network config, e.g. a .prototxt")
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+    from django.core.exceptions import ImproperlyConfigured
+    from stream import detectors
+
+    frames = read_clip(args.clip, args.frames)
+    if not frames:
+        parser.error(f"Could not read any frame from {args.clip}")
+    settings.STREAM_DETECT_PROCESSES = 0  # Backends are compared in this process
+    if args.model:
+        settings.STREAM_DNN = {**settings.STREAM_DNN, "model": args.model, "config": args.config}
+
+    expected = None
+    if args.labels:
+        with open(args.labels) as f:
+            labels = json.load(f)
+        expected = [[tuple(box) for box in labels.get(str(i), [])] for i in range(len(frames))]
+
+    height, width = frames[0].shape[:2]
+    print(f"{len(frames)} frames of {args.clip} at {width}x{height}")
+    print(f"{'backend':>8} {'found':>6} {'precision':>9} {'recall':>7} {'ms/frame':>9}  " + " ".join(f"{c:>3} cam fps" for c in args.cameras))
+    for name in args.backends:
+        settings.STREAM_DETECTOR = name
+        try:
+            detector = detectors.get_detector()
+        except ImproperlyConfigured as e:
+            print(f"{name:>8} skipped: {e}")
+            continue
+
+        started = time.perf_counter()
+        found = [detector.detect(detector.prepare(frame)) for frame in frames]
+        ms = (time.perf_counter() - started) / len(frames) * 1000
+        if expected is None:
+            expected = found  # The first backend is the reference the others are compared with
+        hits, found_count, expected_count = match(found, expected)
+        precision = hits / found_count if found_count else 1.0
+        recall = hits / expected_count if expected_count else 1.0
+
+        rates = [throughput(detector, frames, cameras, args.seconds) for cameras in args.cameras]
+        print(
+            f"{name:>8} {found_count:>6} {precision:>9.2f} {recall:>7.2f} {ms:>9.1f}  "
+            + " ".join(f"{rate:>11.1f}" for rate in rates)
+        )
+        if hasattr(detector, "stats"):
+            print(f"{'':>8} {detector.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""Headless end-to-end benchmark: capture -> detect -> encode -> viewers, for 1..N cameras and viewers.
+
+Cameras are synthetic (or a replayed video file), opened through the same registry and
+capture workers as the real feeds, and every viewer runs the gen_frames loop. Reports
+capture and viewer fps, p50/p99 capture-to-send latency, CPU and memory, and can save the
+results as JSON and compare them with an earlier run:
+
+    python -m benchmarks.bench_pipeline --cameras 1 4 8 --viewers 1 4 --output before.json
+    python -m benchmarks.bench_pipeline --cameras 1 4 8 --viewers 1 4 --compare before.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import threading
+import time
+
+from benchmarks.common import setup_django
+from benchmarks.loadtest_mjpeg import rss_mb
+
+# Metric -> True if higher is better; used when comparing with a previous run
+COMPARED = {"capture_fps": True, "viewer_fps": True, "latency_p50_ms": False, "latency_p99_ms": False, "cpu_percent": False}
+
+
+def percentile(values, share):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(share * len(values)))]
+
+
+def run(views, cameras, viewers, seconds, profile, warmup):
+    """Open `cameras` cameras with `viewers` viewers each for `seconds` and measure them."""
+    from stream.capture import FRAME_TIMEOUT
+
+    stop = threading.Event()
+    measuring = threading.Event()
+    latencies = []
+    delivered = []
+
+    def viewer(camera_id):
+        count = 0
+        with views.camera_registry.acquire(camera_id) as lease:
+            subscription = lease.worker.subscribe()
+            try:
+                while not stop.is_set():
+                    frame = subscription.get(timeout=FRAME_TIMEOUT)
+                    if frame is None:
+                        break
+                    if lease.worker.encoded.get(frame, profile) is None:
+                        continue
+                    if measuring.is_set():
+                        latencies.append(time.time() - frame.timestamp)
+                        count += 1
+            finally:
+                subscription.close()
+        delivered.append(count)
+
+    threads = [threading.Thread(target=viewer, args=(camera_id,)) for camera_id in range(cameras) for _ in range(viewers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(warmup)  # Opening the cameras and the first detections are not what is measured
+
+    with views.lock:
+        workers = list({id(worker): worker for worker in views.camera_instances.values()}.values())
+    seqs = [worker.latest.seq if worker.latest else 0 for worker in workers]
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    started = time.perf_counter()
+    measuring.set()
+    time.sleep(seconds)
+    measuring.clear()
+    elapsed = time.perf_counter() - started
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    captured = sum((worker.latest.seq if worker.latest else 0) - seq for worker, seq in zip(workers, seqs))
+    memory = rss_mb(os.getpid())
+
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    cpu = (after.ru_utime - usage.ru_utime) + (after.ru_stime - usage.ru_stime)
+    return {
+        "cameras": cameras,
+        "viewers": viewers,
+        "capture_fps": captured / elapsed / cameras,
+        "viewer_fps": sum(delivered) / elapsed / len(threads),
+        "latency_p50_ms": percentile(latencies, 0.5) * 1000 if latencies else None,
+        "latency_p99_ms": percentile(latencies, 0.99) * 1000 if latencies else None,
+        "cpu_percent": cpu / elapsed * 100,  # Of one core
+        "rss_mb": memory,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Print the change of every metric against a previous run; return the number of regressions."""
+    previous = {(row["cameras"], row["viewers"]): row for row in baseline["results"]}
+    regressions = 0
+    print(f"\ncompared with {baseline['meta'].get('date', 'previous run')} (tolerance {tolerance:.0%})")
+    for row in results:
+        old = previous.get((row["cameras"], row["viewers"]))
+        if old is None:
+            continue
+        changes = []
+        for metric, higher_is_better in COMPARED.items():
+            if not old.get(metric) or row.get(metric) is None:
+                continue
+            change = (row[metric] - old[metric]) / old[metric]
+            worse = -change if higher_is_better else change
+            flag = ""
+            if worse > tolerance:
+                flag = " REGRESSION"
+                regressions += 1
+            changes.append(f"{metric} {change:+.1%}{flag}")
+        print(f"{row['cameras']:>3} cameras x {row['viewers']:>3} viewers: " + ", ".join(changes))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cameras", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--viewers", type=int, nargs="+", default=[1], help="Viewers per camera")
+    parser.add_argument("--seconds", type=float, default=5.0, help="Measuring time per configuration")
+    parser.add_argument("--warmup", type=float, default=1.0)
+    parser.add_argument("--source", choices=["synthetic", "file"], default="synthetic")
+    parser.add_argument("--path", help="Video file to replay with --source file")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--fps", type=float, default=30, help="Frame rate of every camera")
+    parser.add_argument("--static", action="store_true", help="Synthetic cameras show a static scene")
+    parser.add_argument("--profile", default="full")
+    parser.add_argument("--output", help="Save the results to this JSON file")
+    parser.add_argument("--compare", help="JSON file of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Relative change counted as a regression")
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+    import cv2
+    from stream import views
+
+    settings.STREAM_SOURCE = args.source
+    if args.source == "file":
+        if not args.path:
+            parser.error("--source file needs --path")
+        settings.STREAM_SOURCE_OPTIONS = {"path": args.path, "width": args.width, "height": args.height, "fps": args.fps}
+    else:
+        settings.STREAM_SOURCE_OPTIONS = {"width": args.width, "height": args.height, "fps": args.fps, "moving": not args.static}
+    views.USE_MOCK = False  # A capture device per camera id
+    views.camera_registry.grace = 0  # Every configuration starts with freshly opened cameras
+
+    results = []
+    print(f"{'cameras':>7} {'viewers':>7} {'capture fps':>11} {'viewer fps':>10} {'p50 ms':>8} {'p99 ms':>8} {'cpu %':>7} {'rss MB':>7}")
+    for cameras in args.cameras:
+        for viewers in args.viewers:
+            row = run(views, cameras, viewers, args.seconds, args.profile, args.warmup)
+            results.append(row)
+            print(
+                f"{cameras:>7} {viewers:>7} {row['capture_fps']:>11.1f} {row['viewer_fps']:>10.1f} "
+                f"{row['latency_p50_ms'] or 0:>8.1f} {row['latency_p99_ms'] or 0:>8.1f} "
+                f"{row['cpu_percent']:>7.1f} {row['rss_mb'] or 0:>7.1f}"
+            )
+
+    meta = {
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "args": vars(args),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "opencv": cv2.__version__,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"meta": meta, "results": results}, f, indent=2)
+        print(f"\nsaved to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
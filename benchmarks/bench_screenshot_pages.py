@@ -0,0 +1,96 @@
+"""Screenshot gallery query latency as the table grows: keyset pages vs OFFSET pages.
+
+Seeds a scratch SQLite database with synthetic Screenshot rows in steps (e.g. 10k, 100k, 1M)
+and at every size times the first page, a page deep into the history, a camera-filtered
+page and a time-window page. Keyset latency should stay flat while OFFSET grows with depth.
+"""
+
+import argparse
+import datetime
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from benchmarks.common import setup_django
+
+
+def timed(query, repeat):
+    """Median milliseconds of `repeat` runs of `query`."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        query()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def seed(cursor, start, count, cameras, origin):
+    """Insert rows `start`..`start + count` one second apart, spread over `cameras` cameras."""
+    from django.db import connection
+
+    rng = random.Random(start)
+    batch = []
+    for i in range(start, start + count):
+        timestamp = origin + datetime.timedelta(seconds=i)
+        # Stored the way Django stores the field, so ORM comparisons match the seeded rows
+        batch.append((rng.randrange(cameras), connection.ops.adapt_datetimefield_value(timestamp), f"camera_screenshot_{i}.jpg"))
+        if len(batch) == 10000:
+            cursor.executemany("INSERT INTO stream_screenshot (camera_id, timestamp, file_path) VALUES (%s, %s, %s)", batch)
+            batch = []
+    if batch:
+        cursor.executemany("INSERT INTO stream_screenshot (camera_id, timestamp, file_path) VALUES (%s, %s, %s)", batch)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="table sizes to measure at, comma separated")
+    parser.add_argument("--cameras", type=int, default=16)
+    parser.add_argument("--page-size", type=int, default=24)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    database = os.path.join(tempfile.mkdtemp(), "bench.sqlite3")
+    setup_django(database)
+    from django.core.management import call_command
+    from django.db import connection, transaction
+    from django.utils import timezone
+    from stream.models import Screenshot
+    from stream.screenshots import encode_cursor, filter_screenshots, keyset_page
+
+    call_command("migrate", "stream", verbosity=0)
+    origin = timezone.now() - datetime.timedelta(seconds=max(sizes))
+
+    print(f"{'rows':>9} {'first':>8} {'deep keyset':>12} {'deep OFFSET':>12} {'camera':>8} {'window':>8}  (ms)")
+    seeded = 0
+    for size in sizes:
+        with transaction.atomic(), connection.cursor() as cursor:
+            seed(cursor, seeded, size - seeded, args.cameras, origin)
+        seeded = size
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+        everything = Screenshot.objects.all()
+        # Cursor of a page 90% of the way into the history, as if the user kept clicking "Older"
+        deep_row = everything.order_by("-timestamp", "-id")[int(size * 0.9)]
+        deep_cursor = encode_cursor(deep_row)
+        deep_offset = int(size * 0.9)
+        window = {"since": (origin + datetime.timedelta(seconds=size // 2)).isoformat()}
+        window["until"] = (origin + datetime.timedelta(seconds=size // 2 + 3600)).isoformat()
+
+        first = timed(lambda: keyset_page(everything, None, args.page_size), args.repeat)
+        deep = timed(lambda: keyset_page(everything, deep_cursor, args.page_size), args.repeat)
+        offset = timed(
+            lambda: list(everything.order_by("-timestamp", "-id")[deep_offset:deep_offset + args.page_size]), args.repeat
+        )
+        camera = timed(lambda: keyset_page(filter_screenshots({"camera": "3"}), None, args.page_size), args.repeat)
+        windowed = timed(lambda: keyset_page(filter_screenshots(window), None, args.page_size), args.repeat)
+        print(f"{size:>9} {first:>8.2f} {deep:>12.2f} {offset:>12.2f} {camera:>8.2f} {windowed:>8.2f}")
+
+    os.remove(database)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""Helpers shared by the benchmark scripts.
+
+Run the scripts from the project root, e.g. `python -m benchmarks.bench_cascade`.
+"""
+
+import os
+import time
+
+
+def setup_django(database=None):
+    """Configure Django the same way manage.py does, so benchmarks can use the stream app.
+
+    Pass a path to `database` to run against a scratch SQLite file instead of db.sqlite3.
+    """
+    import django
+    from django.conf import settings
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "cameraAdmin.settings")
+    if database is not None:
+        settings.DATABASES["default"]["NAME"] = database  # Connections are opened lazily, after this
+    django.setup()
+
+
+def synthetic_frames(count, width=640, height=480, seed=0):
+    """Yield `count` BGR frames with a bright square moving across a noisy background."""
+    from stream.sources import SyntheticSource
+
+    source = SyntheticSource(width, height, fps=None, seed=seed)
+    for i in range(count):
+        yield source.frame(i)
+
+
+def measure_fps(process, frames):
+    """Run `process` over every frame and return frames per second."""
+    frames = list(frames)
+    start = time.perf_counter()
+    for frame in frames:
+        process(frame)
+    return len(frames) / (time.perf_counter() - start)
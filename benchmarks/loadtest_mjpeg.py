@@ -0,0 +1,108 @@
+"""Open N simulated MJPEG viewers against a running server and report per-client frame rate and memory.
+
+Example, with the server started via `uvicorn cameraAdmin.asgi:application --port 8000`:
+
+    python -m benchmarks.loadtest_mjpeg --clients 200 --duration 30 --path /async/video_feed/0/?profile=thumb --pid 1234
+
+Only the standard library is used, so the harness can run on any box that can reach the server.
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+BOUNDARY = b"--frame\r\n"
+
+
+def rss_mb(pid):
+    """Resident memory of a process in MiB, read from /proc (Linux only)."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+async def viewer(host, port, path, deadline, results, index):
+    """One MJPEG client: send a GET and count multipart boundaries until the deadline."""
+    frames = 0
+    received = 0
+    error = None
+    started = time.monotonic()
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n".encode())
+        await writer.drain()
+        tail = b""
+        while time.monotonic() < deadline:
+            try:
+                data = await asyncio.wait_for(reader.read(65536), deadline - time.monotonic())
+            except asyncio.TimeoutError:
+                break
+            if not data:
+                error = "connection closed by server"
+                break
+            received += len(data)
+            # A boundary can be split across two reads, so search the end of the previous chunk too
+            window = tail + data
+            frames += window.count(BOUNDARY)
+            tail = window[-(len(BOUNDARY) - 1):]
+        writer.close()
+    except OSError as e:
+        error = str(e)
+    elapsed = max(time.monotonic() - started, 1e-9)
+    results[index] = {"frames": frames, "fps": frames / elapsed, "bytes": received, "error": error}
+
+
+async def run(args):
+    results = [None] * args.clients
+    memory_before = rss_mb(args.pid) if args.pid else None
+    deadline = time.monotonic() + args.ramp + args.duration
+    tasks = []
+    for index in range(args.clients):
+        tasks.append(asyncio.create_task(viewer(args.host, args.port, args.path, deadline, results, index)))
+        if args.ramp:
+            await asyncio.sleep(args.ramp / args.clients)
+    memory_peak = memory_before
+    while not all(task.done() for task in tasks):
+        await asyncio.sleep(1)
+        if args.pid:
+            current = rss_mb(args.pid)
+            if current is not None and (memory_peak is None or current > memory_peak):
+                memory_peak = current
+    return results, memory_before, memory_peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--path", default="/async/video_feed/0/?profile=thumb")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=20, help="seconds every client stays connected after the ramp")
+    parser.add_argument("--ramp", type=float, default=5, help="seconds over which clients connect")
+    parser.add_argument("--pid", type=int, help="server process id, to report its memory")
+    args = parser.parse_args()
+
+    results, memory_before, memory_peak = asyncio.run(run(args))
+    failed = [r for r in results if r["error"]]
+    rates = sorted(r["fps"] for r in results if not r["error"])
+    print(f"{args.clients} clients on {args.path}, {len(failed)} failed")
+    if rates:
+        print(
+            f"per-client fps: min {rates[0]:.1f}  median {statistics.median(rates):.1f}  "
+            f"max {rates[-1]:.1f}  total {sum(rates):.1f}"
+        )
+        print(f"received {sum(r['bytes'] for r in results) / 2**20:.1f} MiB")
+    for error in sorted({r["error"] for r in failed}):
+        print(f"error: {error}")
+    if memory_before is not None:
+        print(f"server RSS: {memory_before:.1f} MiB before, {memory_peak:.1f} MiB peak")
+
+
+if __name__ == "__main__":
+    main()
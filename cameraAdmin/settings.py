@@ -88,6 +88,124 @@ DATABASES = {
 MEDIA_URL = "/media/"
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 
+# Stream pipeline
+# Where camera frames come from: "device" (the real cameras), "synthetic" (generated frames) or
+# "file" (a replayed video) to run and benchmark the pipeline without cameras. Options, e.g.
+# {"width": 1280, "height": 720, "fps": 15} for synthetic, {"path": "clip.avi", "fps": 30} for file
+STREAM_SOURCE = "device"
+STREAM_SOURCE_OPTIONS = {}
+# Haar cascades (file names from the cascades/ directory, without .xml) that run on every frame
+STREAM_CASCADES = ["haarcascade_frontalcatface"]
+# Detector backend of every camera, "cascade" (the Haar cascades above) or "dnn" (an OpenCV dnn network on the
+# CPU, configured by STREAM_DNN); STREAM_CAMERA_DETECTORS picks the backend per camera id
+STREAM_DETECTOR = "cascade"
+STREAM_CAMERA_DETECTORS = {}
+# The dnn backend: an SSD-style network (e.g. MobileNet-SSD) loaded with cv2.dnn.readNet. Frames of all dnn
+# cameras arriving within max_wait seconds are batched into one forward pass of up to max_batch frames.
+# classes lists the class ids that count as cats (8 in the VOC MobileNet-SSD), None for every class
+STREAM_DNN = {
+    "model": None,
+    "config": None,
+    "input_size": (300, 300),
+    "scale": 1 / 127.5,
+    "mean": (127.5, 127.5, 127.5),
+    "swap_rb": False,
+    "classes": [8],
+    "confidence": 0.5,
+    "max_batch": 8,
+    "max_wait": 0.01,
+}
+# Full detection runs every N frames, or every N milliseconds if STREAM_DETECT_EVERY_MS is set;
+# the frames in between reuse the last known boxes
+STREAM_DETECT_EVERY_N_FRAMES = 3
+STREAM_DETECT_EVERY_MS = None
+# Detection runs on a frame downscaled by this factor, boxes are scaled back to full size
+STREAM_DETECT_SCALE = 0.5
+# Stretch the detection interval when a detection pass takes more than this share of a camera's frame time
+STREAM_DETECT_ADAPTIVE = True
+STREAM_DETECT_CPU_BUDGET = 0.5
+STREAM_DETECT_MAX_EVERY_N_FRAMES = 30
+# Run detection in this many worker processes fed through shared memory, so cameras use every core;
+# 0 runs it in each camera's capture thread, None starts one process per core
+STREAM_DETECT_PROCESSES = 0
+# Interpreter the detector processes run with; None uses sys.executable, which under uWSGI is the uwsgi
+# binary, so set it there (the virtualenv's bin/python). If they don't start within
+# STREAM_DETECT_START_TIMEOUT seconds, the error is logged and detection stays in the capture threads
+STREAM_DETECT_PYTHON = None
+STREAM_DETECT_START_TIMEOUT = 30
+# Central detection scheduler: this many threads detect for all cameras, fairly ("round_robin") or
+# highest STREAM_DETECT_PRIORITIES first ("priority"), each camera at most at its target fps; a camera
+# that can't get a thread in time sheds its older frame. 0 keeps detection in each camera's capture loop
+STREAM_DETECT_SCHEDULER_THREADS = 0
+STREAM_DETECT_SCHEDULER_POLICY = "round_robin"
+STREAM_DETECT_TARGET_FPS = 5
+STREAM_DETECT_CAMERA_FPS = {}  # Camera id -> target detection fps
+STREAM_DETECT_PRIORITIES = {}  # Camera id -> priority, higher goes first
+# Size/quality profiles for /video_feed/<id>/?profile=...; width=None keeps the captured resolution.
+# The dashboard grid uses "thumb" and switches a camera to "full" when it is focused
+STREAM_PROFILES = {
+    "full": {"width": None, "quality": 90},
+    "thumb": {"width": 480, "quality": 70},
+}
+# Seconds of processed frames every camera keeps in memory for clip exports ("Save Clip"); 0 turns it off.
+# Frames are raw images: 5 s of 640x480 at 30 fps is about 140 MB per camera, so it is off by default and
+# capped at STREAM_HISTORY_MAX_BYTES per camera (None for no cap) when on
+STREAM_HISTORY_SECONDS = 0
+STREAM_HISTORY_MAX_BYTES = 64 * 1024 * 1024
+# Motion gate: frames of a static scene skip detection and encoding. A frame moves when this share
+# of its pixels changed (see "motion" in /stream_stats/ to tune it); while nothing moves the last
+# frame is resent every STREAM_MOTION_KEEPALIVE seconds, which must stay below the 5 s viewer timeout
+STREAM_MOTION_GATE = True
+STREAM_MOTION_THRESHOLD = 0.01
+STREAM_MOTION_KEEPALIVE = 1.0
+# Screenshots are saved by a background writer: at most this many can wait in its queue,
+# and their database rows are inserted this many at a time
+STREAM_SCREENSHOT_QUEUE_SIZE = 100
+STREAM_SCREENSHOT_BATCH_SIZE = 20
+# Skip storing a screenshot whose perceptual hash (dHash, 64 bits) differs from the camera's previous saved
+# one in at most this many bits, e.g. 4; None stores every screenshot
+STREAM_SCREENSHOT_DEDUP_DISTANCE = None
+# Screenshot storage limits, oldest deleted first: max_age_days, max_count and max_bytes per camera, None for
+# no limit. STREAM_RETENTION applies to every camera, STREAM_RETENTION_CAMERAS overrides it per camera id.
+# Enforced every STREAM_RETENTION_INTERVAL seconds in the background (0 = only by manage.py enforce_retention)
+STREAM_RETENTION = {"max_age_days": None, "max_count": None, "max_bytes": None}
+STREAM_RETENTION_CAMERAS = {}
+STREAM_RETENTION_INTERVAL = 3600
+STREAM_RETENTION_BATCH_SIZE = 500
+# Every box a detection pass finds is stored in the Detection table, written in batches in the background;
+# when the database falls behind by this many passes, further ones are dropped
+STREAM_RECORD_DETECTIONS = True
+STREAM_DETECTION_QUEUE_SIZE = 1000
+# Save a screenshot automatically when cats appear after STREAM_AUTO_SCREENSHOT_GAP seconds without any,
+# at most one per camera every STREAM_AUTO_SCREENSHOT_INTERVAL seconds
+STREAM_AUTO_SCREENSHOT = False
+STREAM_AUTO_SCREENSHOT_GAP = 30
+STREAM_AUTO_SCREENSHOT_INTERVAL = 60
+# Continuous recording (started per camera with POST /recording/<id>/start/): frames are written at up to
+# STREAM_RECORD_FPS in the STREAM_RECORD_PROFILE quality, into segments of STREAM_RECORD_SEGMENT_SECONDS under
+# MEDIA_ROOT/recordings; when the disk falls behind by STREAM_RECORD_QUEUE_SIZE frames, further ones are dropped
+STREAM_RECORD_FPS = 10
+STREAM_RECORD_PROFILE = "full"
+STREAM_RECORD_SEGMENT_SECONDS = 60
+STREAM_RECORD_QUEUE_SIZE = 500
+# A recorded camera whose device fails is reopened after STREAM_RECORD_RESTART_SECONDS, and keeps recording
+STREAM_RECORD_RESTART_SECONDS = 5
+# Connected cameras are probed at most once per TTL (seconds), refreshed in the background;
+# a device that doesn't answer within the probe timeout is treated as absent
+STREAM_DISCOVERY_TTL = 60
+STREAM_DISCOVERY_PROBE_TIMEOUT = 2
+# Gallery thumbnails, cached under MEDIA_ROOT/thumbnails
+STREAM_THUMBNAIL_WIDTH = 320
+STREAM_THUMBNAIL_QUALITY = 80
+# Use the async feed (/async/video_feed/<id>/) on the dashboard; only enable when served through ASGI
+STREAM_ASYNC_FEED = False
+# Threads for the blocking OpenCV calls of the async feed
+STREAM_ASYNC_EXECUTOR_WORKERS = 4
+# A camera stays open this many seconds after its last viewer leaves, so coming back to it is instant
+STREAM_CAMERA_GRACE_SECONDS = 10
+# Per-stage timings, per-camera frame counts and latency, and view timings at /metrics (Prometheus format)
+STREAM_METRICS = True
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
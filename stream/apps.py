@@ -4,3 +4,14 @@ from django.apps import AppConfig
 class StreamConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "stream"
+
+    def ready(self):
+        # Load and validate the Haar cascades once at startup instead of on the first frame
+        from .detection import get_active_cascades
+
+        get_active_cascades()
+
+        # Screenshot storage limits are enforced in the background, the first time one interval after startup
+        from .retention import start_retention
+
+        start_retention()
@@ -0,0 +1,386 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+
+import cv2
+
+from .metrics import DELIVERED_FRAMES, DROPPED_FRAMES, FRAMES, STAGE_SECONDS
+
+# How long a viewer waits for the next frame before giving up on a stalled camera
+FRAME_TIMEOUT = 5.0
+
+# Every part of the multipart/x-mixed-replace stream starts with this
+MULTIPART_HEADER = b"--frame\r\n" b"Content-Type: image/jpeg\r\n\r\n"
+
+
+class Frame:
+    """A processed frame published by a capture worker."""
+
+    __slots__ = ("seq", "image", "boxes", "timestamp")
+
+    def __init__(self, seq, image, boxes, timestamp):
+        self.seq = seq  # Increases by one for every frame the worker publishes
+        self.image = image  # Frame with detections already drawn, shared by all viewers (do not modify)
+        self.boxes = boxes
+        self.timestamp = timestamp
+
+
+# Size and quality profiles a feed can be requested in. width=None keeps the captured resolution,
+# quality is the JPEG quality (0-100, OpenCV's default is 95)
+DEFAULT_PROFILES = {
+    "full": {"width": None, "quality": 90},
+    "thumb": {"width": 480, "quality": 70},
+}
+
+
+def resize_to_width(image, width):
+    """Downscale the image to `width` keeping its aspect ratio; smaller images are returned as is."""
+    height, current = image.shape[:2]
+    if not width or width >= current:
+        return image
+    return cv2.resize(image, (width, max(1, round(height * width / current))), interpolation=cv2.INTER_AREA)
+
+
+def encode_multipart(image, width=None, quality=None):
+    """Encode a frame to JPEG and wrap it into a ready-to-send multipart chunk."""
+    params = [cv2.IMWRITE_JPEG_QUALITY, quality] if quality is not None else []
+    success, buffer = cv2.imencode(".jpg", resize_to_width(image, width), params)
+    if not success:
+        return None
+    # join copies the JPEG straight from the numpy buffer, once
+    return b"".join((MULTIPART_HEADER, buffer, b"\r\n"))
+
+
+class EncodedFrameCache:
+    """Multipart chunks of a camera's most recent frames, keyed by profile and frame sequence number.
+
+    The first viewer that needs a frame in a given profile encodes it, every other viewer
+    of that profile streams the same bytes object, so encoding costs the same for one
+    viewer or fifty.
+    """
+
+    def __init__(self, profiles=None, size=2):
+        self.profiles = profiles or DEFAULT_PROFILES
+        self.size = size  # Only the newest frames are ever requested, older ones are dropped
+        self.encodes = 0
+        self.hits = 0
+        self._lock = threading.Lock()
+        self._chunks = {name: OrderedDict() for name in self.profiles}  # Profile -> frame seq -> chunk
+
+    def peek(self, frame, profile="full"):
+        """Return the chunk if it is already encoded, without ever waiting for an encode.
+
+        Used from the event loop, where blocking on another viewer's encode would stall every
+        other connection; a miss means the caller should encode via get() off the loop.
+        """
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            chunk = self._chunks[profile].get(frame.seq)
+            if chunk is not None:
+                self.hits += 1
+            return chunk
+        finally:
+            self._lock.release()
+
+    def get(self, frame, profile="full"):
+        """Return the multipart chunk for `frame` in `profile`, encoding it if no viewer did yet."""
+        with self._lock:  # Concurrent viewers of a new frame wait for one encode instead of each doing their own
+            chunks = self._chunks[profile]
+            chunk = chunks.get(frame.seq)
+            if chunk is not None:
+                self.hits += 1
+                return chunk
+            options = self.profiles[profile]
+            started = time.perf_counter()
+            chunk = encode_multipart(frame.image, options.get("width"), options.get("quality"))
+            STAGE_SECONDS.observe(time.perf_counter() - started, "encode")
+            self.encodes += 1
+            if chunk is not None:
+                chunks[frame.seq] = chunk
+                while len(chunks) > self.size:
+                    chunks.popitem(last=False)
+            return chunk
+
+    def repeat(self, frame, previous):
+        """Serve `frame` with the chunks already encoded for `previous`, which has the same image."""
+        with self._lock:
+            for chunks in self._chunks.values():
+                chunk = chunks.get(previous.seq)
+                if chunk is not None:
+                    chunks[frame.seq] = chunk
+                    while len(chunks) > self.size:
+                        chunks.popitem(last=False)
+
+
+class FrameHistory:
+    """Ring buffer of a camera's recently processed frames and their detections.
+
+    Frames are kept by reference (no copies) for the last `seconds`, capped at `max_frames`
+    and at `max_bytes` of images, so clip exports are served from memory without reading
+    the device or running detection again. The frames are raw images, which is a lot of
+    memory (5 s of 640x480 at 30 fps is about 140 MB), so with `seconds` at 0 nothing is kept.
+    """
+
+    def __init__(self, seconds=0.0, max_frames=300, max_bytes=None):
+        self.seconds = seconds
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._frames = deque()
+        self._lock = threading.Lock()
+
+    def append(self, frame):
+        if not self.seconds:
+            return
+        with self._lock:
+            self._frames.append(frame)
+            # A keepalive frame shares the previous image but is counted again; they come once a second at most
+            self.bytes += getattr(frame.image, "nbytes", 0)
+            while self._frames and (
+                frame.timestamp - self._frames[0].timestamp > self.seconds
+                or len(self._frames) > self.max_frames
+                or (self.max_bytes is not None and self.bytes > self.max_bytes)
+            ):
+                self.bytes -= getattr(self._frames.popleft().image, "nbytes", 0)
+
+    def last(self, seconds=None):
+        """Frames from the last `seconds` (all buffered frames if None), oldest first."""
+        with self._lock:
+            frames = list(self._frames)
+        if seconds is None or not frames:
+            return frames
+        since = frames[-1].timestamp - seconds
+        return [frame for frame in frames if frame.timestamp >= since]
+
+    def __len__(self):
+        return len(self._frames)
+
+
+class Subscription:
+    """One viewer's mailbox on a capture worker.
+
+    The mailbox holds a single slot: the newest frame the viewer hasn't taken yet. Frames
+    published while the viewer is busy or held back by its fps cap replace each other in
+    that slot and are counted as dropped, so a slow or rate-limited viewer never delays
+    capture or other viewers. The slot is the worker's latest frame itself, compared by
+    sequence number, so publishing a frame costs nothing per subscriber.
+    """
+
+    def __init__(self, worker, max_fps=None):
+        self.worker = worker
+        self.max_fps = max_fps
+        self.min_interval = 1 / max_fps if max_fps else 0.0
+        self.delivered = 0
+        self.dropped = 0
+        self.last_seq = 0
+        self._next_at = 0.0  # Earliest time the fps cap lets the next frame out
+
+    def _take(self, frame):
+        if frame is None:
+            return None
+        if self.last_seq:
+            dropped = frame.seq - self.last_seq - 1
+            if dropped:
+                self.dropped += dropped
+                DROPPED_FRAMES.inc(self.worker.device_id, amount=dropped)
+        self.last_seq = frame.seq
+        self.delivered += 1
+        DELIVERED_FRAMES.inc(self.worker.device_id)
+        self._next_at = time.monotonic() + self.min_interval
+        return frame
+
+    def get(self, timeout=FRAME_TIMEOUT):
+        """Block until the next frame is allowed out and return the newest one (None if the worker stopped)."""
+        delay = self._next_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        return self._take(self.worker.wait_for_frame(self.last_seq, timeout))
+
+    async def get_async(self, timeout=FRAME_TIMEOUT):
+        """Async version of get."""
+        delay = self._next_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return self._take(await self.worker.wait_for_frame_async(self.last_seq, timeout))
+
+    def close(self):
+        self.worker.unsubscribe(self)
+
+    def stats(self):
+        return {"max_fps": self.max_fps, "delivered": self.delivered, "dropped": self.dropped}
+
+
+class CaptureWorker(threading.Thread):
+    """Own one cv2.VideoCapture, read it at the device rate and publish the latest processed frame.
+
+    Any number of viewers can wait on the worker; each frame is read and processed
+    once no matter how many of them there are. With a `motion` gate, frames of a static
+    scene are dropped right after the read: no detection, no encoding, no wake-ups. The
+    last frame is republished every `motion.keepalive` seconds, reusing its encoded JPEG.
+    Recorders added with add_recorder get every published frame right after the viewers,
+    and their worker_stopped(worker), if they have one, once the capture loop ends.
+    """
+
+    def __init__(self, device_id, capture, process=None, profiles=None, history_seconds=0.0, history_max_bytes=None, motion=None):
+        super().__init__(name=f"capture-{device_id}", daemon=True)
+        self.device_id = device_id
+        self.capture = capture
+        self.process = process  # Called once per frame, draws on it and returns the detected boxes
+        self.encoded = EncodedFrameCache(profiles)
+        self.history = FrameHistory(history_seconds, max_bytes=history_max_bytes)
+        self.motion = motion  # MotionGate, or None to process every frame
+        self.static_skipped = 0  # Static frames dropped by the motion gate
+        self._condition = threading.Condition()
+        self._latest = None
+        self._running = True
+        self._async_waiters = {}  # Event loop -> asyncio.Events of the async viewers waiting on it
+        self._subscriptions = set()
+        self._recorders = ()  # Replaced, never modified, so the capture loop reads it without the lock
+
+    @property
+    def running(self):
+        return self._running
+
+    @property
+    def viewer_count(self):
+        return len(self._subscriptions)
+
+    @property
+    def latest(self):
+        """The most recently published frame, or None if nothing was read yet."""
+        return self._latest
+
+    def run(self):
+        seq = 0
+        try:
+            while self._running:
+                started = time.perf_counter()
+                success, image = self.capture.read()
+                STAGE_SECONDS.observe(time.perf_counter() - started, "read")
+                if not success:  # Device is gone or was never opened
+                    break
+                FRAMES.inc(self.device_id)
+                now = time.time()
+                if self.motion is not None:
+                    started = time.perf_counter()
+                    moving = self.motion.update(image, now)
+                    STAGE_SECONDS.observe(time.perf_counter() - started, "motion")
+                if self.motion is not None and not moving:
+                    latest = self._latest
+                    if latest is not None and hasattr(self.process, "carry_over"):
+                        self.process.carry_over(latest)  # Nothing changed, the last detections still stand
+                    if latest is None or now - latest.timestamp < self.motion.keepalive:
+                        self.static_skipped += 1
+                        continue
+                    # Nothing changed, so the keepalive frame is the previous one again, already encoded
+                    seq += 1
+                    frame = Frame(seq, latest.image, latest.boxes, now)
+                    self.encoded.repeat(frame, latest)
+                else:
+                    boxes = self.process(image) if self.process is not None else ()
+                    seq += 1
+                    frame = Frame(seq, image, boxes, now)
+                self.history.append(frame)
+                with self._condition:
+                    self._latest = frame
+                    self._notify()
+                for recorder in self._recorders:
+                    recorder(frame)
+        finally:
+            with self._condition:
+                self._running = False
+                self._notify()  # Wake up viewers so they can finish their responses
+            # The capture is only ever touched from this thread, so release it here
+            self.capture.release()
+            if hasattr(self.process, "close"):
+                self.process.close()
+            for recorder in self._recorders:  # Still attached, so the device died rather than being closed
+                if hasattr(recorder, "worker_stopped"):
+                    recorder.worker_stopped(self)
+
+    def _notify(self):
+        """Wake up every waiting viewer; must be called with the condition held."""
+        self._condition.notify_all()
+        # One callback per event loop, however many async viewers wait on it
+        for loop, events in self._async_waiters.items():
+            try:
+                loop.call_soon_threadsafe(_set_all, events)
+            except RuntimeError:  # The loop was closed while its viewers were waiting
+                pass
+        self._async_waiters = {}
+
+    def _newer(self, after_seq):
+        """The latest frame if it is newer than `after_seq`, else None."""
+        if self._latest is not None and self._latest.seq > after_seq:
+            return self._latest
+        return None
+
+    async def wait_for_frame_async(self, after_seq=0, timeout=FRAME_TIMEOUT):
+        """Async version of wait_for_frame that waits on the event loop instead of blocking a thread."""
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        with self._condition:
+            frame = self._newer(after_seq)
+            if frame is not None or not self._running:
+                return frame
+            self._async_waiters.setdefault(loop, []).append(event)
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        with self._condition:
+            waiters = self._async_waiters.get(loop)
+            if waiters is not None and event in waiters:
+                waiters.remove(event)
+            return self._newer(after_seq)
+
+    def wait_for_frame(self, after_seq=0, timeout=FRAME_TIMEOUT):
+        """Block until a frame newer than `after_seq` is published.
+
+        Returns None if the worker stopped or nothing arrived within `timeout` seconds.
+        Frames published while the caller was busy are skipped, so a slow viewer only
+        ever gets the latest one and never holds up the capture loop.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: not self._running or self._newer(after_seq) is not None, timeout)
+            return self._newer(after_seq)
+
+    def subscribe(self, max_fps=None):
+        """Register a viewer and return its Subscription; optionally cap its frame rate."""
+        subscription = Subscription(self, max_fps)
+        with self._condition:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._condition:
+            self._subscriptions.discard(subscription)
+
+    def add_recorder(self, recorder):
+        """Call `recorder` with every published frame, in the capture thread."""
+        with self._condition:
+            self._recorders = self._recorders + (recorder,)
+
+    def remove_recorder(self, recorder):
+        with self._condition:
+            self._recorders = tuple(r for r in self._recorders if r is not recorder)
+
+    def subscription_stats(self):
+        """Delivered and dropped frame counts of every current viewer."""
+        with self._condition:
+            return [subscription.stats() for subscription in self._subscriptions]
+
+    def stop(self, timeout=FRAME_TIMEOUT):
+        """Ask the capture loop to finish; the device is released by the worker itself."""
+        with self._condition:
+            self._running = False
+            self._notify()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join(timeout)
+
+
+def _set_all(events):
+    for event in events:
+        event.set()
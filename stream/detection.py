@@ -0,0 +1,185 @@
+import glob
+import math
+import os
+import threading
+import time
+
+import cv2
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .metrics import STAGE_SECONDS
+
+# Parameters passed to detectMultiScale for every cascade
+DETECT_PARAMS = {"scaleFactor": 1.1, "minNeighbors": 5, "minSize": (75, 75)}
+
+
+def _build_classifier(xml):
+    """Build a classifier from cascade XML already held in memory, without touching the disk."""
+    storage = cv2.FileStorage(xml, cv2.FILE_STORAGE_READ | cv2.FILE_STORAGE_MEMORY)
+    classifier = cv2.CascadeClassifier()
+    classifier.read(storage.getFirstTopLevelNode())
+    storage.release()
+    return classifier
+
+
+class CascadePool:
+    """Haar cascades loaded once from a directory, handed out as one classifier per thread.
+
+    The XML files are read and validated when the pool is created. detectMultiScale is not
+    safe to call on the same classifier from several threads, so every thread gets its own
+    copy, built from the in-memory XML the first time that thread asks for it.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._sources = {}  # Cascade name (file name without .xml) -> XML text
+        for path in sorted(glob.glob(os.path.join(directory, "*.xml"))):
+            name = os.path.splitext(os.path.basename(path))[0]
+            with open(path, encoding="utf-8") as f:
+                xml = f.read()
+            try:
+                empty = _build_classifier(xml).empty()
+            except cv2.error:
+                empty = True
+            if empty:
+                raise ImproperlyConfigured(f"Error loading cascade '{name}'. Check the file at {path}")
+            self._sources[name] = xml
+        if not self._sources:
+            raise ImproperlyConfigured(f"No cascade files found in {directory}")
+        self._local = threading.local()
+
+    @property
+    def names(self):
+        return list(self._sources)
+
+    def get(self, name):
+        """Return the calling thread's classifier for the named cascade."""
+        classifiers = getattr(self._local, "classifiers", None)
+        if classifiers is None:
+            classifiers = self._local.classifiers = {}
+        classifier = classifiers.get(name)
+        if classifier is None:
+            if name not in self._sources:
+                raise KeyError(f"Unknown cascade '{name}', available: {', '.join(self._sources)}")
+            started = time.perf_counter()
+            classifier = classifiers[name] = _build_classifier(self._sources[name])
+            STAGE_SECONDS.observe(time.perf_counter() - started, "cascade_load")
+        return classifier
+
+    def detect(self, gray_frame, name, **params):
+        """Run the named cascade over a grayscale frame; `params` override DETECT_PARAMS."""
+        return self.get(name).detectMultiScale(gray_frame, **{**DETECT_PARAMS, **params})
+
+    def detect_all(self, gray_frame, names, **params):
+        """Run several cascades over the same frame and return all their boxes as (x, y, w, h) tuples."""
+        return [tuple(box) for name in names for box in self.detect(gray_frame, name, **params)]
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_cascade_pool():
+    """Return the process-wide cascade pool, loading it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = CascadePool(os.path.join(settings.BASE_DIR, "cascades"))
+    return _pool
+
+
+def get_active_cascades():
+    """Names of the cascades that run on every frame, validated against the pool."""
+    pool = get_cascade_pool()
+    names = getattr(settings, "STREAM_CASCADES", None) or pool.names
+    unknown = [name for name in names if name not in pool.names]
+    if unknown:
+        raise ImproperlyConfigured(f"STREAM_CASCADES lists unknown cascades: {', '.join(unknown)}")
+    return names
+
+
+class DetectionCadence:
+    """Decide which frames of one camera get a full detection pass.
+
+    Detection runs every `every_n_frames` frames, or every `every_ms` milliseconds when
+    that is set. With `adaptive` on, the measured cost of a detection pass stretches the
+    interval so detection takes at most `cpu_budget` of the camera's frame time, up to
+    `max_every_n_frames`; when the box has spare time again the interval shrinks back.
+    """
+
+    def __init__(self, every_n_frames=3, every_ms=None, adaptive=True, cpu_budget=0.5, max_every_n_frames=30):
+        self.every_n_frames = max(1, every_n_frames)
+        self.every_ms = every_ms
+        self.adaptive = adaptive
+        self.cpu_budget = cpu_budget
+        self.max_every_n_frames = max(self.every_n_frames, max_every_n_frames)
+        self.interval_frames = self.every_n_frames
+        self.interval_ms = every_ms
+        self.detect_ms = None  # Moving average of a detection pass
+        self.frame_ms = None  # Moving average of the time between frames
+        self.detections = 0
+        self.frames = 0
+        self._frames_since = None  # None until the first detection, so the first frame is always analysed
+        self._last_detection = 0.0
+        self._last_frame = None
+
+    def due(self, now=None):
+        """Count a new frame and return True if it should get a detection pass."""
+        now = time.perf_counter() if now is None else now
+        if self._last_frame is not None:
+            self.frame_ms = _average(self.frame_ms, (now - self._last_frame) * 1000)
+        self._last_frame = now
+        self.frames += 1
+        if self._frames_since is None:
+            return True
+        self._frames_since += 1
+        if self.interval_ms is not None:
+            return (now - self._last_detection) * 1000 >= self.interval_ms
+        return self._frames_since >= self.interval_frames
+
+    def record(self, elapsed, now=None):
+        """Record a detection pass that took `elapsed` seconds and adapt the interval."""
+        self._frames_since = 0
+        self._last_detection = time.perf_counter() if now is None else now
+        self.detections += 1
+        self.detect_ms = _average(self.detect_ms, elapsed * 1000)
+        if not self.adaptive:
+            return
+        if self.every_ms is not None:
+            self.interval_ms = max(self.every_ms, self.detect_ms / self.cpu_budget)
+        elif self.frame_ms:
+            needed = math.ceil(self.detect_ms / (self.cpu_budget * self.frame_ms))
+            self.interval_frames = min(self.max_every_n_frames, max(self.every_n_frames, needed))
+
+    def stats(self):
+        return {
+            "interval_frames": self.interval_frames,
+            "interval_ms": self.interval_ms,
+            "detect_ms": self.detect_ms,
+            "frame_ms": self.frame_ms,
+            "detections": self.detections,
+            "frames": self.frames,
+        }
+
+
+def _average(current, sample, weight=0.2):
+    """Exponential moving average that starts from the first sample."""
+    return sample if current is None else current + weight * (sample - current)
+
+
+def detect_scaled(pool, gray_frame, names, scale=1.0):
+    """Run the cascades on a downscaled copy of the frame and map the boxes back to full size.
+
+    `pool` is anything with detect_all: the in-process CascadePool or a DetectionEngine.
+    """
+    params = {}
+    if scale != 1.0:
+        gray_frame = cv2.resize(gray_frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        min_w, min_h = DETECT_PARAMS["minSize"]
+        params["minSize"] = (max(1, round(min_w * scale)), max(1, round(min_h * scale)))
+    return [
+        (round(x / scale), round(y / scale), round(w / scale), round(h / scale))
+        for (x, y, w, h) in pool.detect_all(gray_frame, names, **params)
+    ]
@@ -0,0 +1,200 @@
+import atexit
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import cv2
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .detection import detect_scaled, get_active_cascades, get_cascade_pool
+from .engine import get_detection_engine
+from .metrics import STAGE_SECONDS
+
+# A detector backend has two steps. prepare(frame) runs in the camera's thread and turns the BGR frame
+# into what the backend needs, a copy the frame can be drawn on after. detect(prepared) returns the
+# boxes as (x, y, w, h) in frame coordinates, inline or in a detection scheduler thread.
+BACKENDS = ("cascade", "dnn")
+
+
+class CascadeDetector:
+    """Haar cascades on a downscaled grayscale frame, in this process or in the detection engine."""
+
+    name = "cascade"
+    prepare_stage = "gray"
+
+    def __init__(self, pool, cascades, scale=0.5):
+        self.pool = pool  # CascadePool, or the DetectionEngine when STREAM_DETECT_PROCESSES is set
+        self.cascades = cascades
+        self.scale = scale
+
+    def prepare(self, frame):
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+    def detect(self, gray_frame):
+        return detect_scaled(self.pool, gray_frame, self.cascades, self.scale)
+
+
+class DnnDetector:
+    """cv2.dnn network on the CPU that batches the frames of several cameras into one forward pass.
+
+    Cameras call detect() from their own threads. One inference thread takes the frames that
+    arrive within `max_wait` seconds of each other, up to `max_batch`, and runs them through
+    the network as a single blobFromImages blob: a pass over N frames costs much less than N
+    passes, so the cost per frame drops as more cameras detect at once. The network has to end
+    in an SSD DetectionOutput layer (rows of image, class, confidence, x1, y1, x2, y2, with
+    coordinates from 0 to 1), like the MobileNet-SSD models cv2.dnn.readNet loads.
+    """
+
+    name = "dnn"
+    prepare_stage = "resize"
+
+    def __init__(
+        self,
+        net,
+        input_size=(300, 300),
+        scale=1 / 127.5,
+        mean=(127.5, 127.5, 127.5),
+        swap_rb=False,
+        classes=None,
+        confidence=0.5,
+        max_batch=8,
+        max_wait=0.01,
+        timeout=5.0,
+    ):
+        self.net = net
+        self.input_size = tuple(input_size)
+        self.scale = scale
+        self.mean = tuple(mean)
+        self.swap_rb = swap_rb
+        self.classes = set(classes) if classes is not None else None  # Class ids that count, None for all
+        self.confidence = confidence
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self.batches = 0
+        self.frames = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="dnn-detector", daemon=True)
+        self._thread.start()
+
+    def prepare(self, frame):
+        """Resize to the network input in the camera's thread; the frame size is kept to scale the boxes back."""
+        return cv2.resize(frame, self.input_size, interpolation=cv2.INTER_AREA), frame.shape[:2]
+
+    def detect(self, prepared):
+        """Wait for the boxes of a prepared frame; raises TimeoutError if the network is too far behind."""
+        future = Future()
+        self._queue.put((prepared, future))
+        return future.result(self.timeout)
+
+    def _take_batch(self):
+        """Block for a frame, then gather the ones arriving within max_wait; None once closed."""
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)  # Finish this batch, stop on the next take
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+            futures = [future for _, future in batch]
+            try:
+                results = self.forward([image for (image, _), _ in batch], [size for (_, size), _ in batch])
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            for future, boxes in zip(futures, results):
+                future.set_result(boxes)
+
+    def forward(self, images, sizes):
+        """One forward pass over `images` (already at the input size); returns each image's boxes scaled to its (height, width)."""
+        blob = cv2.dnn.blobFromImages(images, self.scale, self.input_size, self.mean, self.swap_rb, crop=False)
+        started = time.perf_counter()
+        self.net.setInput(blob)
+        output = self.net.forward()
+        STAGE_SECONDS.observe(time.perf_counter() - started, "dnn_forward")
+        self.batches += 1
+        self.frames += len(images)
+
+        boxes = [[] for _ in images]
+        for image_id, class_id, confidence, x1, y1, x2, y2 in output.reshape(-1, 7).tolist():
+            image_id = int(image_id)
+            if not 0 <= image_id < len(images) or confidence < self.confidence:  # -1 pads unused rows
+                continue
+            if self.classes is not None and int(class_id) not in self.classes:
+                continue
+            height, width = sizes[image_id]
+            x1, x2 = max(0.0, x1) * width, min(1.0, x2) * width
+            y1, y2 = max(0.0, y1) * height, min(1.0, y2) * height
+            if x2 > x1 and y2 > y1:
+                boxes[image_id].append((round(x1), round(y1), round(x2 - x1), round(y2 - y1)))
+        return boxes
+
+    def stats(self):
+        return {"batches": self.batches, "frames": self.frames, "batch_size": self.frames / self.batches if self.batches else None}
+
+    def close(self, timeout=5):
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+
+_dnn = None
+_dnn_lock = threading.Lock()
+
+
+def get_dnn_detector():
+    """Return the process-wide DNN detector configured by STREAM_DNN, loading the network on first use.
+
+    Every camera on the dnn backend shares it, which is what lets their frames be batched.
+    """
+    global _dnn
+    if _dnn is None:
+        with _dnn_lock:
+            if _dnn is None:
+                options = dict(getattr(settings, "STREAM_DNN", {}))
+                model = options.pop("model", None)
+                config = options.pop("config", None)
+                if not model:
+                    raise ImproperlyConfigured("The dnn detector needs STREAM_DNN['model'], the network's weights file")
+                try:
+                    net = cv2.dnn.readNet(model, config or "")
+                except cv2.error as e:
+                    raise ImproperlyConfigured(f"Could not load the network {model}: {e}")
+                net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+                net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+                detector = DnnDetector(net, **options)
+                atexit.register(detector.close)
+                _dnn = detector
+    return _dnn
+
+
+def get_detector(camera_id=None):
+    """The detector backend of a camera: STREAM_CAMERA_DETECTORS[camera_id] if set, else STREAM_DETECTOR."""
+    name = getattr(settings, "STREAM_CAMERA_DETECTORS", {}).get(camera_id, getattr(settings, "STREAM_DETECTOR", "cascade"))
+    if name == "cascade":
+        # Cascades are loaded once at startup, only detection runs per frame: in the calling thread,
+        # or in the detector processes when STREAM_DETECT_PROCESSES is set
+        return CascadeDetector(
+            get_detection_engine() or get_cascade_pool(),
+            get_active_cascades(),
+            getattr(settings, "STREAM_DETECT_SCALE", 0.5),
+        )
+    if name == "dnn":
+        return get_dnn_detector()
+    raise ImproperlyConfigured(f"Unknown detector '{name}' for camera {camera_id}, expected one of: {', '.join(BACKENDS)}")
@@ -0,0 +1,91 @@
+import threading
+import time
+
+import cv2
+
+
+def probe_device(index):
+    """Return True if a camera answers at this device index."""
+    cap = cv2.VideoCapture(index, cv2.CAP_DSHOW)
+    try:
+        return cap.isOpened()
+    finally:
+        cap.release()
+
+
+class CameraDiscovery:
+    """Cached list of connected cameras, probed concurrently and refreshed in the background.
+
+    All device indices are probed at the same time, each on its own thread, and a probe that
+    doesn't answer within `probe_timeout` seconds counts as "no camera". Indices that are
+    already streaming (`in_use`) are reported as connected without being opened again.
+    The result is cached for `ttl` seconds; after that the cached list is still returned
+    right away while a background refresh probes again, so only the very first call waits.
+    """
+
+    def __init__(self, probe=probe_device, indices=range(10), ttl=60.0, probe_timeout=2.0, in_use=None):
+        self.probe = probe
+        self.indices = list(indices)
+        self.ttl = ttl
+        self.probe_timeout = probe_timeout
+        self.in_use = in_use or (lambda: ())
+        self.refreshes = 0
+        self._cameras = None
+        self._updated = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = None  # Thread of the running background refresh
+        self._hung = set()  # Indices whose last probe never returned, not probed again until it does
+
+    def cameras(self):
+        """Return the connected camera indices, from cache whenever there is one."""
+        if self._cameras is None:
+            return self.refresh()
+        if time.monotonic() - self._updated > self.ttl:
+            self.refresh(wait=False)
+        return self._cameras
+
+    def refresh(self, wait=True):
+        """Probe the devices again; with wait=False the probe runs in the background."""
+        with self._lock:
+            running = self._refreshing
+            if running is None:
+                running = self._refreshing = threading.Thread(target=self._refresh, name="camera-discovery", daemon=True)
+                running.start()
+        if wait:
+            running.join()
+        return self._cameras if self._cameras is not None else []
+
+    def _refresh(self):
+        try:
+            self._cameras = self._probe_all()
+            self._updated = time.monotonic()
+            self.refreshes += 1
+        finally:
+            with self._lock:
+                self._refreshing = None
+
+    def _probe_all(self):
+        in_use = set(self.in_use())
+        results = {}
+        threads = []
+        for index in self.indices:
+            if index in in_use or index in self._hung:
+                continue
+            thread = threading.Thread(target=self._probe_one, args=(index, results), daemon=True)
+            thread.start()
+            threads.append((index, thread))
+
+        deadline = time.monotonic() + self.probe_timeout
+        for index, thread in threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+            if thread.is_alive():
+                self._hung.add(index)  # Left running in the background, it clears itself once it returns
+        return sorted(index for index in self.indices if index in in_use or results.get(index))
+
+    def _probe_one(self, index, results):
+        try:
+            results[index] = self.probe(index)
+        except Exception:
+            results[index] = False
+        finally:
+            self._hung.discard(index)
@@ -0,0 +1,202 @@
+import atexit
+import itertools
+import logging
+import multiprocessing
+import multiprocessing.spawn
+import os
+import queue
+import sys
+import threading
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+from django.conf import settings
+
+from .detection import CascadePool
+
+logger = logging.getLogger(__name__)
+
+def _detector_main(directory, memory_name, slot_bytes, tasks, results, ready):
+    """Detector process: run the cascades over frames the capture threads put in shared memory."""
+    cv2.setNumThreads(1)  # The parallelism comes from the processes, OpenCV's own threads would only compete
+    pool = CascadePool(directory)
+    memory = shared_memory.SharedMemory(name=memory_name)  # Attached, the engine owns and unlinks the block
+    ready.release()
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            task_id, slot, shape, names, params = task
+            try:
+                gray_frame = np.ndarray(shape, dtype=np.uint8, buffer=memory.buf, offset=slot * slot_bytes)
+                boxes = np.array(pool.detect_all(gray_frame, names, **params), dtype=np.int32).reshape(-1, 4)
+                del gray_frame  # A view into the block must not outlive it
+                results.put((task_id, boxes, None))
+            except Exception as e:
+                results.put((task_id, None, repr(e)))
+    finally:
+        memory.close()
+
+
+class DetectionEngine:
+    """Run detectMultiScale in a pool of processes, so detection of many cameras uses every core.
+
+    Frames are not pickled: the caller copies its grayscale frame into one of `slots` slots
+    of a shared memory block and only the slot number goes through the task queue. The
+    detector process answers with an (N, 4) int32 array of boxes, and the slot is reused
+    once the answer is in. detect_all has the same signature as CascadePool.detect_all,
+    so the engine can stand in for the pool anywhere, e.g. in detect_scaled.
+
+    The processes are started with the `python` interpreter (sys.executable by default).
+    Under uWSGI sys.executable is the uwsgi binary, so there it has to be given explicitly
+    (or uWSGI run with py-sys-executable). RuntimeError is raised if the processes aren't
+    up within `start_timeout` seconds.
+    """
+
+    def __init__(self, directory, processes=None, slots=None, slot_bytes=1920 * 1080, timeout=5.0, python=None, start_timeout=30.0):
+        self.processes = processes or os.cpu_count() or 1
+        self.slots = slots or 2 * self.processes
+        self.slot_bytes = slot_bytes  # Largest grayscale frame a slot holds
+        self.timeout = timeout
+        self.submitted = 0
+        self.completed = 0
+        self.memory = shared_memory.SharedMemory(create=True, size=self.slots * self.slot_bytes)
+        # Spawn rather than fork: forking a process full of capture threads can deadlock the child
+        context = multiprocessing.get_context("spawn")
+        ready = context.Semaphore(0)
+        self._tasks = context.Queue()
+        self._results = context.Queue()
+        self._free = queue.Queue()
+        for slot in range(self.slots):
+            self._free.put(slot)
+        self._pending = {}  # Task id -> (Future, slot)
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._processes = [
+            context.Process(
+                target=_detector_main,
+                args=(directory, self.memory.name, self.slot_bytes, self._tasks, self._results, ready),
+                name=f"detector-{i}",
+                daemon=True,
+            )
+            for i in range(self.processes)
+        ]
+        # The interpreter setting is process-wide, so it only applies while the detectors start
+        previous = multiprocessing.spawn.get_executable()
+        context.set_executable(python or sys.executable)
+        try:
+            for process in self._processes:
+                process.start()
+        except Exception:
+            for process in self._processes:
+                if process.pid is not None:
+                    process.terminate()
+            self.memory.close()
+            self.memory.unlink()
+            raise
+        finally:
+            context.set_executable(previous)
+        self._collector = threading.Thread(target=self._collect, name="detection-results", daemon=True)
+        self._collector.start()
+        for _ in self._processes:
+            if not ready.acquire(timeout=start_timeout):
+                self.close(timeout=1)
+                raise RuntimeError(f"The detector processes did not start within {start_timeout} s using {python or sys.executable}")
+
+    def detect_all(self, gray_frame, names, **params):
+        """Detect in a detector process; only the calling thread waits, other cameras carry on.
+
+        Raises TimeoutError if no slot frees up or no answer comes within `timeout` seconds.
+        """
+        if gray_frame.dtype != np.uint8 or gray_frame.nbytes > self.slot_bytes:
+            raise ValueError(f"Expected a grayscale uint8 frame of at most {self.slot_bytes} bytes")
+        try:
+            slot = self._free.get(timeout=self.timeout)  # All slots busy means the detectors are behind
+        except queue.Empty:
+            raise TimeoutError("No free detection slot")
+        view = np.ndarray(gray_frame.shape, dtype=np.uint8, buffer=self.memory.buf, offset=slot * self.slot_bytes)
+        view[...] = gray_frame
+        del view
+        future = Future()
+        with self._lock:
+            task_id = next(self._ids)
+            self._pending[task_id] = (future, slot)
+            self.submitted += 1
+        self._tasks.put((task_id, slot, gray_frame.shape, list(names), params))
+        return future.result(self.timeout)
+
+    def _collect(self):
+        while True:
+            result = self._results.get()
+            if result is None:
+                return
+            task_id, boxes, error = result
+            with self._lock:
+                future, slot = self._pending.pop(task_id)
+                self.completed += 1
+            # The slot is only reused once its process is done with it, even if the caller gave up waiting
+            self._free.put(slot)
+            if error is not None:
+                future.set_exception(RuntimeError(f"Detection failed: {error}"))
+            else:
+                future.set_result([tuple(box) for box in boxes.tolist()])
+
+    def stats(self):
+        with self._lock:
+            return {
+                "processes": self.processes,
+                "slots": self.slots,
+                "free_slots": self._free.qsize(),
+                "submitted": self.submitted,
+                "completed": self.completed,
+            }
+
+    def close(self, timeout=5):
+        """Stop the detector processes and free the shared memory."""
+        for _ in self._processes:
+            self._tasks.put(None)
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self._results.put(None)
+        self._collector.join(timeout)
+        self.memory.close()
+        self.memory.unlink()
+
+
+_engine = None
+_engine_failed = False  # Starting the processes failed once, they aren't tried again
+_engine_lock = threading.Lock()
+
+
+def get_detection_engine():
+    """Return the process-wide detection engine, or None when detection runs in the capture threads.
+
+    STREAM_DETECT_PROCESSES = 0 keeps detection in-process; None starts one detector per core.
+    If the processes can't be started, the error is logged once and detection stays in-process.
+    """
+    global _engine, _engine_failed
+    processes = getattr(settings, "STREAM_DETECT_PROCESSES", 0)
+    if processes == 0 or _engine_failed:
+        return None
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None and not _engine_failed:
+                try:
+                    engine = DetectionEngine(
+                        os.path.join(settings.BASE_DIR, "cascades"),
+                        processes=processes,
+                        python=getattr(settings, "STREAM_DETECT_PYTHON", None),
+                        start_timeout=getattr(settings, "STREAM_DETECT_START_TIMEOUT", 30),
+                    )
+                except Exception:
+                    logger.exception("Could not start the detector processes, detecting in the capture threads instead")
+                    _engine_failed = True
+                    return None
+                atexit.register(engine.close)
+                _engine = engine
+    return _engine
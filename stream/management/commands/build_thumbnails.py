@@ -0,0 +1,39 @@
+import itertools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from stream.models import Screenshot
+from stream.thumbnails import ensure_thumbnail
+
+CHUNK_SIZE = 2000
+
+
+class Command(BaseCommand):
+    help = "Generate gallery thumbnails for existing screenshots in parallel."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="parallel threads (default: CPU count)")
+        parser.add_argument("--force", action="store_true", help="rebuild thumbnails that are already cached")
+        parser.add_argument("--camera", type=int, help="only screenshots of this camera")
+
+    def handle(self, *args, **options):
+        screenshots = Screenshot.objects.order_by("id")
+        if options["camera"] is not None:
+            screenshots = screenshots.filter(camera_id=options["camera"])
+        file_paths = screenshots.values_list("file_path", flat=True).iterator(chunk_size=CHUNK_SIZE)
+
+        built = missing = 0
+        # OpenCV releases the GIL while decoding, resizing and encoding, so threads run in parallel
+        with ThreadPoolExecutor(max_workers=options["workers"]) as executor:
+            # Submit a chunk at a time so memory stays flat however many screenshots there are
+            for chunk in iter(lambda: list(itertools.islice(file_paths, CHUNK_SIZE)), []):
+                for path in executor.map(lambda file_path: ensure_thumbnail(file_path, force=options["force"]), chunk):
+                    if path is None:
+                        missing += 1
+                    else:
+                        built += 1
+                self.stdout.write(f"{built + missing} screenshots processed")
+
+        self.stdout.write(self.style.SUCCESS(f"{built} thumbnails ready, {missing} screenshots without a file"))
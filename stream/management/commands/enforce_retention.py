@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from stream.retention import retention_from_settings
+
+
+class Command(BaseCommand):
+    help = "Delete screenshots over their camera's age, count or disk space limit (STREAM_RETENTION)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--max-age-days", type=float, help="override the age limit of every camera")
+        parser.add_argument("--max-count", type=int, help="override the count limit of every camera")
+        parser.add_argument("--max-bytes", type=int, help="override the disk space limit of every camera")
+        parser.add_argument("--camera", type=int, help="only screenshots of this camera")
+
+    def handle(self, *args, **options):
+        retention = retention_from_settings()
+        overrides = {name: options[name] for name in ("max_age_days", "max_count", "max_bytes") if options[name] is not None}
+        if overrides:
+            retention.default.update(overrides)
+            retention.cameras = {camera_id: {**policy, **overrides} for camera_id, policy in retention.cameras.items()}
+
+        if options["camera"] is not None:
+            deleted, freed = retention.enforce_camera(options["camera"])
+            results = {options["camera"]: (deleted, freed)} if deleted else {}
+        else:
+            results = retention.enforce()
+
+        for camera_id, (deleted, freed) in results.items():
+            self.stdout.write(f"camera {camera_id}: {deleted} screenshots deleted, {freed / 1e6:.1f} MB freed")
+        self.stdout.write(self.style.SUCCESS(f"{retention.deleted} screenshots deleted, {retention.freed / 1e6:.1f} MB freed"))
@@ -0,0 +1,188 @@
+import functools
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+
+# Pipeline metrics, exported in the Prometheus text format at /metrics. Hot-path code records into
+# the module-level metrics below, e.g. STAGE_SECONDS.observe(elapsed, "read"): a bisect and a few
+# increments under a lock. With STREAM_METRICS = False every metric is a no-op and views aren't wrapped.
+# Values kept elsewhere anyway (viewer counts, open devices) are gauges read only when scraped.
+ENABLED = getattr(settings, "STREAM_METRICS", True)
+
+# Seconds; the pipeline stages take from microseconds (drawing) to tens of milliseconds (detection)
+STAGE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+VIEW_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}  # Label values -> count
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=STAGE_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # Label values -> [per-bucket counts (last one is +Inf), sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, *labels):
+        series = self._series.get(labels)
+        return series[2] if series is not None else 0
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(labels, list(counts), total, count) for labels, (counts, total, count) in self._series.items()]
+        for labels, counts, total, count in series:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, labels)} {count}")
+        return lines
+
+
+class Gauge:
+    """A value read when the metrics are scraped: `collect` returns {label values tuple: value}."""
+
+    def __init__(self, name, help, labels=(), collect=None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.collect = collect
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for labels, value in self.collect().items():
+            lines.append(f"{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}")
+        return lines
+
+
+class _Noop:
+    """Stands in for every metric when metrics are disabled."""
+
+    def inc(self, *args, **kwargs):
+        pass
+
+    def observe(self, *args):
+        pass
+
+    def render(self):
+        return []
+
+
+NOOP = _Noop()
+_metrics = []
+
+
+def _register(metric):
+    if not ENABLED:
+        return NOOP
+    _metrics.append(metric)
+    return metric
+
+
+def counter(name, help, labels=()):
+    return _register(Counter(name, help, labels))
+
+
+def histogram(name, help, labels=(), buckets=STAGE_BUCKETS):
+    return _register(Histogram(name, help, labels, buckets))
+
+
+def gauge(name, help, labels=(), collect=None):
+    return _register(Gauge(name, help, labels, collect))
+
+
+def render():
+    """All registered metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def timed(view_name):
+    """Decorator recording a view's handling time in VIEW_SECONDS; returns the view unchanged when disabled."""
+
+    def decorator(view):
+        if not ENABLED:
+            return view
+
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return view(*args, **kwargs)
+            finally:
+                VIEW_SECONDS.observe(time.perf_counter() - started, view_name)
+
+        return wrapper
+
+    return decorator
+
+
+# Stages: read, motion, gray (or resize for the dnn detector), detect, dnn_forward (one batched pass), draw, encode
+# and cascade_load (building a thread's classifier)
+STAGE_SECONDS = histogram("stream_stage_seconds", "Time spent in each stage of the frame pipeline", ["stage"])
+FRAMES = counter("stream_frames_total", "Frames read from each capture device", ["device"])
+FRAME_LATENCY = histogram(
+    "stream_frame_latency_seconds", "Time from reading a frame to sending it to a viewer", ["camera"], LATENCY_BUCKETS
+)
+DELIVERED_FRAMES = counter("stream_viewer_frames_total", "Frames handed to viewers of each capture device", ["device"])
+DROPPED_FRAMES = counter(
+    "stream_viewer_dropped_frames_total", "Frames viewers of each capture device skipped because they were behind", ["device"]
+)
+VIEW_SECONDS = histogram("stream_view_seconds", "Request handling time of instrumented views", ["view"], VIEW_BUCKETS)
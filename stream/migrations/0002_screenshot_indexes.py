@@ -0,0 +1,23 @@
+# Generated by Django 5.1.2 on 2026-10-17 22:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stream", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="screenshot",
+            index=models.Index(
+                fields=["camera_id", "timestamp"], name="screenshot_camera_time_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="screenshot",
+            index=models.Index(fields=["timestamp"], name="screenshot_time_idx"),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.1.2 on 2026-10-17 22:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stream", "0002_screenshot_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Detection",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("camera_id", models.IntegerField()),
+                ("timestamp", models.DateTimeField()),
+                ("x", models.IntegerField()),
+                ("y", models.IntegerField()),
+                ("width", models.IntegerField()),
+                ("height", models.IntegerField()),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["camera_id", "timestamp"],
+                        name="detection_camera_time_idx",
+                    ),
+                    models.Index(fields=["timestamp"], name="detection_time_idx"),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.1.2 on 2026-10-17 22:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stream", "0003_detection"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RecordingSegment",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("camera_id", models.IntegerField()),
+                ("started_at", models.DateTimeField()),
+                ("ended_at", models.DateTimeField(blank=True, null=True)),
+                ("file_path", models.CharField(max_length=255)),
+                ("frames", models.IntegerField(default=0)),
+                ("size", models.BigIntegerField(default=0)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["camera_id", "started_at"],
+                        name="recording_camera_start_idx",
+                    )
+                ],
+            },
+        ),
+    ]
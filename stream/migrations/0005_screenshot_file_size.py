@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-17 22:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stream", "0004_recordingsegment"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="screenshot",
+            name="file_size",
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.2 on 2026-10-17 23:25
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stream", "0005_screenshot_file_size"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="screenshot",
+            name="timestamp",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
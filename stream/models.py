@@ -1,9 +1,57 @@
 from django.db import models
+from django.utils import timezone
 
 class Screenshot(models.Model):
     camera_id = models.IntegerField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(default=timezone.now)  # When the frame was captured, not when the row was written
     file_path = models.CharField(max_length=255)
+    file_size = models.IntegerField(null=True, blank=True)  # Bytes on disk; None for screenshots saved before it was recorded
+
+    class Meta:
+        # The gallery pages newest first by (timestamp, id), optionally for given cameras
+        indexes = [
+            models.Index(fields=["camera_id", "timestamp"], name="screenshot_camera_time_idx"),
+            models.Index(fields=["timestamp"], name="screenshot_time_idx"),
+        ]
 
     def __str__(self):
         return f"Camera {self.camera_id} - {self.timestamp}"
+
+
+class Detection(models.Model):
+    """One box found by a detection pass; the boxes of one pass share camera and timestamp."""
+
+    camera_id = models.IntegerField()
+    timestamp = models.DateTimeField()
+    x = models.IntegerField()
+    y = models.IntegerField()
+    width = models.IntegerField()
+    height = models.IntegerField()
+
+    class Meta:
+        # "When did camera 3 see a cat last week": a time range, optionally for given cameras
+        indexes = [
+            models.Index(fields=["camera_id", "timestamp"], name="detection_camera_time_idx"),
+            models.Index(fields=["timestamp"], name="detection_time_idx"),
+        ]
+
+    def __str__(self):
+        return f"Camera {self.camera_id} - {self.timestamp} ({self.x}, {self.y}, {self.width}, {self.height})"
+
+
+class RecordingSegment(models.Model):
+    """A fixed-duration piece of a camera's continuous recording, stored under MEDIA_ROOT/recordings."""
+
+    camera_id = models.IntegerField()
+    started_at = models.DateTimeField()
+    ended_at = models.DateTimeField(null=True, blank=True)  # None while the segment is being recorded
+    file_path = models.CharField(max_length=255)
+    frames = models.IntegerField(default=0)
+    size = models.BigIntegerField(default=0)
+
+    class Meta:
+        # Playback looks up "the last segment of camera 2 that started before 14:03:10"
+        indexes = [models.Index(fields=["camera_id", "started_at"], name="recording_camera_start_idx")]
+
+    def __str__(self):
+        return f"Camera {self.camera_id} - {self.started_at} ({self.frames} frames)"
@@ -0,0 +1,53 @@
+import cv2
+import numpy as np
+
+
+class Mosaic:
+    """Tile the latest processed frames of several cameras into one image.
+
+    The canvas is allocated once and a tile is only redrawn when its camera published a
+    new frame. Cameras backed by the same capture worker (mock cameras) are resized once
+    per frame and copied into each of their tiles.
+    """
+
+    def __init__(self, tiles, cols, tile_width, tile_height):
+        self.tiles = tiles  # List of (camera_id, worker), in display order
+        self.cols = max(1, min(cols, len(tiles)))
+        self.rows = -(-len(tiles) // self.cols)
+        self.tile_width = tile_width
+        self.tile_height = tile_height
+        self.canvas = np.zeros((self.rows * tile_height, self.cols * tile_width, 3), dtype=np.uint8)
+        self._drawn = [None] * len(tiles)  # Sequence number of the frame currently drawn in each tile
+
+    def compose(self):
+        """Redraw the tiles whose camera has a new frame; returns True if the canvas changed."""
+        resized = {}  # (worker, frame seq) -> tile image, shared by tiles of the same worker
+        changed = False
+        for index, (camera_id, worker) in enumerate(self.tiles):
+            frame = worker.latest
+            if frame is None or self._drawn[index] == frame.seq:
+                continue
+            key = (id(worker), frame.seq)
+            if key not in resized:
+                resized[key] = self._fit(frame.image)
+            row, col = divmod(index, self.cols)
+            y, x = row * self.tile_height, col * self.tile_width
+            tile = self.canvas[y:y + self.tile_height, x:x + self.tile_width]
+            tile[:] = resized[key]
+            cv2.putText(tile, f"Camera {camera_id}", (8, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+            self._drawn[index] = frame.seq
+            changed = True
+        return changed
+
+    def _fit(self, image):
+        """Scale the image into a tile keeping its aspect ratio, letterboxed with black."""
+        height, width = image.shape[:2]
+        scale = min(self.tile_width / width, self.tile_height / height)
+        fitted_width, fitted_height = max(1, int(width * scale)), max(1, int(height * scale))
+        tile = np.zeros((self.tile_height, self.tile_width, 3), dtype=np.uint8)
+        y = (self.tile_height - fitted_height) // 2
+        x = (self.tile_width - fitted_width) // 2
+        tile[y:y + fitted_height, x:x + fitted_width] = cv2.resize(
+            image, (fitted_width, fitted_height), interpolation=cv2.INTER_AREA
+        )
+        return tile
@@ -0,0 +1,350 @@
+import atexit
+import datetime
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Detection, Screenshot
+from .thumbnails import remove_screenshot_file, screenshot_path, write_thumbnail
+
+logger = logging.getLogger(__name__)
+
+
+class ScreenshotJob:
+    """A screenshot waiting to be written, and afterwards its outcome."""
+
+    __slots__ = ("id", "camera_id", "image", "file_name", "captured_at", "file_size", "status", "screenshot_id", "error")
+
+    def __init__(self, camera_id, image, file_name, captured_at=None):
+        self.id = uuid.uuid4().hex
+        self.camera_id = camera_id
+        self.image = image
+        self.file_name = file_name
+        self.captured_at = timezone.now() if captured_at is None else captured_at
+        self.file_size = None
+        self.status = "queued"
+        self.screenshot_id = None
+        self.error = None
+
+    def as_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "camera_id": self.camera_id,
+            "file_path": self.file_name,
+            "screenshot_id": self.screenshot_id,
+            "error": self.error,
+        }
+
+
+class BatchWriter:
+    """Background thread that takes queued items in batches and hands each batch to _write.
+
+    The thread takes up to `batch_size` items at a time, waiting at most `batch_wait`
+    seconds to fill a batch, so a burst becomes one transaction instead of many.
+    """
+
+    name = "batch-writer"
+
+    def __init__(self, max_queue=100, batch_size=20, batch_wait=0.5):
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        """Stop the writer thread after it has written everything that was queued."""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()  # Anything the thread didn't get to before the timeout
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def flush(self):
+        """Write everything that is queued right now, in the calling thread."""
+        while True:
+            batch = self._take_batch(block=False)
+            if not batch:
+                return
+            self._write(batch)
+
+    def _take_batch(self, block):
+        try:
+            batch = [self._queue.get(timeout=self.batch_wait) if block else self._queue.get_nowait()]
+        except queue.Empty:
+            return []
+        # batch_wait bounds the whole batch from its first item on, not each get: a steady trickle
+        # of items must not hold the batch back until batch_size of them have arrived
+        deadline = time.monotonic() + self.batch_wait
+        try:
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if not block or remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+        except queue.Empty:
+            pass
+        return batch
+
+    def _run(self):
+        try:
+            while not (self._stopping.is_set() and self._queue.empty()):
+                batch = self._take_batch(block=True)
+                if batch:
+                    self._write(batch)
+        finally:
+            connection.close()  # The thread's own database connection
+
+    def _write(self, batch):
+        raise NotImplementedError
+
+
+def image_hash(image):
+    """64-bit difference hash (dHash): nearly identical images get hashes only a few bits apart."""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    return int.from_bytes(np.packbits(small[:, 1:] > small[:, :-1]).tobytes(), "big")
+
+
+class ScreenshotWriter(BatchWriter):
+    """Background writer that encodes queued screenshots and inserts their rows in batches.
+
+    Requests only enqueue a frame and get a job id back. The writer thread writes the JPEG
+    files of a batch and inserts all of its Screenshot rows with one bulk_create inside one
+    transaction, so bursts don't serialize on the SQLite write lock. With `dedup_distance`
+    set, a screenshot whose dHash is within that many bits of the camera's previous saved
+    one isn't stored; its job ends as "duplicate" pointing at the screenshot kept instead.
+    """
+
+    name = "screenshot-writer"
+
+    def __init__(self, max_queue=100, batch_size=20, batch_wait=0.5, keep_jobs=1000, dedup_distance=None):
+        super().__init__(max_queue, batch_size, batch_wait)
+        self.keep_jobs = keep_jobs  # Finished jobs are remembered for status polling, oldest forgotten first
+        self.dedup_distance = dedup_distance
+        self.duplicates = 0
+        self._jobs = OrderedDict()
+        self._jobs_lock = threading.Lock()
+        self._last_saved = {}  # Camera id -> (dHash, job) of its last stored screenshot, writer thread only
+
+    def submit(self, camera_id, image, file_name, captured_at=None):
+        """Queue a screenshot and return its job; raises queue.Full if the writer is too far behind.
+
+        `captured_at` (an aware datetime, now if None) is the screenshot's timestamp, however
+        long it waits in the queue.
+        """
+        job = ScreenshotJob(camera_id, image, file_name, captured_at)
+        self._queue.put_nowait(job)
+        with self._jobs_lock:
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.keep_jobs:
+                self._jobs.popitem(last=False)
+        return job
+
+    def status(self, job_id):
+        with self._jobs_lock:
+            job = self._jobs.get(job_id)
+        return job.as_dict() if job is not None else None
+
+    def _write(self, batch):
+        written = []
+        duplicates = []
+        last_saved = dict(self._last_saved)  # Becomes the writer's once the rows are in
+        for job in batch:
+            digest = None
+            if self.dedup_distance is not None:
+                digest = image_hash(job.image)
+                previous = last_saved.get(job.camera_id)
+                if previous is not None and (digest ^ previous[0]).bit_count() <= self.dedup_distance:
+                    job.status, job.image = "duplicate", None
+                    duplicates.append((job, previous[1]))
+                    self.duplicates += 1
+                    continue
+            path = screenshot_path(job.file_name)
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)  # The camera's directory for the day
+                if not cv2.imwrite(path, job.image):
+                    raise OSError(f"Could not write {job.file_name}")
+                job.file_size = os.path.getsize(path)
+                written.append(job)
+            except Exception as e:
+                job.status, job.error = "failed", str(e)
+                job.image = None
+                continue
+            if digest is not None:
+                last_saved[job.camera_id] = (digest, job)
+            try:
+                # The frame is still in memory, so the gallery thumbnail costs a resize, not a re-read
+                write_thumbnail(job.file_name, job.image)
+            except Exception:
+                logger.warning("Could not write thumbnail of %s, it will be made on first view", job.file_name, exc_info=True)
+            job.image = None  # The frame is no longer needed, let it go
+
+        try:
+            with transaction.atomic():
+                rows = Screenshot.objects.bulk_create(
+                    [
+                        Screenshot(camera_id=job.camera_id, timestamp=job.captured_at, file_path=job.file_name, file_size=job.file_size)
+                        for job in written
+                    ]
+                )
+        except Exception as e:
+            logger.exception("Failed to insert %d screenshot rows", len(written))
+            for job in written:
+                job.status, job.error = "failed", str(e)
+                try:
+                    remove_screenshot_file(job.file_name)  # No row will ever point at the file or its thumbnail
+                except OSError:
+                    logger.warning("Could not remove %s", job.file_name, exc_info=True)
+        else:
+            for job, row in zip(written, rows):
+                job.status, job.screenshot_id = "saved", row.id
+            self._last_saved = last_saved
+        for job, kept in duplicates:
+            if kept.status == "failed":  # A duplicate of a screenshot that wasn't saved after all
+                job.status, job.error = "failed", kept.error
+            else:
+                job.screenshot_id = kept.screenshot_id
+
+
+class DetectionWriter(BatchWriter):
+    """Background writer for detection passes: the pipeline queues boxes, rows are inserted in batches.
+
+    record() never blocks the capture loop; if the database falls so far behind that the
+    queue is full, the pass is dropped and counted instead.
+    """
+
+    name = "detection-writer"
+
+    def __init__(self, max_queue=1000, batch_size=200, batch_wait=1.0):
+        super().__init__(max_queue, batch_size, batch_wait)
+        self.written = 0
+        self.dropped = 0
+
+    def record(self, camera_id, timestamp, boxes):
+        """Queue the boxes of one detection pass; `timestamp` is a time.time() value."""
+        try:
+            self._queue.put_nowait((camera_id, timestamp, boxes))
+        except queue.Full:
+            self.dropped += 1
+
+    def _write(self, batch):
+        rows = [
+            Detection(
+                camera_id=camera_id,
+                timestamp=datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc),
+                x=x,
+                y=y,
+                width=w,
+                height=h,
+            )
+            for camera_id, timestamp, boxes in batch
+            for (x, y, w, h) in boxes
+        ]
+        try:
+            with transaction.atomic():
+                Detection.objects.bulk_create(rows)
+        except Exception:
+            logger.exception("Failed to insert %d detection rows", len(rows))
+            return
+        self.written += len(rows)
+
+
+class FileRemover(BatchWriter):
+    """Background thread removing the files and cached thumbnails of deleted screenshots, in batches.
+
+    Bulk deletes drop the rows with one query and hand the file names over, so a request
+    deleting thousands of screenshots doesn't wait for thousands of unlinks. The queue is
+    unbounded: the rows are already gone, so the files must not be forgotten.
+    """
+
+    name = "screenshot-remover"
+
+    def __init__(self, batch_size=500, batch_wait=0.5):
+        super().__init__(0, batch_size, batch_wait)
+        self.removed = 0
+
+    def remove(self, file_names):
+        for file_name in file_names:
+            self._queue.put_nowait(file_name)
+
+    def _write(self, batch):
+        for file_name in batch:
+            try:
+                remove_screenshot_file(file_name)
+            except OSError:
+                logger.warning("Could not remove %s", file_name, exc_info=True)
+                continue
+            self.removed += 1
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_screenshot_writer():
+    """Return the process-wide screenshot writer, starting it on first use."""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                writer = ScreenshotWriter(
+                    max_queue=getattr(settings, "STREAM_SCREENSHOT_QUEUE_SIZE", 100),
+                    batch_size=getattr(settings, "STREAM_SCREENSHOT_BATCH_SIZE", 20),
+                    dedup_distance=getattr(settings, "STREAM_SCREENSHOT_DEDUP_DISTANCE", None),
+                )
+                writer.start()
+                atexit.register(writer.stop)  # Flush whatever is still queued on shutdown
+                _writer = writer
+    return _writer
+
+
+_detection_writer = None
+
+
+def get_detection_writer():
+    """Return the process-wide detection writer, starting it on first use."""
+    global _detection_writer
+    if _detection_writer is None:
+        with _writer_lock:
+            if _detection_writer is None:
+                writer = DetectionWriter(max_queue=getattr(settings, "STREAM_DETECTION_QUEUE_SIZE", 1000))
+                writer.start()
+                atexit.register(writer.stop)
+                _detection_writer = writer
+    return _detection_writer
+
+
+_remover = None
+
+
+def get_screenshot_remover():
+    """Return the process-wide remover of deleted screenshots' files, starting it on first use."""
+    global _remover
+    if _remover is None:
+        with _writer_lock:
+            if _remover is None:
+                remover = FileRemover()
+                remover.start()
+                atexit.register(remover.stop)
+                _remover = remover
+    return _remover
@@ -0,0 +1,151 @@
+import logging
+import queue
+import time
+
+import cv2
+from django.conf import settings
+
+from .detection import DetectionCadence
+from .detectors import get_detector
+from .metrics import STAGE_SECONDS
+from .persistence import get_detection_writer, get_screenshot_writer
+from .scheduling import get_detection_scheduler
+from .screenshots import screenshot_file_name
+
+logger = logging.getLogger(__name__)
+
+
+class AutoCapture:
+    """Decide when a detection deserves an automatic screenshot.
+
+    A screenshot is due when cats appear after at least `gap` seconds without any (a
+    detection starts), and at most once every `interval` seconds, so a cat sitting in front
+    of the camera for an hour gives one screenshot, not hundreds.
+    """
+
+    def __init__(self, gap=30.0, interval=60.0):
+        self.gap = gap
+        self.interval = interval
+        self.captures = 0
+        self._last_seen = None
+        self._last_capture = None
+
+    def update(self, boxes, now):
+        """Feed the boxes of a frame; returns True if this frame should be captured."""
+        if not boxes:
+            return False
+        started = self._last_seen is None or now - self._last_seen >= self.gap
+        self._last_seen = now
+        if not started or (self._last_capture is not None and now - self._last_capture < self.interval):
+            return False
+        self._last_capture = now
+        self.captures += 1
+        return True
+
+
+class FrameProcessor:
+    """Per-camera frame processing: detect cats on scheduled frames and draw the boxes.
+
+    One instance belongs to one capture worker, so its state (last boxes, detection
+    cadence) is only touched from that worker's thread. Detection goes through the
+    camera's detector backend (see detectors.get_detector). When the detection scheduler
+    is on, detection leaves the capture thread: frames are submitted at the camera's target
+    fps and the boxes the scheduler found last are drawn.
+    """
+
+    def __init__(self, camera_id=None):
+        self.camera_id = camera_id
+        self.detector = get_detector(camera_id)
+        self.cadence = DetectionCadence(
+            every_n_frames=getattr(settings, "STREAM_DETECT_EVERY_N_FRAMES", 3),
+            every_ms=getattr(settings, "STREAM_DETECT_EVERY_MS", None),
+            adaptive=getattr(settings, "STREAM_DETECT_ADAPTIVE", True),
+            cpu_budget=getattr(settings, "STREAM_DETECT_CPU_BUDGET", 0.5),
+            max_every_n_frames=getattr(settings, "STREAM_DETECT_MAX_EVERY_N_FRAMES", 30),
+        )
+        self.boxes = []  # Last known boxes, drawn on the frames between detections
+        self.record_detections = getattr(settings, "STREAM_RECORD_DETECTIONS", True)
+        self.auto_capture = None
+        if getattr(settings, "STREAM_AUTO_SCREENSHOT", False):
+            self.auto_capture = AutoCapture(
+                gap=getattr(settings, "STREAM_AUTO_SCREENSHOT_GAP", 30),
+                interval=getattr(settings, "STREAM_AUTO_SCREENSHOT_INTERVAL", 60),
+            )
+        self.scheduled = None
+        scheduler = get_detection_scheduler()
+        if scheduler is not None:
+            self.scheduled = scheduler.register(
+                camera_id,
+                self.detect,
+                target_fps=getattr(settings, "STREAM_DETECT_CAMERA_FPS", {}).get(camera_id, getattr(settings, "STREAM_DETECT_TARGET_FPS", 5)),
+                priority=getattr(settings, "STREAM_DETECT_PRIORITIES", {}).get(camera_id, 0),
+            )
+
+    def detect(self, prepared):
+        """Run the detector on a frame its prepare() made; called in this thread or a scheduler thread."""
+        started = time.perf_counter()
+        boxes = self.detector.detect(prepared)
+        STAGE_SECONDS.observe(time.perf_counter() - started, "detect")
+        if boxes and self.record_detections:
+            get_detection_writer().record(self.camera_id, time.time(), boxes)  # Queued, written in batches
+        return boxes
+
+    def prepare(self, frame):
+        """The detector's copy of the frame (grayscale, or resized for the network); boxes are drawn on the frame itself."""
+        started = time.perf_counter()
+        prepared = self.detector.prepare(frame)
+        STAGE_SECONDS.observe(time.perf_counter() - started, self.detector.prepare_stage)
+        return prepared
+
+    def __call__(self, frame):
+        """Detect cats in the frame (if it is due) and draw rectangles around them."""
+        if self.scheduled is not None:
+            if self.scheduled.due():
+                # A copy for the detector (grayscale, or resized for the network), the frame itself gets boxes drawn on it right below
+                try:
+                    self.scheduled.submit(self.prepare(frame))
+                except Exception:
+                    logger.exception("Could not prepare a frame of camera %s for detection, skipped it", self.camera_id)
+            self.boxes = self.scheduled.boxes
+        elif self.cadence.due():
+            started = time.perf_counter()
+            try:
+                self.boxes = self.detect(self.prepare(frame))
+            except TimeoutError:
+                logger.warning("Detection timed out, keeping the last boxes")
+            except Exception:
+                # A failing detector (or a frame it can't take) must not stop the capture loop, and with it the camera for every viewer
+                logger.exception("Detection failed for camera %s, keeping the last boxes", self.camera_id)
+            self.cadence.record(time.perf_counter() - started)
+
+        # Draw rectangles around detected cats
+        started = time.perf_counter()
+        for (x, y, w, h) in self.boxes:
+            cv2.rectangle(frame, (x, y), (x + w, y + h), (255, 0, 0), 2)
+        STAGE_SECONDS.observe(time.perf_counter() - started, "draw")
+
+        if self.auto_capture is not None and self.auto_capture.update(self.boxes, time.time()):
+            self.save_auto_screenshot(frame)
+        return self.boxes
+
+    def carry_over(self, frame):
+        """Called for the frames the motion gate skips or repeats: the scene and with it `frame.boxes` are unchanged.
+
+        A cat sitting still is still there, so automatic capture has to see it on those frames too,
+        or the next processed frame would look like a new appearance.
+        """
+        if self.auto_capture is not None and self.auto_capture.update(frame.boxes, time.time()):
+            self.save_auto_screenshot(frame.image)
+
+    def save_auto_screenshot(self, frame):
+        # The frame is published as is and never modified afterwards, so the writer can take it without a copy
+        file_name = screenshot_file_name(self.camera_id, "auto")
+        try:
+            get_screenshot_writer().submit(self.camera_id, frame, file_name)
+        except queue.Full:
+            logger.warning("Screenshot queue is full, skipped the automatic screenshot of camera %s", self.camera_id)
+
+    def close(self):
+        """Leave the detection scheduler once the camera is closed."""
+        if self.scheduled is not None:
+            self.scheduled.close()
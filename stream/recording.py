@@ -0,0 +1,355 @@
+import atexit
+import datetime
+import logging
+import mmap
+import os
+import queue
+import struct
+import threading
+from bisect import bisect_right
+
+import cv2
+import numpy as np
+from django.conf import settings
+
+from .capture import MULTIPART_HEADER
+from .models import RecordingSegment
+from .persistence import BatchWriter
+
+logger = logging.getLogger(__name__)
+
+# Recordings are MJPEG segments: the JPEGs of the recorded frames back to back in a .mjpeg file,
+# plus a .mjpeg.idx file with one fixed-size record per frame: capture time (time.time()),
+# byte offset of its JPEG in the segment and JPEG length. Records are in capture order, so the
+# frame shown at any moment is a binary search away and reading it is a slice of the segment.
+INDEX_RECORD = struct.Struct("<dQI")
+
+
+def recordings_dir():
+    return os.path.join(settings.MEDIA_ROOT, "recordings")
+
+
+def segment_path(segment):
+    """Absolute path of a RecordingSegment's .mjpeg file; its index is the same path plus ".idx"."""
+    return os.path.join(recordings_dir(), segment.file_path)
+
+
+def _to_datetime(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+
+
+def _map(f):
+    """Read-only memory map of a whole file; an empty file (nothing flushed yet) maps to b""."""
+    if os.fstat(f.fileno()).st_size == 0:
+        return b""
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class _Timestamps:
+    """The capture times of a segment's index as a sequence, so bisect can search the mapped records."""
+
+    def __init__(self, reader):
+        self.reader = reader
+
+    def __len__(self):
+        return len(self.reader)
+
+    def __getitem__(self, i):
+        return self.reader.timestamp(i)
+
+
+class SegmentReader:
+    """Random access to one recorded segment, with the segment and its index memory-mapped.
+
+    A segment that is still being recorded can be read up to what the writer has flushed,
+    frames whose JPEG isn't completely on disk yet are left out.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as data, open(path + ".idx", "rb") as index:
+            # The maps stay valid after the files are closed
+            self._data = _map(data)
+            self._index = _map(index)
+        self._count = len(self._index) // INDEX_RECORD.size
+        while self._count and sum(self.entry(self._count - 1)[1:]) > len(self._data):
+            self._count -= 1
+
+    def __len__(self):
+        return self._count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def entry(self, i):
+        """(timestamp, offset, length) of frame `i`."""
+        return INDEX_RECORD.unpack_from(self._index, i * INDEX_RECORD.size)
+
+    def timestamp(self, i):
+        return self.entry(i)[0]
+
+    def find(self, timestamp):
+        """Index of the last frame captured at or before `timestamp`, or None if the segment starts later."""
+        i = bisect_right(_Timestamps(self), timestamp) - 1
+        return i if i >= 0 else None
+
+    def jpeg(self, i):
+        _, offset, length = self.entry(i)
+        return self._data[offset:offset + length]
+
+    def close(self):
+        for mapped in (self._data, self._index):
+            if isinstance(mapped, mmap.mmap):
+                mapped.close()
+
+
+class _OpenSegment:
+    __slots__ = ("id", "data", "index", "started", "last", "size", "frames")
+
+    def __init__(self, segment_id, data, index, started):
+        self.id = segment_id
+        self.data = data
+        self.index = index
+        self.started = started
+        self.last = started
+        self.size = 0
+        self.frames = 0
+
+
+class RecordingWriter(BatchWriter):
+    """Background writer that appends the recorded frames of every camera to their segments.
+
+    A camera's recording is cut into segments of `segment_seconds`, each with a
+    RecordingSegment row created when it opens and completed when it closes, so playback
+    finds the segment with one index seek, even while it is still being recorded. One
+    thread serves every camera and flushes each segment once per batch: disk writes are
+    sequential appends in large chunks no matter how many cameras record, and when the disk
+    can't keep up frames are dropped and counted instead of stalling the capture loops.
+    """
+
+    name = "recording-writer"
+
+    def __init__(self, max_queue=500, batch_size=100, batch_wait=0.5, segment_seconds=60):
+        super().__init__(max_queue, batch_size, batch_wait)
+        self.segment_seconds = segment_seconds
+        self.written = 0
+        self.dropped = 0
+        self._segments = {}  # Camera id -> _OpenSegment, only touched by the thread writing batches
+
+    def record(self, camera_id, timestamp, jpeg):
+        """Queue one frame's JPEG; `timestamp` is its time.time() capture time."""
+        try:
+            self._queue.put_nowait((camera_id, timestamp, jpeg))
+        except queue.Full:
+            self.dropped += 1
+
+    def finish(self, camera_id):
+        """Close the camera's current segment once the frames queued before are written."""
+        self._queue.put((camera_id, None, None))
+
+    def stop(self, timeout=10):
+        super().stop(timeout)
+        for camera_id in list(self._segments):
+            self._close(camera_id)
+
+    def _write(self, batch):
+        touched = {}
+        for camera_id, timestamp, jpeg in batch:
+            if jpeg is None:
+                self._close(camera_id)
+                touched.pop(camera_id, None)
+                continue
+            segment = self._segments.get(camera_id)
+            if segment is not None and timestamp - segment.started >= self.segment_seconds:
+                self._close(camera_id)  # Closing flushes it
+                touched.pop(camera_id, None)
+                segment = None
+            try:
+                if segment is None:
+                    segment = self._open(camera_id, timestamp)
+                segment.data.write(jpeg)
+                segment.index.write(INDEX_RECORD.pack(timestamp, segment.size, len(jpeg)))
+            except Exception:
+                logger.exception("Could not record a frame of camera %s", camera_id)
+                self.dropped += 1
+                self._close(camera_id)
+                touched.pop(camera_id, None)
+                continue
+            segment.size += len(jpeg)
+            segment.frames += 1
+            segment.last = timestamp
+            self.written += 1
+            touched[camera_id] = segment
+        for segment in touched.values():
+            # The JPEGs go to disk before the index records pointing at them, so readers never see a dangling offset
+            segment.data.flush()
+            segment.index.flush()
+
+    def _open(self, camera_id, timestamp):
+        started = _to_datetime(timestamp)
+        file_path = f"camera_{camera_id}/{started.strftime('%Y-%m-%d_%H-%M-%S_%f')}.mjpeg"
+        path = os.path.join(recordings_dir(), file_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = open(path, "wb", buffering=1 << 20)
+        index = open(path + ".idx", "wb")
+        row = RecordingSegment.objects.create(camera_id=camera_id, started_at=started, file_path=file_path)
+        segment = self._segments[camera_id] = _OpenSegment(row.id, data, index, timestamp)
+        return segment
+
+    def _close(self, camera_id):
+        segment = self._segments.pop(camera_id, None)
+        if segment is None:
+            return
+        try:
+            segment.data.close()
+            segment.index.close()
+        except OSError:
+            logger.exception("Could not close the recording segment of camera %s", camera_id)
+        RecordingSegment.objects.filter(id=segment.id).update(
+            ended_at=_to_datetime(segment.last), frames=segment.frames, size=segment.size
+        )
+
+    def stats(self):
+        return {"written": self.written, "dropped": self.dropped, "pending": self.pending(), "open_segments": len(self._segments)}
+
+
+class CameraRecorder:
+    """Feeds a capture worker's published frames to the recording writer, at most `fps` a second.
+
+    Recording uses the frames the worker publishes for streaming, not a second read of the
+    device, and their JPEG comes from the worker's encoded frame cache: a frame viewers
+    already watch in the recorded profile isn't encoded again. `on_stop` is called with the
+    recorder when the worker it is attached to stops on its own, e.g. after a read failure.
+    """
+
+    def __init__(self, camera_id, encoded, writer, fps=10, profile="full", on_stop=None):
+        self.camera_id = camera_id
+        self.encoded = encoded
+        self.writer = writer
+        self.fps = fps
+        self.profile = profile
+        self.on_stop = on_stop
+        self.interval = 1 / fps if fps else 0.0
+        self.frames = 0
+        self.restarts = 0
+        self._next_at = 0.0
+
+    def __call__(self, frame):
+        if frame.timestamp < self._next_at:
+            return
+        # Keep to the schedule, so frames arriving a bit late don't lower the rate, but never catch up by more than half an interval
+        self._next_at = max(self._next_at + self.interval, frame.timestamp + self.interval / 2)
+        chunk = self.encoded.get(frame, self.profile)
+        if chunk is None:
+            return
+        # The JPEG inside the multipart chunk, without copying it
+        self.writer.record(self.camera_id, frame.timestamp, memoryview(chunk)[len(MULTIPART_HEADER):-2])
+        self.frames += 1
+
+    def worker_stopped(self, worker):
+        if self.on_stop is not None:
+            self.on_stop(self)
+
+    def close(self):
+        self.writer.finish(self.camera_id)
+
+    def stats(self):
+        return {"fps": self.fps, "profile": self.profile, "frames": self.frames, "restarts": self.restarts}
+
+
+def find_frame(camera_id, at, tolerance=5.0):
+    """Return (capture time, JPEG) of the recorded frame camera `camera_id` showed at `at` (an aware datetime).
+
+    Returns None if nothing was recorded within `tolerance` seconds before `at`.
+    """
+    segment = RecordingSegment.objects.filter(camera_id=camera_id, started_at__lte=at).order_by("-started_at").first()
+    if segment is None:
+        return None
+    try:
+        reader = SegmentReader(segment_path(segment))
+    except FileNotFoundError:
+        return None
+    with reader:
+        i = reader.find(at.timestamp())
+        if i is None or at.timestamp() - reader.timestamp(i) > tolerance:
+            return None
+        return _to_datetime(reader.timestamp(i)), reader.jpeg(i)
+
+
+def _entries(camera_id, start, end=None):
+    """Yield (capture time, reader, frame index) of a camera's recorded frames from `start` on, across segments."""
+    first = RecordingSegment.objects.filter(camera_id=camera_id, started_at__lte=start).order_by("-started_at").first()
+    later = RecordingSegment.objects.filter(camera_id=camera_id, started_at__gt=start).order_by("started_at")
+    if end is not None:
+        later = later.filter(started_at__lt=end)
+    segments = ([first] if first is not None else []) + list(later)
+    for segment in segments:
+        try:
+            reader = SegmentReader(segment_path(segment))
+        except FileNotFoundError:
+            continue
+        with reader:
+            i = reader.find(start.timestamp())
+            for j in range(i if i is not None else 0, len(reader)):
+                timestamp = reader.timestamp(j)
+                if end is not None and timestamp >= end.timestamp():
+                    return
+                yield timestamp, reader, j
+
+
+def iter_recording(camera_id, start, end=None):
+    """Yield (capture time, JPEG) of a camera's recorded frames from `start` on, oldest first, across segments."""
+    for timestamp, reader, i in _entries(camera_id, start, end):
+        yield _to_datetime(timestamp), reader.jpeg(i)
+
+
+def export_recording(camera_id, start, end, path):
+    """Write a camera's recording between `start` and `end` to a video file with cv2.VideoWriter.
+
+    The clip plays at the recorded frame rate. Returns the number of frames written (no file if 0).
+    """
+    # The frame rate comes from the index alone, nothing is read from the segments for it
+    timestamps = [timestamp for timestamp, _, _ in _entries(camera_id, start, end)]
+    if not timestamps:
+        return 0
+    duration = timestamps[-1] - timestamps[0]
+    fps = (len(timestamps) - 1) / duration if duration > 0 else 1.0
+    writer = None
+    frames = 0
+    try:
+        for _, jpeg in iter_recording(camera_id, start, end):
+            image = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if image is None:
+                continue
+            if writer is None:
+                height, width = image.shape[:2]
+                writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), fps, (width, height))
+            writer.write(image)
+            frames += 1
+    finally:
+        if writer is not None:
+            writer.release()
+    return frames
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_recording_writer():
+    """Return the process-wide recording writer, starting it on first use."""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                writer = RecordingWriter(
+                    max_queue=getattr(settings, "STREAM_RECORD_QUEUE_SIZE", 500),
+                    segment_seconds=getattr(settings, "STREAM_RECORD_SEGMENT_SECONDS", 60),
+                )
+                writer.start()
+                atexit.register(writer.stop)  # Close the open segments on shutdown
+                _writer = writer
+    return _writer
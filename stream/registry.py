@@ -0,0 +1,164 @@
+import threading
+import time
+
+
+class CameraLease:
+    """A claim on a camera: its device stays open while at least one lease is held."""
+
+    def __init__(self, registry, camera_id, device_id, worker):
+        self.registry = registry
+        self.camera_id = camera_id
+        self.device_id = device_id
+        self.worker = worker
+        self.released = False
+
+    def release(self):
+        """Give the lease back; releasing twice is a no-op."""
+        if not self.released:
+            self.released = True
+            self.registry._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class CameraRegistry:
+    """Capture workers by camera, opened on the first lease and closed after the last one.
+
+    Every viewer or screenshot takes a lease. When the last lease on a device ends, the
+    device stays open for `grace` seconds; a new lease within that time reuses the running
+    worker (a warm reopen) instead of paying for closing and reopening the device.
+    Several camera ids can map to one device (`device_for`), as the mock cameras do.
+    Devices are opened outside the lock, so a slow open only holds up the callers waiting
+    for that same device.
+    """
+
+    def __init__(self, open_worker, device_for=None, grace=10.0):
+        self.open_worker = open_worker  # Called with a device id, returns a started capture worker
+        self.device_for = device_for or (lambda camera_id: camera_id)
+        self.grace = grace
+        self.lock = threading.Lock()
+        self.cameras = {}  # Camera id -> capture worker, for every camera whose device is open
+        self._workers = {}  # Device id -> capture worker
+        self._leases = {}  # Device id -> number of leases held
+        self._timers = {}  # Device id -> timer that closes it once the grace period is over
+        self._opening = {}  # Device id -> Event set once the caller opening it is done
+        self.opens = 0
+        self.closes = 0
+        self.warm_reopens = 0
+        self.last_open_seconds = None
+        self.total_open_seconds = 0.0
+
+    def acquire(self, camera_id):
+        """Take a lease on a camera, opening its device if it isn't open yet."""
+        device_id = self.device_for(camera_id)
+        while True:
+            with self.lock:
+                timer = self._timers.pop(device_id, None)
+                if timer is not None:  # The device was idle and about to close, keep it
+                    timer.cancel()
+                    self.warm_reopens += 1
+                opening = self._opening.get(device_id)
+                if opening is None:
+                    worker = self._workers.get(device_id)
+                    # An idle worker whose device died is replaced; one that still has leases is kept,
+                    # its viewers will see it stopped and let go
+                    if worker is not None and (worker.running or self._leases.get(device_id)):
+                        return self._lease(camera_id, device_id, worker)
+                    dead = self._detach(device_id)  # Drops every camera id still mapped to the dead worker
+                    opening = self._opening[device_id] = threading.Event()
+                    break
+            opening.wait()  # Another caller is opening the device, then take a lease on it
+
+        try:
+            if dead is not None:
+                dead.stop()
+            started = time.perf_counter()
+            worker = self.open_worker(device_id)
+            opened = time.perf_counter() - started
+        except BaseException:
+            with self.lock:
+                del self._opening[device_id]
+            opening.set()  # The callers waiting try to open it themselves
+            raise
+        with self.lock:
+            self.last_open_seconds = opened
+            self.total_open_seconds += opened
+            self.opens += 1
+            self._workers[device_id] = worker
+            del self._opening[device_id]
+            lease = self._lease(camera_id, device_id, worker)
+        opening.set()
+        return lease
+
+    def _lease(self, camera_id, device_id, worker):
+        """Count a new lease on an open device; the lock must be held."""
+        self._leases[device_id] = self._leases.get(device_id, 0) + 1
+        self.cameras[camera_id] = worker
+        return CameraLease(self, camera_id, device_id, worker)
+
+    def _release(self, lease):
+        device_id = lease.device_id
+        with self.lock:
+            remaining = self._leases.get(device_id, 0) - 1
+            if remaining > 0:
+                self._leases[device_id] = remaining
+                return
+            self._leases[device_id] = 0
+            if self.grace > 0:
+                timer = threading.Timer(self.grace, self._close_idle)
+                timer.args = (device_id, timer)
+                timer.daemon = True
+                self._timers[device_id] = timer
+                timer.start()
+                return
+            worker = self._detach(device_id)
+        if worker is not None:
+            worker.stop()  # Outside the lock, stopping waits for the capture loop to finish
+
+    def _close_idle(self, device_id, timer):
+        with self.lock:
+            if self._timers.get(device_id) is not timer:  # Cancelled by a new lease in the meantime
+                return
+            del self._timers[device_id]
+            worker = self._detach(device_id)
+        if worker is not None:
+            worker.stop()
+
+    def _detach(self, device_id):
+        """Forget a device and every camera id mapped to it; the lock must be held."""
+        worker = self._workers.pop(device_id, None)
+        self._leases.pop(device_id, None)
+        for camera_id in [camera_id for camera_id, mapped in self.cameras.items() if mapped is worker]:
+            del self.cameras[camera_id]
+        if worker is not None:
+            self.closes += 1
+        return worker
+
+    def in_use(self):
+        """Ids of the cameras whose device is open, copied under the lock so other threads can iterate it."""
+        with self.lock:
+            return list(self.cameras)
+
+    def leases(self, camera_id):
+        """Number of leases held on the device of a camera."""
+        with self.lock:
+            return self._leases.get(self.device_for(camera_id), 0)
+
+    def stats(self):
+        with self.lock:
+            devices = {
+                device_id: {"leases": self._leases.get(device_id, 0), "idle": device_id in self._timers}
+                for device_id in self._workers
+            }
+            return {
+                "devices": devices,
+                "opens": self.opens,
+                "closes": self.closes,
+                "warm_reopens": self.warm_reopens,
+                "last_open_seconds": self.last_open_seconds,
+                "average_open_seconds": self.total_open_seconds / self.opens if self.opens else None,
+            }
@@ -0,0 +1,174 @@
+import datetime
+import logging
+import os
+import threading
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from .models import Screenshot
+from .thumbnails import remove_screenshot_file, screenshot_path
+
+logger = logging.getLogger(__name__)
+
+# Limits of a camera's screenshots; None means no limit
+DEFAULT_POLICY = {"max_age_days": None, "max_count": None, "max_bytes": None}
+
+
+class Retention:
+    """Keeps every camera's screenshots within its age, count and disk space limits.
+
+    `default` applies to every camera, `cameras` overrides it per camera id. enforce()
+    deletes whatever is over a limit, oldest first, `batch_size` screenshots at a time:
+    the rows of a batch go in one transaction, then their files. Screenshots saved before
+    file sizes were recorded get their size read from disk first, so the byte limit counts them.
+    """
+
+    def __init__(self, default=None, cameras=None, batch_size=500):
+        self.default = {**DEFAULT_POLICY, **(default or {})}
+        self.cameras = cameras or {}
+        self.batch_size = batch_size
+        self.runs = 0
+        self.deleted = 0
+        self.freed = 0
+        self._thread = None
+        self._stopping = threading.Event()
+
+    @property
+    def limited(self):
+        """True if any camera has any limit, i.e. enforce() can ever delete something."""
+        policies = [self.default, *self.cameras.values()]
+        return any(policy.get(name) is not None for policy in policies for name in DEFAULT_POLICY)
+
+    def policy(self, camera_id):
+        return {**self.default, **self.cameras.get(camera_id, {})}
+
+    def enforce(self, now=None):
+        """Apply every camera's limits once; returns {camera id: (screenshots deleted, bytes freed)} of cameras that had to give some up."""
+        now = timezone.now() if now is None else now
+        results = {}
+        for camera_id in Screenshot.objects.values_list("camera_id", flat=True).distinct().order_by("camera_id"):
+            deleted, freed = self.enforce_camera(camera_id, now)
+            if deleted:
+                results[camera_id] = (deleted, freed)
+        self.runs += 1
+        return results
+
+    def enforce_camera(self, camera_id, now=None):
+        now = timezone.now() if now is None else now
+        policy = self.policy(camera_id)
+        screenshots = Screenshot.objects.filter(camera_id=camera_id).order_by("timestamp", "id")
+        deleted = freed = 0
+
+        if policy["max_age_days"] is not None:
+            expired = screenshots.filter(timestamp__lt=now - datetime.timedelta(days=policy["max_age_days"]))
+            while True:
+                batch = list(expired.values_list("id", "file_path", "file_size")[: self.batch_size])
+                if not batch:
+                    break
+                deleted, freed = deleted + len(batch), freed + self._delete(batch)
+
+        if policy["max_count"] is None and policy["max_bytes"] is None:
+            return deleted, freed
+        if policy["max_bytes"] is not None:
+            self._fill_sizes(screenshots)
+        totals = screenshots.aggregate(count=Count("id"), size=Sum("file_size"))
+        excess_count = totals["count"] - policy["max_count"] if policy["max_count"] is not None else 0
+        excess_bytes = (totals["size"] or 0) - policy["max_bytes"] if policy["max_bytes"] is not None else 0
+        while excess_count > 0 or excess_bytes > 0:
+            batch = []
+            for row in screenshots.values_list("id", "file_path", "file_size")[: self.batch_size]:
+                if excess_count <= 0 and excess_bytes <= 0:
+                    break
+                batch.append(row)
+                excess_count -= 1
+                excess_bytes -= row[2] or 0
+            if not batch:
+                break
+            deleted, freed = deleted + len(batch), freed + self._delete(batch)
+        return deleted, freed
+
+    def _fill_sizes(self, screenshots):
+        """Read the size of screenshots saved before it was recorded; a missing file counts as 0 bytes."""
+        while True:
+            rows = list(screenshots.filter(file_size__isnull=True)[: self.batch_size])
+            if not rows:
+                return
+            for row in rows:
+                try:
+                    row.file_size = os.path.getsize(screenshot_path(row.file_path))
+                except OSError:
+                    row.file_size = 0
+            Screenshot.objects.bulk_update(rows, ["file_size"])
+
+    def _delete(self, batch):
+        """Delete one batch of (id, file_path, file_size) rows, then their files; returns the bytes freed."""
+        with transaction.atomic():
+            Screenshot.objects.filter(id__in=[row[0] for row in batch]).delete()
+        # The rows go first: if removing a file fails, a file is left over rather than a row without its file
+        for _, file_path, _ in batch:
+            try:
+                remove_screenshot_file(file_path)
+            except OSError:
+                logger.warning("Could not remove %s", file_path, exc_info=True)
+        freed = sum(row[2] or 0 for row in batch)
+        self.deleted += len(batch)
+        self.freed += freed
+        return freed
+
+    def start(self, interval):
+        """Enforce the limits every `interval` seconds in a background thread, the first time after one interval."""
+        self._thread = threading.Thread(target=self._run, args=(interval,), name="screenshot-retention", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self, interval):
+        try:
+            while not self._stopping.wait(interval):
+                try:
+                    results = self.enforce()
+                except Exception:
+                    logger.exception("Screenshot retention failed")
+                    continue
+                if results:
+                    logger.info("Screenshot retention deleted %s", results)
+        finally:
+            connection.close()  # The thread's own database connection
+
+    def stats(self):
+        return {"runs": self.runs, "deleted": self.deleted, "freed": self.freed}
+
+
+def retention_from_settings():
+    """Retention configured by STREAM_RETENTION (every camera) and STREAM_RETENTION_CAMERAS (per camera id)."""
+    return Retention(
+        default=getattr(settings, "STREAM_RETENTION", None),
+        cameras=getattr(settings, "STREAM_RETENTION_CAMERAS", None),
+        batch_size=getattr(settings, "STREAM_RETENTION_BATCH_SIZE", 500),
+    )
+
+
+_retention = None
+_retention_lock = threading.Lock()
+
+
+def start_retention():
+    """Start the background retention job once per process, if any limit is set and STREAM_RETENTION_INTERVAL isn't 0."""
+    global _retention
+    interval = getattr(settings, "STREAM_RETENTION_INTERVAL", 3600)
+    with _retention_lock:
+        if _retention is not None or not interval:
+            return _retention
+        retention = retention_from_settings()
+        if not retention.limited:
+            return None
+        retention.start(interval)
+        _retention = retention
+    return _retention
@@ -0,0 +1,182 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .detection import _average
+
+logger = logging.getLogger(__name__)
+
+POLICIES = ("round_robin", "priority")
+
+
+class ScheduledCamera:
+    """One camera's place in the detection scheduler: its pending frame, its last boxes and its numbers."""
+
+    def __init__(self, scheduler, camera_id, detect, target_fps, priority):
+        self.scheduler = scheduler
+        self.camera_id = camera_id
+        self.detect = detect  # Called with a frame prepared by the camera's detector in a scheduler thread, returns the boxes
+        self.target_fps = target_fps
+        self.priority = priority
+        self.boxes = []  # Boxes of the most recent detection, drawn on every frame until the next one
+        self.pending = None  # (prepared frame, submitted at): a single slot, a newer frame replaces it
+        self.busy = False
+        self.next_at = 0.0  # When the camera may submit again, according to its target fps
+        self.last_served = 0.0
+        self.submitted = 0
+        self.detections = 0
+        self.shed = 0
+        self.interval_ms = None  # Moving average of the time between detections
+        self.latency_ms = None  # Moving average of submit-to-boxes time
+        self.degradation = 0.0  # Moving average share of submitted frames that were shed
+        self._last_detection = None
+
+    def due(self, now=None):
+        """True if the camera's target fps allows submitting another frame."""
+        return (time.monotonic() if now is None else now) >= self.next_at
+
+    def submit(self, frame, now=None):
+        self.scheduler._submit(self, frame, time.monotonic() if now is None else now)
+
+    def close(self):
+        self.scheduler._unregister(self)
+
+    def stats(self):
+        fps = 1000 / self.interval_ms if self.interval_ms else 0.0
+        return {
+            "target_fps": self.target_fps,
+            "fps": fps,
+            "priority": self.priority,
+            "submitted": self.submitted,
+            "detections": self.detections,
+            "shed": self.shed,
+            "latency_ms": self.latency_ms,
+            # 0 while every frame the camera submits at its target fps gets detected, 1 when none do
+            "degradation": self.degradation,
+        }
+
+
+class DetectionScheduler:
+    """Fixed pool of detection threads shared fairly by every camera.
+
+    Cameras don't detect in their own capture loop any more; each submits a frame when its
+    target detection fps allows and carries on drawing the last known boxes. The `threads`
+    detection threads are the whole budget: a free thread takes the camera that has waited
+    longest since it was last served (round_robin), or the highest priority camera first
+    with ties served the same way (priority). A camera has one pending slot, so under
+    overload a newer frame replaces the one still waiting (counted as shed) instead of
+    queueing up latency, and stats() shows how far each camera falls short of its target.
+    """
+
+    def __init__(self, threads=2, policy="round_robin"):
+        if policy not in POLICIES:
+            raise ImproperlyConfigured(f"Unknown detection scheduler policy '{policy}', expected one of: {', '.join(POLICIES)}")
+        self.policy = policy
+        self._condition = threading.Condition()
+        self._cameras = set()
+        self._stopping = False
+        self._threads = [threading.Thread(target=self._run, name=f"detection-{i}", daemon=True) for i in range(threads)]
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout=5):
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def register(self, camera_id, detect, target_fps=5.0, priority=0):
+        camera = ScheduledCamera(self, camera_id, detect, target_fps, priority)
+        with self._condition:
+            self._cameras.add(camera)
+        return camera
+
+    def _unregister(self, camera):
+        with self._condition:
+            self._cameras.discard(camera)
+            camera.pending = None
+
+    def _submit(self, camera, frame, now):
+        with self._condition:
+            camera.next_at = now + 1 / camera.target_fps
+            camera.submitted += 1
+            shed = camera.pending is not None
+            if shed:
+                camera.shed += 1  # The older frame never got a thread, drop it rather than fall behind
+            camera.degradation = _average(camera.degradation, 1.0 if shed else 0.0, weight=0.1)
+            camera.pending = (frame, now)
+            self._condition.notify()
+
+    def _ready(self):
+        return [camera for camera in self._cameras if camera.pending is not None and not camera.busy]
+
+    def _take(self):
+        """Pick the next camera to serve and take its pending frame; the condition must be held."""
+        # Among equals, the camera whose pending frame is oldest goes first
+        if self.policy == "priority":
+            camera = min(self._ready(), key=lambda camera: (-camera.priority, camera.last_served, camera.pending[1]))
+        else:
+            camera = min(self._ready(), key=lambda camera: (camera.last_served, camera.pending[1]))
+        frame = camera.pending
+        camera.pending = None
+        camera.busy = True
+        camera.last_served = time.monotonic()
+        return camera, frame
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._stopping or self._ready())
+                if self._stopping:
+                    return
+                camera, (frame, submitted) = self._take()
+            try:
+                boxes = camera.detect(frame)
+            except Exception:
+                logger.exception("Detection failed for camera %s", camera.camera_id)
+                boxes = None
+            now = time.monotonic()
+            with self._condition:
+                camera.busy = False
+                if boxes is not None:
+                    camera.boxes = boxes
+                camera.detections += 1
+                camera.latency_ms = _average(camera.latency_ms, (now - submitted) * 1000)
+                if camera._last_detection is not None:
+                    camera.interval_ms = _average(camera.interval_ms, (now - camera._last_detection) * 1000)
+                camera._last_detection = now
+                if camera.pending is not None:
+                    self._condition.notify()  # A frame that arrived meanwhile can go now
+
+    def stats(self):
+        with self._condition:
+            return {
+                "threads": len(self._threads),
+                "policy": self.policy,
+                "cameras": {camera.camera_id: camera.stats() for camera in self._cameras},
+            }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_detection_scheduler():
+    """Return the process-wide detection scheduler, or None when every camera detects in its own capture loop."""
+    global _scheduler
+    threads = getattr(settings, "STREAM_DETECT_SCHEDULER_THREADS", 0)
+    if not threads:
+        return None
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                scheduler = DetectionScheduler(threads, getattr(settings, "STREAM_DETECT_SCHEDULER_POLICY", "round_robin"))
+                scheduler.start()
+                _scheduler = scheduler
+    return _scheduler
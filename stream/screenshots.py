@@ -0,0 +1,163 @@
+import base64
+import datetime
+import zipfile
+
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Screenshot
+from .thumbnails import screenshot_path
+
+DEFAULT_PAGE_SIZE = 24
+MAX_PAGE_SIZE = 200
+
+# Query parameters understood by filter_screenshots
+FILTERS = ("camera", "search", "camera_min", "camera_max", "since", "until")
+
+
+def screenshot_file_name(camera_id, kind="screenshot", when=None):
+    """Storage path of a new screenshot, relative to MEDIA_ROOT/screenshots.
+
+    Files are sharded per camera and per day (camera_3/2024-05-01/...), so no directory
+    grows without bound, and names go down to the microsecond, so two captures within
+    the same second don't overwrite each other.
+    """
+    when = timezone.now() if when is None else when
+    return f"camera_{camera_id}/{when:%Y-%m-%d}/camera_{camera_id}_{kind}_{when:%Y-%m-%d_%H-%M-%S-%f}.jpg"
+
+
+def parse_camera_ids(value):
+    """Parse "1,2, 5" into [1, 2, 5]; raises ValueError on anything that isn't a camera id."""
+    return [int(part) for part in value.split(",") if part.strip()]
+
+
+def parse_time(value):
+    """Parse an ISO date or datetime (as sent by a datetime-local input) into an aware datetime."""
+    parsed = parse_datetime(value)
+    if parsed is None:
+        try:
+            parsed = datetime.datetime.combine(datetime.date.fromisoformat(value), datetime.time.min)
+        except ValueError:
+            raise ValueError(f"Invalid date or time: '{value}'")
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def filter_screenshots(params, queryset=None):
+    """Apply the gallery filters from query parameters; raises ValueError on malformed values.
+
+    Works on any queryset with camera_id and timestamp fields (Screenshot by default, also Detection).
+
+    camera (or the gallery's search box) - exact camera ids, comma separated
+    camera_min / camera_max - camera id range
+    since / until - time window, ISO date or datetime (until is exclusive)
+
+    Every filter is an exact or range comparison, so it can be served by the
+    (camera_id, timestamp) and (timestamp) indexes.
+    """
+    queryset = Screenshot.objects.all() if queryset is None else queryset
+    camera_ids = params.get("camera") or params.get("search")
+    if camera_ids:
+        queryset = queryset.filter(camera_id__in=parse_camera_ids(camera_ids))
+    if params.get("camera_min"):
+        queryset = queryset.filter(camera_id__gte=int(params["camera_min"]))
+    if params.get("camera_max"):
+        queryset = queryset.filter(camera_id__lte=int(params["camera_max"]))
+    if params.get("since"):
+        queryset = queryset.filter(timestamp__gte=parse_time(params["since"]))
+    if params.get("until"):
+        queryset = queryset.filter(timestamp__lt=parse_time(params["until"]))
+    return queryset
+
+
+def encode_cursor(screenshot):
+    """Opaque cursor pointing just after `screenshot` in newest-first order."""
+    raw = f"{screenshot.timestamp.isoformat()}|{screenshot.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        timestamp, screenshot_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return parse_time(timestamp), int(screenshot_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+
+
+def keyset_page(queryset, cursor=None, page_size=DEFAULT_PAGE_SIZE):
+    """Return (screenshots, next_cursor) for one page, newest first.
+
+    Instead of OFFSET, which has to walk every skipped row, the page starts right after
+    the (timestamp, id) of the previous page's last row, so every page costs one index
+    seek however deep it is.
+    """
+    queryset = queryset.order_by("-timestamp", "-id")
+    if cursor:
+        timestamp, screenshot_id = decode_cursor(cursor)
+        # Written as a range plus an exclusion rather than an OR, so the database can seek the timestamp index
+        queryset = queryset.filter(timestamp__lte=timestamp).exclude(timestamp=timestamp, id__gte=screenshot_id)
+    rows = list(queryset[: page_size + 1])  # One extra row tells whether there is a next page
+    if len(rows) > page_size:
+        return rows[:page_size], encode_cursor(rows[page_size - 1])
+    return rows, None
+
+
+def parse_page_size(value):
+    if not value:
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(int(value), MAX_PAGE_SIZE))
+
+
+class _ZipStream:
+    """Write-only file object for zipfile that keeps what was written until it is taken.
+
+    It can't seek, so zipfile writes each entry's sizes after its data and the archive can
+    be sent while it is being built.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def zip_screenshots(screenshots, chunk_size=64 * 1024):
+    """Yield a ZIP archive of the screenshots' files piece by piece, in constant memory.
+
+    Rows are read from the database in batches and every file is copied through in
+    `chunk_size` blocks. JPEGs don't compress, so they are stored as they are. Files
+    missing on disk are left out.
+    """
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, "w", zipfile.ZIP_STORED) as archive:
+        for file_path, timestamp in screenshots.values_list("file_path", "timestamp").iterator(chunk_size=500):
+            try:
+                f = open(screenshot_path(file_path), "rb")
+            except FileNotFoundError:
+                continue
+            with f:
+                info = zipfile.ZipInfo(file_path, date_time=timezone.localtime(timestamp).timetuple()[:6])
+                with archive.open(info, "w") as entry:
+                    while True:
+                        block = f.read(chunk_size)
+                        if not block:
+                            break
+                        entry.write(block)
+                        yield stream.take()
+    yield stream.take()  # The central directory, written when the archive closes
@@ -0,0 +1,129 @@
+import time
+
+import cv2
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+
+class _Pacer:
+    """Sleeps so frames come out at `fps` like a real camera; fps=None means as fast as possible."""
+
+    def __init__(self, fps):
+        self.interval = 1 / fps if fps else 0.0
+        self._next = None
+
+    def wait(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        if self._next is None or now - self._next > self.interval:  # First frame, or the reader fell behind
+            self._next = now
+        elif self._next > now:
+            time.sleep(self._next - now)
+        self._next += self.interval
+
+
+class SyntheticSource:
+    """Frame source with the cv2.VideoCapture interface that draws frames instead of reading a device.
+
+    A bright square moves across a fixed noisy background, so detection and encoding get
+    realistic work. With `moving=False` the square stays put (an idle camera). `frames`
+    limits how many frames are produced before read() reports the end, like an unplugged camera.
+    """
+
+    def __init__(self, width=640, height=480, fps=30, seed=0, moving=True, frames=None):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.moving = moving
+        self.frames = frames
+        self.reads = 0
+        self._background = np.random.default_rng(seed).integers(0, 64, (height, width, 3), dtype=np.uint8)
+        self._size = min(width, height) // 4
+        self._pacer = _Pacer(fps)
+        self._open = True
+
+    def isOpened(self):
+        return self._open
+
+    def frame(self, index):
+        """Frame number `index`, without pacing."""
+        frame = self._background.copy()
+        step = index if self.moving else 0
+        x = (step * 7) % (self.width - self._size)
+        y = (step * 3) % (self.height - self._size)
+        frame[y:y + self._size, x:x + self._size] = 200
+        return frame
+
+    def read(self):
+        if not self._open or (self.frames is not None and self.reads >= self.frames):
+            return False, None
+        self._pacer.wait()
+        self.reads += 1
+        return True, self.frame(self.reads)
+
+    def release(self):
+        self._open = False
+
+
+class FileReplaySource:
+    """Replay a video file as a camera: resized to `width`x`height`, paced at `fps`, looping at the end.
+
+    fps=None plays at the file's own frame rate; width or height None keeps that dimension.
+    """
+
+    def __init__(self, path, width=None, height=None, fps=None, loop=True):
+        self.path = path
+        self.loop = loop
+        self.reads = 0
+        self._capture = cv2.VideoCapture(path)
+        if not self._capture.isOpened():
+            raise ImproperlyConfigured(f"Could not open video file {path}")
+        self.fps = fps or self._capture.get(cv2.CAP_PROP_FPS) or 30
+        self.width = width
+        self.height = height
+        self._pacer = _Pacer(self.fps)
+
+    def isOpened(self):
+        return self._capture.isOpened()
+
+    def read(self):
+        success, frame = self._capture.read()
+        if not success and self.loop and self.reads:
+            self._capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            success, frame = self._capture.read()
+        if not success:
+            return False, None
+        if self.width or self.height:
+            height, width = frame.shape[:2]
+            size = (self.width or width, self.height or height)
+            if size != (width, height):
+                frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        self._pacer.wait()
+        self.reads += 1
+        return True, frame
+
+    def release(self):
+        self._capture.release()
+
+
+SOURCES = ("device", "synthetic", "file")
+
+
+def open_source(device_id):
+    """Open the frame source of a camera as configured by STREAM_SOURCE.
+
+    "device" (default) opens the real camera. "synthetic" and "file" stand in for it with
+    generated frames or a replayed video, configured by STREAM_SOURCE_OPTIONS, so the whole
+    pipeline runs and can be measured without a camera attached.
+    """
+    kind = getattr(settings, "STREAM_SOURCE", "device")
+    options = getattr(settings, "STREAM_SOURCE_OPTIONS", {})
+    if kind == "device":
+        return cv2.VideoCapture(device_id)
+    if kind == "synthetic":
+        return SyntheticSource(seed=device_id, **options)  # Every camera gets its own background
+    if kind == "file":
+        return FileReplaySource(**options)
+    raise ImproperlyConfigured(f"Unknown STREAM_SOURCE '{kind}', expected one of: {', '.join(SOURCES)}")
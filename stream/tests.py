@@ -1,15 +1,73 @@
-from django.test import TestCase
-from stream.views import create_camera_instance, release_camera_instance, list_connected_cameras, camera_instances
+from django.test import Client, TestCase
+from stream.views import create_camera_instance, release_camera_instance, list_connected_cameras, camera_instances, camera_registry
+from stream.capture import MULTIPART_HEADER, CaptureWorker, EncodedFrameCache, Frame, FrameHistory
+from stream.models import Detection, RecordingSegment, Screenshot
+from stream.persistence import DetectionWriter, FileRemover, ScreenshotWriter
+from stream.recording import CameraRecorder, RecordingWriter, SegmentReader, find_frame, iter_recording, segment_path
+from stream.screenshots import filter_screenshots, keyset_page, screenshot_file_name
+from stream.retention import Retention
+from stream.thumbnails import ensure_thumbnail, thumbnail_path
+from stream.discovery import CameraDiscovery
+from stream.registry import CameraRegistry
+from stream.sources import FileReplaySource, SyntheticSource, open_source
+from django.core.management import call_command
+import io
+import zipfile
+import datetime
+from unittest import mock
+import queue
+from stream.detection import CascadePool, DetectionCadence, detect_scaled, get_cascade_pool
+from stream.detectors import CascadeDetector, DnnDetector, get_detector, get_dnn_detector
+from stream.engine import DetectionEngine, get_detection_engine
+from stream.processing import AutoCapture, FrameProcessor
+from stream.scheduling import DetectionScheduler
+from stream.mosaic import Mosaic
+from stream.motion import MotionGate
+from stream import metrics, views
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.test import override_settings
+import os
+import shutil
+import tempfile
+import numpy as np
+import asyncio
+import threading
+import time
 import cv2
 
+
+class FakeCapture:
+    """Заглушка cv2.VideoCapture, которая отдаёт заданное число синтетических кадров."""
+
+    def __init__(self, frames=50, shape=(48, 64, 3)):
+        self.frames = frames
+        self.shape = shape
+        self.reads = 0
+        self.released = False
+        self.gate = threading.Semaphore(0)  # Тест сам решает, когда камера "выдаёт" кадр
+
+    def read(self):
+        if self.reads >= self.frames or not self.gate.acquire(timeout=0.5):
+            return False, None
+        self.reads += 1
+        return True, np.full(self.shape, self.reads % 256, dtype=np.uint8)
+
+    def release(self):
+        self.released = True
+
 class StreamUnitTests(TestCase):
     def setUp(self):
         # Инициализация перед тестами
         self.mock_camera_id = 0
+        # Без льготного периода камера закрывается сразу после последней аренды
+        patcher = mock.patch.object(camera_registry, "grace", 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
 
     def tearDown(self):
         # Освобождение ресурсов после тестов
-        if self.mock_camera_id in camera_instances:
+        while self.mock_camera_id in camera_instances and camera_registry.leases(self.mock_camera_id):
             release_camera_instance(self.mock_camera_id)
 
     def test_list_connected_cameras_mock(self):
@@ -23,7 +81,7 @@ class StreamUnitTests(TestCase):
         """Тест создания камеры."""
         create_camera_instance(self.mock_camera_id)
         self.assertIn(self.mock_camera_id, camera_instances)
-        self.assertIsInstance(camera_instances[self.mock_camera_id], cv2.VideoCapture)
+        self.assertIsInstance(camera_instances[self.mock_camera_id], CaptureWorker)
 
     def test_release_camera_instance(self):
         """Тест освобождения камеры."""
@@ -89,4 +147,1666 @@ class StreamUnitTests(TestCase):
         release_camera_instance(nonexistent_camera_id)  # Попытка освободить
         self.assertNotIn(nonexistent_camera_id, camera_instances)  # Камеры там быть не должно
         
+
+class CaptureWorkerTests(TestCase):
+    def test_viewers_share_frames(self):
+        """Несколько зрителей получают один и тот же обработанный кадр, камера читается один раз."""
+        capture = FakeCapture(frames=3)
+        processed = []
+        worker = CaptureWorker(0, capture, process=lambda frame: processed.append(frame) or ())
+        worker.start()
+        capture.gate.release()
+        first = worker.wait_for_frame(0, timeout=2)
+        second = worker.wait_for_frame(0, timeout=2)
+        self.assertIs(first, second)
+        self.assertEqual(first.seq, 1)
+        self.assertEqual(capture.reads, 1)
+        self.assertEqual(len(processed), 1)
+        worker.stop()
+
+    def test_slow_viewer_gets_latest_frame(self):
+        """Медленный зритель пропускает устаревшие кадры и получает последний."""
+        capture = FakeCapture(frames=3)
+        worker = CaptureWorker(0, capture)
+        worker.start()
+        for _ in range(3):
+            capture.gate.release()
+        worker.join(timeout=5)
+        frame = worker.wait_for_frame(0, timeout=0)
+        self.assertEqual(frame.seq, 3)
+        self.assertIsNone(worker.wait_for_frame(frame.seq, timeout=0))
+
+    def test_stop_releases_capture(self):
+        """Остановка воркера освобождает устройство."""
+        capture = FakeCapture()
+        worker = CaptureWorker(0, capture)
+        worker.start()
+        worker.stop()
+        self.assertFalse(worker.is_alive())
+        self.assertTrue(capture.released)
+        self.assertIsNone(worker.wait_for_frame(0, timeout=0))
+    def test_async_viewer_waits_on_event_loop(self):
+        """Асинхронный зритель получает тот же кадр, что и синхронный, не занимая поток."""
+        capture = FakeCapture(frames=2)
+        worker = CaptureWorker(0, capture)
+        worker.start()
+        self.addCleanup(worker.stop)
+
+        async def watch():
+            waiting = asyncio.ensure_future(worker.wait_for_frame_async(0, timeout=2))
+            await asyncio.sleep(0.05)
+            self.assertFalse(waiting.done())  # Кадров ещё нет, зритель ждёт
+            capture.gate.release()
+            return await waiting
+
+        frame = asyncio.run(watch())
+        self.assertEqual(frame.seq, 1)
+        self.assertIs(frame, worker.wait_for_frame(0, timeout=0))
+
+    def test_async_viewer_times_out(self):
+        """Если камера не отдаёт кадры, асинхронное ожидание завершается по таймауту."""
+        capture = FakeCapture(frames=1)
+        worker = CaptureWorker(0, capture)
+        worker.start()
+        self.addCleanup(worker.stop)
+        self.assertIsNone(asyncio.run(worker.wait_for_frame_async(0, timeout=0.05)))
+
+    def test_subscription_counts_dropped_frames(self):
+        """Медленный подписчик получает только новейший кадр, пропущенные кадры считаются."""
+        capture = FakeCapture(frames=5)
+        worker = CaptureWorker(0, capture)
+        worker.start()
+        subscription = worker.subscribe()
+        self.assertEqual(worker.viewer_count, 1)
+        capture.gate.release()
+        self.assertEqual(subscription.get(timeout=2).seq, 1)
+        for _ in range(4):
+            capture.gate.release()
+        worker.join(timeout=5)
+        self.assertEqual(subscription.get(timeout=0).seq, 5)
+        self.assertEqual(subscription.stats(), {"max_fps": None, "delivered": 2, "dropped": 3})
+        subscription.close()
+        self.assertEqual(worker.viewer_count, 0)
+
+    def test_subscription_fps_cap(self):
+        """Ограничение fps выдерживает паузу между кадрами, не задерживая захват."""
+        capture = FakeCapture(frames=100)
+        worker = CaptureWorker(0, capture)
+        worker.start()
+        self.addCleanup(worker.stop)
+        subscription = worker.subscribe(max_fps=10)
+        capture.gate.release()
+        subscription.get(timeout=2)
+        started = time.monotonic()
+        for _ in range(3):
+            capture.gate.release()
+        frame = subscription.get(timeout=2)
+        self.assertGreaterEqual(time.monotonic() - started, 0.09)
+        self.assertEqual(frame.seq, 4)  # За время паузы камера выдала 3 кадра, зритель получил последний
+        self.assertEqual(subscription.dropped, 2)
+
+    def test_video_feed_rejects_bad_fps(self):
+        """Некорректный fps возвращает 400."""
+        self.assertEqual(self.client.get("/video_feed/0/?fps=abc").status_code, 400)
+        self.assertEqual(self.client.get("/video_feed/0/?fps=0").status_code, 400)
+
+    def test_encoded_cache_peek(self):
+        """peek возвращает только уже закодированные кадры и никогда не кодирует сам."""
+        cache = EncodedFrameCache()
+        frame = Frame(1, np.zeros((48, 64, 3), dtype=np.uint8), (), 0.0)
+        self.assertIsNone(cache.peek(frame))
+        chunk = cache.get(frame)
+        self.assertIs(cache.peek(frame), chunk)
+        self.assertEqual(cache.encodes, 1)
+
+    def test_encoded_chunk_shared_between_viewers(self):
+        """Кадр кодируется в JPEG один раз, все зрители получают один и тот же объект bytes."""
+        cache = EncodedFrameCache(size=2)
+        frame = Frame(1, np.zeros((48, 64, 3), dtype=np.uint8), (), 0.0)
+        first = cache.get(frame)
+        self.assertTrue(first.startswith(MULTIPART_HEADER))
+        self.assertTrue(first.endswith(b"\r\n"))
+        self.assertIs(cache.get(frame), first)
+        self.assertEqual(cache.encodes, 1)
+        self.assertEqual(cache.hits, 1)
+
+    def test_encoded_cache_keeps_newest_frames(self):
+        """Кэш хранит только последние кадры."""
+        cache = EncodedFrameCache(size=2)
+        image = np.zeros((48, 64, 3), dtype=np.uint8)
+        frames = [Frame(seq, image, (), 0.0) for seq in (1, 2, 3)]
+        for frame in frames:
+            cache.get(frame)
+        cache.get(frames[0])
+        self.assertEqual(cache.encodes, 4)
+
+    def test_encoded_cache_profiles(self):
+        """Каждый профиль кодируется отдельно: уменьшенный кадр для сетки, полный по запросу."""
+        profiles = {"full": {"width": None, "quality": 90}, "thumb": {"width": 32, "quality": 50}}
+        cache = EncodedFrameCache(profiles)
+        frame = Frame(1, np.random.randint(0, 255, (48, 64, 3), dtype=np.uint8), (), 0.0)
+        full = cache.get(frame, "full")
+        thumb = cache.get(frame, "thumb")
+        self.assertIs(cache.get(frame, "thumb"), thumb)
+        self.assertEqual(cache.encodes, 2)
+        jpeg = np.frombuffer(thumb[len(MULTIPART_HEADER):-2], dtype=np.uint8)
+        self.assertEqual(cv2.imdecode(jpeg, cv2.IMREAD_COLOR).shape, (24, 32, 3))
+        self.assertLess(len(thumb), len(full))
+
+    def test_video_feed_rejects_unknown_profile(self):
+        """Неизвестный профиль возвращает 400, не открывая камеру."""
+        response = self.client.get("/video_feed/0/?profile=huge")
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn(0, camera_instances)
+
+
+class CameraRegistryTests(TestCase):
+    class StubWorker:
+        def __init__(self, device_id):
+            self.device_id = device_id
+            self.running = True
+
+        def stop(self):
+            self.running = False
+
+    def setUp(self):
+        self.opened = []
+
+    def open_worker(self, device_id):
+        worker = self.StubWorker(device_id)
+        self.opened.append(worker)
+        return worker
+
+    def test_closes_after_last_lease(self):
+        """Камера закрывается только когда отпущена последняя аренда."""
+        registry = CameraRegistry(self.open_worker, grace=0)
+        first = registry.acquire(1)
+        second = registry.acquire(1)
+        self.assertIs(first.worker, second.worker)
+        first.release()
+        first.release()  # Повторное освобождение ничего не делает
+        self.assertTrue(second.worker.running)
+        self.assertEqual(registry.leases(1), 1)
+        second.release()
+        self.assertFalse(second.worker.running)
+        self.assertNotIn(1, registry.cameras)
+        self.assertEqual((registry.opens, registry.closes), (1, 1))
+
+    def test_warm_reopen_within_grace(self):
+        """Аренда в течение льготного периода переиспользует открытую камеру."""
+        registry = CameraRegistry(self.open_worker, grace=0.2)
+        with registry.acquire(1) as lease:
+            worker = lease.worker
+        self.assertTrue(registry.stats()["devices"][1]["idle"])
+        with registry.acquire(1) as lease:
+            self.assertIs(lease.worker, worker)
+        self.assertEqual(registry.warm_reopens, 1)
+        self.assertEqual(len(self.opened), 1)
+        time.sleep(0.5)
+        self.assertFalse(worker.running)
+        self.assertNotIn(1, registry.cameras)
+        self.assertEqual(registry.stats()["closes"], 1)
+
+    def test_shared_device(self):
+        """Несколько камер на одном устройстве (режим MOCK) делят один поток захвата."""
+        registry = CameraRegistry(self.open_worker, device_for=lambda camera_id: 0, grace=0)
+        first = registry.acquire(1)
+        second = registry.acquire(2)
+        self.assertIs(registry.cameras[1], registry.cameras[2])
+        first.release()
+        self.assertTrue(second.worker.running)
+        second.release()
+        self.assertEqual(registry.cameras, {})
+        stats = registry.stats()
+        self.assertEqual((stats["opens"], stats["closes"]), (1, 1))
+        self.assertIsNotNone(stats["average_open_seconds"])
+
+    def test_in_use_is_a_snapshot(self):
+        """Список открытых камер — копия, сделанная под блокировкой."""
+        registry = CameraRegistry(self.open_worker, grace=0)
+        with registry.acquire(1), registry.acquire(3):
+            in_use = registry.in_use()
+        self.assertEqual(sorted(in_use), [1, 3])
+        self.assertEqual(registry.in_use(), [])
+
+    def test_dead_idle_worker_is_replaced(self):
+        """Остановившаяся камера без аренд при следующей аренде открывается заново."""
+        registry = CameraRegistry(self.open_worker, grace=10)
+        with registry.acquire(1) as lease:
+            lease.worker.running = False  # Устройство отвалилось
+        with registry.acquire(1) as lease:
+            self.assertIs(lease.worker, self.opened[1])
+        self.assertEqual(registry.opens, 2)
+
+    def test_replaced_worker_is_detached(self):
+        """Вместе с мёртвым воркером забываются все камеры устройства, закрытие учитывается."""
+        registry = CameraRegistry(self.open_worker, device_for=lambda camera_id: 0, grace=10)
+        with registry.acquire(1), registry.acquire(2) as lease:
+            lease.worker.running = False
+        with registry.acquire(2) as lease:
+            self.assertIs(lease.worker, self.opened[1])
+            self.assertEqual(registry.cameras, {2: self.opened[1]})
+        self.assertEqual((registry.opens, registry.closes), (2, 1))
+
+    def test_slow_open_does_not_block_other_devices(self):
+        """Пока устройство медленно открывается, другие камеры и статистика доступны, а ждущие получают тот же воркер."""
+        release = threading.Event()
+
+        def open_worker(device_id):
+            if device_id == 1:
+                release.wait(2)
+            return self.open_worker(device_id)
+
+        registry = CameraRegistry(open_worker, grace=0)
+        leases = []
+        threads = [threading.Thread(target=lambda: leases.append(registry.acquire(1))) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.05)
+        with registry.acquire(2) as lease:  # Не ждёт устройство 1
+            self.assertTrue(lease.worker.running)
+        registry.stats()
+        self.assertEqual(leases, [])
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertIs(leases[0].worker, leases[1].worker)
+        self.assertEqual(registry.leases(1), 2)
+        self.assertEqual(registry.opens, 2)
+
+    def test_release_endpoint_keeps_other_viewers(self):
+        """Запрос release_camera не закрывает камеру, которую смотрят другие."""
+        with mock.patch("stream.views.start_capture_worker", side_effect=self.open_worker):
+            lease = camera_registry.acquire(0)
+            try:
+                response = self.client.get("/release_camera/0/")
+                self.assertEqual(response.json()["leases"], 1)
+                self.assertTrue(lease.worker.running)
+            finally:
+                with mock.patch.object(camera_registry, "grace", 0):
+                    lease.release()
+        self.assertFalse(lease.worker.running)
+
+
+class MotionGateTests(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.background = rng.integers(0, 64, (240, 320, 3), dtype=np.uint8)
+
+    def noisy(self, seed):
+        """Тот же фон с шумом сенсора."""
+        noise = np.random.default_rng(seed).integers(-4, 5, self.background.shape)
+        return np.clip(self.background + noise, 0, 255).astype(np.uint8)
+
+    def test_static_scene(self):
+        """Шум сенсора не считается движением, первый кадр всегда проходит."""
+        gate = MotionGate()
+        self.assertTrue(gate.update(self.noisy(1)))
+        for seed in range(2, 10):
+            self.assertFalse(gate.update(self.noisy(seed)))
+        self.assertLess(gate.score, gate.threshold)
+        stats = gate.stats()
+        self.assertEqual((stats["moving_frames"], stats["static_frames"]), (1, 8))
+        self.assertEqual(stats["max"], 1.0)
+
+    def test_motion(self):
+        """Появившийся объект даёт движение."""
+        gate = MotionGate()
+        gate.update(self.noisy(1))
+        frame = self.noisy(2)
+        frame[60:120, 80:160] = 220
+        self.assertTrue(gate.update(frame))
+        self.assertGreater(gate.score, 0.05)
+
+    def test_slow_change_adds_up(self):
+        """Медленные изменения копятся относительно последнего пропущенного кадра."""
+        gate = MotionGate()
+        gate.update(self.background)
+        moved = [gate.update(np.clip(self.background.astype(int) + step * 4, 0, 255).astype(np.uint8)) for step in range(1, 8)]
+        self.assertFalse(moved[0])
+        self.assertTrue(any(moved))
+
+    def test_worker_skips_static_frames(self):
+        """Статичные кадры не обрабатываются, а keepalive повторяет уже закодированный кадр."""
+        capture = FakeCapture(frames=3)  # Кадры отличаются на единицу яркости — сцена статична
+        processed = []
+        gate = MotionGate(keepalive=60)
+        worker = CaptureWorker(0, capture, process=lambda frame: processed.append(frame) or (), motion=gate)
+        worker.start()
+        self.addCleanup(worker.stop)
+        capture.gate.release()
+        first = worker.wait_for_frame(0, timeout=2)
+        chunk = worker.encoded.get(first)
+        capture.gate.release()
+        self.assertIsNone(worker.wait_for_frame(first.seq, timeout=0.3))
+        self.assertEqual(worker.static_skipped, 1)
+
+        gate.keepalive = 0  # Следующий статичный кадр отправляется как keepalive
+        capture.gate.release()
+        keepalive = worker.wait_for_frame(first.seq, timeout=2)
+        self.assertEqual(keepalive.seq, 2)
+        self.assertIs(keepalive.image, first.image)
+        self.assertIs(worker.encoded.get(keepalive), chunk)
+        self.assertEqual(worker.encoded.encodes, 1)
+        self.assertEqual(len(processed), 1)
+
+
+class MetricsTests(TestCase):
+    def test_histogram_render(self):
+        """Гистограмма выводится в текстовом формате Prometheus с накопительными корзинами."""
+        histogram = metrics.Histogram("test_seconds", "Test", ["stage"], buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.5, 3.0):
+            histogram.observe(value, "read")
+        lines = histogram.render()
+        self.assertIn("# TYPE test_seconds histogram", lines)
+        self.assertIn('test_seconds_bucket{stage="read",le="0.1"} 1', lines)
+        self.assertIn('test_seconds_bucket{stage="read",le="1.0"} 3', lines)
+        self.assertIn('test_seconds_bucket{stage="read",le="+Inf"} 4', lines)
+        self.assertIn('test_seconds_count{stage="read"} 4', lines)
+        self.assertIn('test_seconds_sum{stage="read"} 4.05', lines)
+
+    def test_counter_labels_escaped(self):
+        counter = metrics.Counter("test_total", "Test", ["camera"])
+        counter.inc('a"b')
+        counter.inc('a"b', amount=2)
+        self.assertEqual(counter.render()[-1], 'test_total{camera="a\\"b"} 3')
+
+    def test_pipeline_stages_exported(self):
+        """Этапы конвейера и задержка кадра попадают в /metrics."""
+        reads = metrics.STAGE_SECONDS.count("read")
+        capture = FakeCapture(frames=2)
+        worker = CaptureWorker(0, capture, process=FrameProcessor())
+        worker.start()
+        self.addCleanup(worker.stop)
+        capture.gate.release()
+        frame = worker.wait_for_frame(0, timeout=2)
+        worker.encoded.get(frame)
+        self.assertGreater(metrics.STAGE_SECONDS.count("read"), reads)
+
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        body = response.content.decode()
+        for stage in ("read", "gray", "detect", "draw", "encode"):
+            self.assertIn(f'stream_stage_seconds_count{{stage="{stage}"}}', body)
+        self.assertIn('stream_frames_total{device="0"}', body)
+        self.assertIn("# TYPE stream_viewers gauge", body)
+
+    def test_view_timings(self):
+        """Время обработки представлений записывается по имени представления."""
+        before = metrics.VIEW_SECONDS.count("screenshots_list")
+        self.client.get("/screenshots/")
+        self.assertEqual(metrics.VIEW_SECONDS.count("screenshots_list"), before + 1)
+
+
+class FrameSourceTests(TestCase):
+    def test_synthetic_source(self):
+        """Синтетический источник отдаёт кадры нужного размера с заданной частотой и заканчивается после frames."""
+        source = SyntheticSource(width=160, height=120, fps=50, frames=5)
+        started = time.monotonic()
+        frames = [source.read() for _ in range(6)]
+        self.assertGreaterEqual(time.monotonic() - started, 0.07)  # 5 кадров при 50 fps
+        self.assertEqual([success for success, _ in frames], [True] * 5 + [False])
+        self.assertEqual(frames[0][1].shape, (120, 160, 3))
+        self.assertFalse(np.array_equal(frames[0][1], frames[1][1]))  # Квадрат движется
+
+    def test_static_synthetic_source(self):
+        source = SyntheticSource(width=160, height=120, fps=None, moving=False)
+        self.assertTrue(np.array_equal(source.read()[1], source.read()[1]))
+
+    def test_file_replay(self):
+        """Видеофайл проигрывается по кругу в заданном разрешении."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "clip.avi")
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 10, (160, 120))
+        source = SyntheticSource(width=160, height=120, fps=None)
+        for i in range(3):
+            writer.write(source.frame(i))
+        writer.release()
+
+        replay = FileReplaySource(path, width=80, height=60, fps=1000)
+        frames = [replay.read() for _ in range(7)]
+        replay.release()
+        self.assertTrue(all(success for success, _ in frames))
+        self.assertEqual(frames[0][1].shape, (60, 80, 3))
+        self.assertEqual(replay.reads, 7)
+
+    def test_open_source_from_settings(self):
+        with override_settings(STREAM_SOURCE="synthetic", STREAM_SOURCE_OPTIONS={"width": 64, "height": 48}):
+            self.assertIsInstance(open_source(3), SyntheticSource)
+        with override_settings(STREAM_SOURCE="webcam"):
+            with self.assertRaises(ImproperlyConfigured):
+                open_source(0)
+
+    def test_video_feed_without_camera(self):
+        """С синтетическим источником весь конвейер работает без камеры: /video_feed/ отдаёт JPEG."""
+        with mock.patch.object(camera_registry, "grace", 0), override_settings(
+            STREAM_SOURCE="synthetic", STREAM_SOURCE_OPTIONS={"width": 160, "height": 120, "fps": 30}
+        ):
+            response = self.client.get("/video_feed/0/")
+            chunk = next(iter(response.streaming_content))
+            response.close()  # Закрывает генератор и освобождает камеру
+        self.assertTrue(chunk.startswith(MULTIPART_HEADER))
+        jpeg = np.frombuffer(chunk[len(MULTIPART_HEADER):-2], dtype=np.uint8)
+        self.assertEqual(cv2.imdecode(jpeg, cv2.IMREAD_COLOR).shape, (120, 160, 3))
+        for _ in range(100):
+            if 0 not in camera_instances:
+                break
+            time.sleep(0.01)
+        self.assertNotIn(0, camera_instances)
+
+
+class FrameHistoryTests(TestCase):
+    def test_keeps_last_seconds(self):
+        """Кольцевой буфер хранит только кадры за последние N секунд."""
+        history = FrameHistory(seconds=1.0, max_frames=100)
+        for i in range(30):
+            history.append(Frame(i + 1, None, (), i * 0.125))
+        self.assertEqual([frame.seq for frame in history.last()], list(range(22, 31)))
+        self.assertEqual([frame.seq for frame in history.last(0.25)], [28, 29, 30])
+
+    def test_max_frames(self):
+        """Размер буфера ограничен max_frames."""
+        history = FrameHistory(seconds=60, max_frames=5)
+        for i in range(10):
+            history.append(Frame(i + 1, None, (), i * 0.01))
+        self.assertEqual(len(history), 5)
+
+    def test_max_bytes(self):
+        """Размер буфера ограничен объёмом изображений, а без STREAM_HISTORY_SECONDS кадры не хранятся вовсе."""
+        image = np.zeros((48, 64, 3), dtype=np.uint8)
+        history = FrameHistory(seconds=60, max_bytes=image.nbytes * 3)
+        for i in range(10):
+            history.append(Frame(i + 1, image.copy(), (), i * 0.01))
+        self.assertEqual([frame.seq for frame in history.last()], [8, 9, 10])
+        self.assertEqual(history.bytes, image.nbytes * 3)
+        disabled = FrameHistory()
+        disabled.append(Frame(1, image, (), 0.0))
+        self.assertEqual(len(disabled), 0)
+
+
+class ScreenshotFromBufferTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.capture = FakeCapture(frames=10)
+        self.worker = CaptureWorker(42, self.capture, history_seconds=5)
+        self.worker.start()
+        for _ in range(3):
+            self.capture.gate.release()
+        self.assertIsNotNone(self.worker.wait_for_frame(2, timeout=2))
+        self.addCleanup(self.worker.stop)
+        # Камера 42 "стримится": аренда держит её открытой на всё время теста
+        for patcher in (mock.patch.object(camera_registry, "grace", 0), mock.patch("stream.views.start_capture_worker", return_value=self.worker)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        create_camera_instance(42)
+        self.addCleanup(release_camera_instance, 42)
+
+    def test_screenshot_uses_latest_frame(self):
+        """Скриншот берётся из последнего обработанного кадра, без лишнего чтения камеры."""
+        reads = self.capture.reads
+        writer = ScreenshotWriter()
+        with override_settings(MEDIA_ROOT=self.media_root), mock.patch("stream.views.get_screenshot_writer", return_value=writer):
+            response = self.client.post("/save_screenshot/42/")
+            self.assertEqual(response.status_code, 202)
+            job_id = response.json()["job_id"]
+            self.assertEqual(self.client.get(f"/screenshot_status/{job_id}/").json()["status"], "queued")
+            writer.flush()
+            status = self.client.get(f"/screenshot_status/{job_id}/").json()
+        self.assertEqual(self.capture.reads, reads)
+        screenshot = Screenshot.objects.get(camera_id=42)
+        self.assertEqual(status["status"], "saved")
+        self.assertEqual(status["screenshot_id"], screenshot.id)
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, "screenshots", screenshot.file_path)))
+
+    def test_export_clip(self):
+        """Экспорт клипа пишет буферизованные кадры в видеофайл."""
+        with override_settings(MEDIA_ROOT=self.media_root):
+            response = self.client.post("/export_clip/42/?seconds=10")
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["frames"], 3)
+        self.assertTrue(os.path.getsize(os.path.join(self.media_root, data["file_path"])) > 0)
+
+    def test_export_clip_without_stream(self):
+        """Для камеры без потока экспортировать нечего."""
+        self.assertEqual(self.client.post("/export_clip/43/").status_code, 404)
+
+
+class ScreenshotWriterTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.image = np.zeros((48, 64, 3), dtype=np.uint8)
+
+    def test_batch_insert(self):
+        """Очередь записывается пачками: файлы на диске, строки вставлены одним запросом."""
+        writer = ScreenshotWriter(batch_size=10)
+        jobs = [writer.submit(i % 2, self.image, f"shot_{i}.jpg") for i in range(5)]
+        with override_settings(MEDIA_ROOT=self.media_root), self.assertNumQueries(3):  # SAVEPOINT, INSERT, RELEASE
+            writer.flush()
+        self.assertEqual(Screenshot.objects.count(), 5)
+        for job in jobs:
+            status = writer.status(job.id)
+            self.assertEqual(status["status"], "saved")
+            self.assertTrue(Screenshot.objects.filter(id=status["screenshot_id"], file_path=job.file_name).exists())
+            self.assertTrue(os.path.exists(os.path.join(self.media_root, "screenshots", job.file_name)))
+
+    def test_queue_is_bounded(self):
+        """Переполненная очередь отклоняет новые скриншоты."""
+        writer = ScreenshotWriter(max_queue=2)
+        writer.submit(0, self.image, "a.jpg")
+        writer.submit(0, self.image, "b.jpg")
+        with self.assertRaises(queue.Full):
+            writer.submit(0, self.image, "c.jpg")
+
+    def test_unwritable_file_fails_job(self):
+        """Ошибка записи файла помечает задачу как failed и не создаёт строку."""
+        writer = ScreenshotWriter()
+        # Каталоги камеры и дня создаются сами, поэтому мешаем файлом на месте каталога
+        os.makedirs(os.path.join(self.media_root, "screenshots"))
+        open(os.path.join(self.media_root, "screenshots", "not_a_dir"), "w").close()
+        job = writer.submit(0, self.image, "not_a_dir/shot.jpg")
+        with override_settings(MEDIA_ROOT=self.media_root):
+            writer.flush()
+        self.assertEqual(writer.status(job.id)["status"], "failed")
+        self.assertEqual(Screenshot.objects.count(), 0)
+
+    def test_sharded_file_names(self):
+        """Скриншоты раскладываются по каталогам камеры и дня, имена с микросекундами не совпадают."""
+        when = datetime.datetime(2024, 5, 1, 12, 0, 0, 123456, tzinfo=datetime.timezone.utc)
+        self.assertEqual(
+            screenshot_file_name(3, when=when), "camera_3/2024-05-01/camera_3_screenshot_2024-05-01_12-00-00-123456.jpg"
+        )
+        writer = ScreenshotWriter()
+        jobs = [writer.submit(3, self.image, screenshot_file_name(3)) for _ in range(3)]
+        with override_settings(MEDIA_ROOT=self.media_root):
+            writer.flush()
+        self.assertEqual(len({job.file_name for job in jobs}), 3)
+        for job in jobs:
+            screenshot = Screenshot.objects.get(id=writer.status(job.id)["screenshot_id"])
+            path = os.path.join(self.media_root, "screenshots", job.file_name)
+            self.assertEqual(screenshot.file_size, os.path.getsize(path))
+
+    def test_near_duplicates_skipped(self):
+        """Почти такой же кадр той же камеры не сохраняется, задача указывает на сохранённый."""
+        writer = ScreenshotWriter(dedup_distance=4)
+        scene = np.random.default_rng(0).integers(0, 255, (48, 64, 3), dtype=np.uint8)
+        noisy = np.clip(scene.astype(np.int16) + 2, 0, 255).astype(np.uint8)  # Чуть светлее
+        other = np.random.default_rng(1).integers(0, 255, (48, 64, 3), dtype=np.uint8)
+        first = writer.submit(0, scene, "a.jpg")
+        duplicate = writer.submit(0, noisy, "b.jpg")
+        other_camera = writer.submit(1, noisy, "c.jpg")
+        changed = writer.submit(0, other, "d.jpg")
+        with override_settings(MEDIA_ROOT=self.media_root):
+            writer.flush()
+        self.assertEqual(writer.status(duplicate.id)["status"], "duplicate")
+        self.assertEqual(writer.status(duplicate.id)["screenshot_id"], writer.status(first.id)["screenshot_id"])
+        self.assertEqual(writer.status(other_camera.id)["status"], "saved")
+        self.assertEqual(writer.status(changed.id)["status"], "saved")
+        self.assertEqual(Screenshot.objects.count(), 3)
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, "screenshots", "b.jpg")))
+        self.assertEqual(writer.duplicates, 1)
+
+    def test_timestamp_is_capture_time(self):
+        """Время скриншота — момент съёмки кадра, а не момент записи пачки."""
+        writer = ScreenshotWriter()
+        captured_at = datetime.datetime(2024, 5, 1, 12, 0, 0, 250000, tzinfo=datetime.timezone.utc)
+        job = writer.submit(0, self.image, "a.jpg", captured_at)
+        with override_settings(MEDIA_ROOT=self.media_root):
+            writer.flush()
+        self.assertEqual(Screenshot.objects.get(id=writer.status(job.id)["screenshot_id"]).timestamp, captured_at)
+
+    def test_failed_insert_removes_files(self):
+        """Если строки не вставились, файлы пачки удаляются, а следующий кадр не считается дубликатом."""
+        writer = ScreenshotWriter(dedup_distance=4)
+        first = writer.submit(0, self.image, "camera_0/a.jpg")
+        with override_settings(MEDIA_ROOT=self.media_root), mock.patch.object(
+            Screenshot.objects, "bulk_create", side_effect=RuntimeError("database is locked")
+        ), self.assertLogs("stream.persistence", "ERROR"):
+            writer.flush()
+        self.assertEqual(writer.status(first.id)["status"], "failed")
+        with override_settings(MEDIA_ROOT=self.media_root):
+            self.assertFalse(os.path.exists(os.path.join(self.media_root, "screenshots", "camera_0", "a.jpg")))
+            self.assertFalse(os.path.exists(thumbnail_path("camera_0/a.jpg")))
+        again = writer.submit(0, self.image, "camera_0/b.jpg")
+        with override_settings(MEDIA_ROOT=self.media_root):
+            writer.flush()
+        self.assertEqual(writer.status(again.id)["status"], "saved")
+
+    def test_status_of_unknown_job(self):
+        """Статус неизвестной задачи возвращает 404."""
+        self.assertEqual(self.client.get("/screenshot_status/nope/").status_code, 404)
+
+
+class DetectionRecordTests(TestCase):
+    def test_batch_insert(self):
+        """Проходы детекции записываются пачкой, по строке на рамку."""
+        writer = DetectionWriter(batch_size=10)
+        writer.record(3, 1700000000.5, [(1, 2, 30, 40), (5, 6, 70, 80)])
+        writer.record(4, 1700000001.0, [(9, 9, 90, 90)])
+        with self.assertNumQueries(3):  # SAVEPOINT, INSERT, RELEASE
+            writer.flush()
+        self.assertEqual(writer.written, 3)
+        detection = Detection.objects.get(camera_id=4)
+        self.assertEqual((detection.x, detection.y, detection.width, detection.height), (9, 9, 90, 90))
+        self.assertEqual(detection.timestamp, datetime.datetime(2023, 11, 14, 22, 13, 21, tzinfo=datetime.timezone.utc))
+
+    def test_full_queue_drops(self):
+        """Переполненная очередь не блокирует конвейер, проход отбрасывается."""
+        writer = DetectionWriter(max_queue=1)
+        writer.record(0, 0.0, [(1, 1, 1, 1)])
+        writer.record(0, 0.0, [(1, 1, 1, 1)])
+        self.assertEqual(writer.dropped, 1)
+
+    def test_batch_wait_bounds_whole_batch(self):
+        """Редкий, но непрерывный поток записей не задерживает пачку дольше batch_wait."""
+        writer = DetectionWriter(batch_size=100, batch_wait=0.1)
+        stop = threading.Event()
+
+        def trickle():
+            while not stop.wait(0.02):
+                writer.record(0, 0.0, [(1, 1, 1, 1)])
+
+        thread = threading.Thread(target=trickle)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(stop.set)
+        started = time.monotonic()
+        batch = writer._take_batch(block=True)
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertTrue(0 < len(batch) < 100)
+
+    def test_processor_records_detections(self):
+        """Найденные рамки уходят в очередь записи, пустые проходы — нет."""
+        writer = DetectionWriter()
+        processor = FrameProcessor(5)
+        gray = np.zeros((48, 64), dtype=np.uint8)
+        with mock.patch("stream.processing.get_detection_writer", return_value=writer), mock.patch(
+            "stream.detectors.detect_scaled", side_effect=[[], [(1, 2, 3, 4)]]
+        ):
+            processor.detect(gray)
+            processor.detect(gray)
+        self.assertEqual(writer.pending(), 1)
+        writer.flush()
+        self.assertEqual(list(Detection.objects.values_list("camera_id", "x")), [(5, 1)])
+
+    def test_detections_api(self):
+        """API отвечает на вопрос «когда камера 3 видела кота» фильтром по времени."""
+        base = datetime.datetime(2024, 5, 1, 12, 0, tzinfo=datetime.timezone.utc)
+        for i, camera_id in enumerate([3, 3, 4, 3]):
+            Detection.objects.create(camera_id=camera_id, timestamp=base + datetime.timedelta(days=i), x=i, y=0, width=10, height=10)
+        response = self.client.get("/api/detections/?camera=3&since=2024-05-02&page_size=1")
+        data = response.json()
+        self.assertEqual([row["box"][0] for row in data["results"]], [3])
+        data = self.client.get(f"/api/detections/?camera=3&since=2024-05-02&page_size=1&cursor={data['next_cursor']}").json()
+        self.assertEqual([row["box"][0] for row in data["results"]], [1])
+        self.assertIsNone(data["next_cursor"])
+        self.assertEqual(self.client.get("/api/detections/?since=yesterday").status_code, 400)
+
+    def test_auto_capture_once_per_visit(self):
+        """Кот, сидящий перед камерой, даёт один автоматический скриншот, а не сотни."""
+        capture = AutoCapture(gap=10, interval=60)
+        self.assertFalse(capture.update([], 0))
+        decisions = [capture.update([(1, 1, 5, 5)], t) for t in range(0, 100)]
+        self.assertEqual(decisions.count(True), 1)
+        self.assertFalse(capture.update([(1, 1, 5, 5)], 105))  # Пропал на 6 с — тот же визит
+        self.assertTrue(capture.update([(1, 1, 5, 5)], 130))  # Новое появление после паузы
+        self.assertFalse(capture.update([(1, 1, 5, 5)], 150))  # Новый визит, но интервал ещё не прошёл
+        self.assertEqual(capture.captures, 2)
+
+    def test_processor_saves_auto_screenshot(self):
+        writer = ScreenshotWriter()
+        with override_settings(STREAM_AUTO_SCREENSHOT=True):
+            processor = FrameProcessor(6)
+        processor.cadence = DetectionCadence(every_n_frames=1000, adaptive=False)
+        processor.cadence.due()  # Первый кадр уже проанализирован
+        processor.cadence.record(0.001)
+        processor.boxes = [(5, 5, 20, 20)]
+        with mock.patch("stream.processing.get_screenshot_writer", return_value=writer):
+            for _ in range(5):
+                processor(np.zeros((48, 64, 3), dtype=np.uint8))
+        self.assertEqual(writer.pending(), 1)
+
+    def test_auto_capture_behind_motion_gate(self):
+        """Неподвижный кот за детектором движения не даёт новых автоскриншотов: статичные кадры продлевают визит."""
+        writer = ScreenshotWriter()
+        with override_settings(STREAM_AUTO_SCREENSHOT=True):
+            processor = FrameProcessor(8)
+        processor.auto_capture = AutoCapture(gap=0.2, interval=0.3)
+        processor.cadence = DetectionCadence(every_n_frames=1, adaptive=False)
+        processor.detector = mock.Mock(prepare_stage="gray")
+        processor.detector.detect.return_value = [(5, 5, 20, 20)]
+        capture = FakeCapture(frames=200)  # Соседние кадры отличаются на единицу яркости — сцена статична
+        worker = CaptureWorker(8, capture, process=processor, motion=MotionGate(keepalive=60))
+        with mock.patch("stream.processing.get_screenshot_writer", return_value=writer), mock.patch(
+            "stream.processing.get_detection_writer"
+        ):
+            worker.start()
+            self.addCleanup(worker.stop)
+            capture.gate.release()
+            first = worker.wait_for_frame(0, timeout=2)
+            for _ in range(10):  # Полсекунды статичной сцены, дольше gap и interval
+                capture.gate.release()
+                time.sleep(0.05)
+            deadline = time.monotonic() + 2
+            while worker.static_skipped < 10 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            capture.reads = 100  # Кот шевельнулся: кадр заметно ярче
+            capture.gate.release()
+            self.assertIsNotNone(worker.wait_for_frame(first.seq, timeout=2))
+        self.assertEqual(processor.auto_capture.captures, 1)
+        self.assertEqual(writer.pending(), 1)
+
+
+class RecordingTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.origin = 1700000000.0
+
+    def at(self, offset):
+        return datetime.datetime.fromtimestamp(self.origin + offset, datetime.timezone.utc)
+
+    def record(self, camera_id=2, seconds=5, segment_seconds=2):
+        """Записать кадр каждые 0.5 с; вместо JPEG — метка с номером кадра."""
+        writer = RecordingWriter(segment_seconds=segment_seconds)
+        for i in range(int(seconds * 2)):
+            writer.record(camera_id, self.origin + i * 0.5, f"jpeg-{i}".encode())
+        writer.finish(camera_id)
+        writer.flush()
+        return writer
+
+    def test_segments(self):
+        """Запись режется на сегменты заданной длины, у каждого строка с началом, концом и размером."""
+        self.record()
+        segments = list(RecordingSegment.objects.filter(camera_id=2).order_by("started_at"))
+        self.assertEqual([segment.frames for segment in segments], [4, 4, 2])
+        self.assertEqual(segments[0].started_at, self.at(0))
+        self.assertEqual(segments[0].ended_at, self.at(1.5))
+        self.assertEqual(segments[0].size, len(b"jpeg-0") * 4)
+        with SegmentReader(segment_path(segments[1])) as reader:
+            self.assertEqual(len(reader), 4)
+            self.assertEqual(reader.jpeg(0), b"jpeg-4")
+
+    def test_find_frame(self):
+        """Кадр на заданный момент находится по индексу сегментов и бинарным поиском по индексу кадров."""
+        self.record()
+        timestamp, jpeg = find_frame(2, self.at(2.7))
+        self.assertEqual(jpeg, b"jpeg-5")
+        self.assertEqual(timestamp, self.at(2.5))
+        self.assertIsNone(find_frame(2, self.at(-1)))  # Запись ещё не началась
+        self.assertIsNone(find_frame(2, self.at(60)))  # Запись давно закончилась
+        self.assertIsNone(find_frame(3, self.at(2.7)))
+
+    def test_open_segment_is_readable(self):
+        """Сегмент, который ещё пишется, уже читается до последнего сброшенного на диск кадра."""
+        writer = RecordingWriter()
+        for i in range(4):
+            writer.record(1, self.origin + i * 0.5, b"frame")
+        writer.flush()
+        segment = RecordingSegment.objects.get(camera_id=1)
+        self.assertIsNone(segment.ended_at)
+        with SegmentReader(segment_path(segment)) as reader:
+            self.assertEqual(len(reader), 4)
+            self.assertEqual(reader.find(self.origin + 1.2), 2)
+        writer.stop()
+        segment.refresh_from_db()
+        self.assertEqual(segment.frames, 4)
+        self.assertEqual(segment.ended_at, self.at(1.5))
+
+    def test_playback_crosses_segments(self):
+        """Воспроизведение идёт с кадра на момент начала и продолжается в следующих сегментах."""
+        self.record()
+        jpegs = [jpeg for _, jpeg in iter_recording(2, self.at(1.2), self.at(3.6))]
+        self.assertEqual(jpegs, [f"jpeg-{i}".encode() for i in range(2, 8)])
+
+    def test_queue_is_bounded(self):
+        """Если диск не успевает, лишние кадры отбрасываются и считаются."""
+        writer = RecordingWriter(max_queue=2)
+        for i in range(5):
+            writer.record(0, self.origin + i, b"frame")
+        self.assertEqual(writer.dropped, 3)
+
+    def test_recorder_paces_and_reuses_encoded_frames(self):
+        """Рекордер пишет не чаще заданного fps и берёт JPEG из кэша кодированных кадров."""
+        writer = RecordingWriter()
+        encoded = EncodedFrameCache()
+        recorder = CameraRecorder(5, encoded, writer, fps=10)
+        image = np.zeros((48, 64, 3), dtype=np.uint8)
+        for i in range(60):  # 2 секунды камеры на 30 fps
+            frame = Frame(i + 1, image, [], self.origin + i / 30)
+            if i % 3 == 0:
+                encoded.get(frame)  # Часть кадров уже закодирована для зрителей
+            recorder(frame)
+        self.assertAlmostEqual(recorder.frames, 20, delta=1)
+        self.assertLess(encoded.encodes, 20 + recorder.frames)
+        writer.flush()
+        self.assertEqual(writer.written, recorder.frames)
+        with SegmentReader(segment_path(RecordingSegment.objects.get(camera_id=5))) as reader:
+            self.assertEqual(reader.jpeg(0)[:2], b"\xff\xd8")  # Начало JPEG
+
+    def test_frame_endpoint(self):
+        """Кадр записи на заданный момент отдаётся как JPEG."""
+        self.record()
+        response = self.client.get("/recording/2/frame/", {"at": self.at(2.7).isoformat()})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/jpeg")
+        self.assertEqual(response.content, b"jpeg-5")
+        self.assertEqual(self.client.get("/recording/2/frame/", {"at": self.at(600).isoformat()}).status_code, 404)
+        self.assertEqual(self.client.get("/recording/2/frame/", {"at": "вчера"}).status_code, 400)
+
+    def test_async_playback(self):
+        """Асинхронное воспроизведение отдаёт записанные кадры и заканчивается вместе с записью."""
+        self.record()
+
+        async def play():
+            return [chunk async for chunk in views.agen_recording(2, self.at(1.2), self.at(3.6), 16)]
+
+        # Строки тестовой транзакции видны только этому соединению, поэтому сегменты находим заранее
+        recorded = list(iter_recording(2, self.at(1.2), self.at(3.6)))
+        with mock.patch("stream.views.iter_recording", return_value=(item for item in recorded)):
+            chunks = asyncio.run(play())
+        self.assertEqual(chunks, [MULTIPART_HEADER + f"jpeg-{i}".encode() + b"\r\n" for i in range(2, 8)])
+        self.assertEqual(self.client.get("/async/recording/2/play/", {"speed": "100"}).status_code, 400)
+
+    def test_start_and_stop(self):
+        """Запись подключается к уже работающему захвату и держит камеру открытой до остановки."""
+        capture = FakeCapture()
+        worker = CaptureWorker(7, capture)
+        worker.start()
+        self.addCleanup(worker.stop)
+        writer = RecordingWriter()
+        with mock.patch.object(camera_registry, "grace", 0), mock.patch(
+            "stream.views.start_capture_worker", return_value=worker
+        ), mock.patch("stream.views.get_recording_writer", return_value=writer):
+            self.assertEqual(self.client.post("/recording/7/start/").status_code, 201)
+            self.assertEqual(self.client.post("/recording/7/start/").status_code, 200)  # Уже пишется
+            self.assertEqual(len(worker._recorders), 1)
+            self.assertEqual(camera_registry.leases(7), 1)
+            self.assertIn("7", self.client.get("/stream_stats/").json()["recording"]["cameras"])
+            self.assertEqual(self.client.post("/recording/7/stop/").status_code, 200)
+            self.assertEqual(self.client.post("/recording/7/stop/").status_code, 404)
+        self.assertEqual(worker._recorders, ())
+        self.assertEqual(camera_registry.leases(7), 0)
+        self.assertEqual(writer.pending(), 1)  # Закрытие сегмента
+
+    def test_start_on_dead_camera(self):
+        """Запись не подключается к умершему воркеру: камера открывается заново, а если не вышло — 503."""
+        dead, capture = CaptureWorker(7, FakeCapture()), FakeCapture()
+        dead.stop()  # Устройство отказало сразу после открытия
+        fresh = CaptureWorker(7, capture)
+        fresh.start()
+        self.addCleanup(fresh.stop)
+        with mock.patch.object(camera_registry, "grace", 0), mock.patch(
+            "stream.views.start_capture_worker", side_effect=[dead, fresh]
+        ), mock.patch("stream.views.get_recording_writer", return_value=RecordingWriter()):
+            self.assertEqual(self.client.post("/recording/7/start/").status_code, 201)
+            self.assertEqual(len(fresh._recorders), 1)
+            self.assertEqual(dead._recorders, ())
+            self.assertEqual(self.client.post("/recording/7/stop/").status_code, 200)
+        self.assertEqual(camera_registry.leases(7), 0)
+
+        # Умерший воркер, который ещё держит зритель, не заменяется — запись не стартует
+        dead = CaptureWorker(7, FakeCapture())
+        dead.stop()
+        with mock.patch.object(camera_registry, "grace", 0), mock.patch(
+            "stream.views.start_capture_worker", return_value=dead
+        ), mock.patch("stream.views.get_recording_writer", return_value=RecordingWriter()):
+            with camera_registry.acquire(7):
+                response = self.client.post("/recording/7/start/")
+                self.assertEqual(response.status_code, 503)
+                self.assertEqual(response.json()["status"], "error")
+                self.assertEqual(camera_registry.leases(7), 1)
+        self.assertEqual(camera_registry.leases(7), 0)
+        self.assertNotIn(7, views.recordings)
+
+    def test_recording_moves_to_reopened_camera(self):
+        """Если устройство камеры отказало, запись отпускает мёртвый воркер и продолжает на открытом заново."""
+        dead_capture, capture = FakeCapture(frames=1), FakeCapture()
+        dead = CaptureWorker(9, dead_capture)
+        reopened = CaptureWorker(9, capture)
+        reopened.start()
+        self.addCleanup(reopened.stop)
+        writer = RecordingWriter()
+        with override_settings(STREAM_RECORD_RESTART_SECONDS=0), mock.patch.object(camera_registry, "grace", 0), mock.patch(
+            "stream.views.start_capture_worker", side_effect=[dead, reopened]
+        ), mock.patch("stream.views.get_recording_writer", return_value=writer):
+            dead.start()
+            self.assertEqual(self.client.post("/recording/9/start/").status_code, 201)
+            dead_capture.gate.release()  # Один кадр, потом устройство "пропадает"
+            deadline = time.monotonic() + 5
+            while not reopened._recorders and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(len(reopened._recorders), 1)
+            self.assertEqual(reopened._recorders[0].restarts, 1)
+            with camera_registry.acquire(9) as lease:
+                self.assertIs(lease.worker, reopened)  # Новые зрители получают живой воркер
+            self.assertEqual(self.client.post("/recording/9/stop/").status_code, 200)
+        self.assertEqual(reopened._recorders, ())
+
+
+class ScreenshotBrowsingTests(TestCase):
+    def setUp(self):
+        # 30 скриншотов с трёх камер, по одному в минуту
+        self.origin = datetime.datetime(2024, 12, 1, 12, 0, tzinfo=datetime.timezone.utc)
+        Screenshot.objects.bulk_create([Screenshot(camera_id=i % 3, file_path=f"shot_{i}.jpg") for i in range(30)])
+        for i, screenshot in enumerate(Screenshot.objects.order_by("id")):
+            Screenshot.objects.filter(id=screenshot.id).update(timestamp=self.origin + datetime.timedelta(minutes=i))
+
+    def test_keyset_pages_cover_everything_once(self):
+        """Страницы по курсору идут от новых к старым без пропусков и повторов."""
+        seen = []
+        cursor = None
+        while True:
+            response = self.client.get("/api/screenshots/", {"page_size": 7, **({"cursor": cursor} if cursor else {})})
+            data = response.json()
+            seen.extend(item["file_path"] for item in data["results"])
+            cursor = data["next_cursor"]
+            if cursor is None:
+                break
+        self.assertEqual(seen, [f"shot_{i}.jpg" for i in reversed(range(30))])
+
+    def test_keyset_handles_equal_timestamps(self):
+        """Скриншоты с одинаковым временем не теряются на границе страниц."""
+        Screenshot.objects.update(timestamp=self.origin)
+        screenshots, cursor = keyset_page(Screenshot.objects.all(), page_size=20)
+        rest, end = keyset_page(Screenshot.objects.all(), cursor, page_size=20)
+        self.assertIsNone(end)
+        self.assertEqual(len({s.id for s in screenshots} | {s.id for s in rest}), 30)
+
+    def test_exact_camera_filter(self):
+        """Фильтр по камере точный: камера 1 не находит камеры 10, 11 и т.д."""
+        Screenshot.objects.create(camera_id=11, file_path="other.jpg")
+        results = self.client.get("/api/screenshots/", {"camera": "1", "page_size": 100}).json()["results"]
+        self.assertEqual({item["camera_id"] for item in results}, {1})
+        self.assertEqual(len(results), 10)
+        results = self.client.get("/api/screenshots/", {"camera": "0,2", "page_size": 100}).json()["results"]
+        self.assertEqual(len(results), 20)
+
+    def test_camera_range_and_time_window(self):
+        """Фильтры по диапазону камер и окну времени."""
+        results = filter_screenshots({"camera_min": "1", "camera_max": "2"})
+        self.assertEqual(results.count(), 20)
+        window = {"since": "2024-12-01T12:10", "until": "2024-12-01T12:20"}
+        self.assertEqual(filter_screenshots(window).count(), 10)
+
+    def test_invalid_filters(self):
+        """Некорректные фильтры дают 400 и в API, и на странице."""
+        self.assertEqual(self.client.get("/api/screenshots/", {"camera": "one"}).status_code, 400)
+        self.assertEqual(self.client.get("/api/screenshots/", {"cursor": "garbage"}).status_code, 400)
+        self.assertEqual(self.client.get("/screenshots/", {"since": "yesterday"}).status_code, 400)
+
+    def test_gallery_page_links_to_next_page(self):
+        """Страница галереи показывает ограниченное число скриншотов и ссылку на следующую страницу."""
+        response = self.client.get("/screenshots/", {"search": "1", "page_size": 4})
+        self.assertEqual(len(response.context["screenshots"]), 4)
+        self.assertIn("search=1", response.context["next_query"])
+        self.assertIn("cursor=", response.context["next_query"])
+
+
+class ScreenshotBulkTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        os.makedirs(os.path.join(self.media_root, "screenshots"))
+        # По два скриншота с камер 0, 1 и 2
+        for i in range(6):
+            with open(os.path.join(self.media_root, "screenshots", f"shot_{i}.jpg"), "wb") as f:
+                f.write(f"image {i}".encode() * 100)
+        Screenshot.objects.bulk_create([Screenshot(camera_id=i % 3, file_path=f"shot_{i}.jpg") for i in range(6)])
+
+    def exists(self, i):
+        return os.path.exists(os.path.join(self.media_root, "screenshots", f"shot_{i}.jpg"))
+
+    def test_bulk_delete(self):
+        """Удаление по фильтру — один DELETE, файлы удаляются в фоне."""
+        remover = FileRemover()
+        with mock.patch("stream.views.get_screenshot_remover", return_value=remover):
+            with self.assertNumQueries(4):  # SAVEPOINT, SELECT путей, DELETE, RELEASE
+                response = self.client.post("/api/screenshots/delete/", {"camera": "1,2"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["deleted"], 4)
+        self.assertEqual(sorted(Screenshot.objects.values_list("camera_id", flat=True)), [0, 0])
+        self.assertTrue(self.exists(1))  # Файлы ещё не тронуты, запрос их не ждёт
+        remover.flush()
+        self.assertEqual([i for i in range(6) if self.exists(i)], [0, 3])
+        self.assertEqual(remover.removed, 4)
+
+    def test_bulk_delete_needs_a_filter(self):
+        """Без фильтров массовое удаление ничего не удаляет."""
+        self.assertEqual(self.client.post("/api/screenshots/delete/").status_code, 400)
+        self.assertEqual(self.client.post("/api/screenshots/delete/?camera=1").status_code, 400)  # Фильтры только в теле
+        self.assertEqual(self.client.post("/api/screenshots/delete/", {"since": "вчера"}).status_code, 400)
+        self.assertEqual(self.client.get("/api/screenshots/delete/?camera=1").status_code, 405)
+        self.assertEqual(Screenshot.objects.count(), 6)
+
+    def test_bulk_delete_needs_csrf_token(self):
+        """Массовое удаление без CSRF-токена (запрос с чужого сайта) отклоняется."""
+        client = Client(enforce_csrf_checks=True)
+        self.assertEqual(client.post("/api/screenshots/delete/", {"camera": "1"}).status_code, 403)
+        self.assertEqual(Screenshot.objects.count(), 6)
+        self.assertIn('"X-CSRFToken": "', client.get("/screenshots/", {"camera": "1"}).content.decode())
+
+    def test_zip_export(self):
+        """Экспорт отдаёт ZIP потоком; отсутствующие на диске файлы пропускаются."""
+        os.remove(os.path.join(self.media_root, "screenshots", "shot_4.jpg"))
+        response = self.client.get("/api/screenshots/export/?camera=1")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/zip")
+        self.assertTrue(response.streaming)
+        archive = zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content)))
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(archive.namelist(), ["shot_1.jpg"])
+        self.assertEqual(archive.read("shot_1.jpg"), b"image 1" * 100)
+
+    def test_zip_export_streams_in_blocks(self):
+        """Архив собирается по кускам, а не целиком в памяти."""
+        from stream.screenshots import zip_screenshots
+
+        pieces = list(zip_screenshots(Screenshot.objects.order_by("id"), chunk_size=100))
+        self.assertGreater(len(pieces), 6)
+        # Блок файла плюс заголовки записи; последний кусок — оглавление архива
+        self.assertLessEqual(max(len(piece) for piece in pieces[:-1]), 300)
+        archive = zipfile.ZipFile(io.BytesIO(b"".join(pieces)))
+        self.assertEqual(len(archive.namelist()), 6)
+
+
+class RetentionTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.now = datetime.datetime(2024, 5, 10, 12, 0, tzinfo=datetime.timezone.utc)
+        # По 5 скриншотов камер 0 и 1, по одному в день, в каталогах камеры и дня; каждый файл 100 байт
+        for camera_id in (0, 1):
+            for day in range(5):
+                when = self.now - datetime.timedelta(days=day)
+                file_name = screenshot_file_name(camera_id, when=when)
+                path = os.path.join(self.media_root, "screenshots", file_name)
+                os.makedirs(os.path.dirname(path))
+                with open(path, "wb") as f:
+                    f.write(b"x" * 100)
+                screenshot = Screenshot.objects.create(camera_id=camera_id, file_path=file_name, file_size=100)
+                Screenshot.objects.filter(id=screenshot.id).update(timestamp=when)
+
+    def days_left(self, camera_id):
+        timestamps = Screenshot.objects.filter(camera_id=camera_id).order_by("timestamp").values_list("timestamp", flat=True)
+        return [(self.now - timestamp).days for timestamp in timestamps]
+
+    def files_left(self, camera_id):
+        root = os.path.join(self.media_root, "screenshots", f"camera_{camera_id}")
+        return sum(len(files) for _, _, files in os.walk(root))
+
+    def test_max_age(self):
+        """Старые скриншоты удаляются вместе с файлами и пустыми каталогами дня."""
+        retention = Retention(default={"max_age_days": 2.5})
+        self.assertEqual(retention.enforce(self.now), {0: (2, 200), 1: (2, 200)})
+        self.assertEqual(self.days_left(0), [2, 1, 0])
+        self.assertEqual(self.files_left(0), 3)
+        self.assertEqual(len(os.listdir(os.path.join(self.media_root, "screenshots", "camera_0"))), 3)
+
+    def test_per_camera_count_and_bytes(self):
+        """Лимиты количества и объёма задаются по камерам; удаляются самые старые, пачками."""
+        retention = Retention(cameras={0: {"max_count": 3}, 1: {"max_bytes": 150}}, batch_size=2)
+        self.assertEqual(retention.enforce(self.now), {0: (2, 200), 1: (4, 400)})
+        self.assertEqual(self.days_left(0), [2, 1, 0])
+        self.assertEqual(self.days_left(1), [0])
+        self.assertEqual(self.files_left(1), 1)
+        self.assertEqual(retention.stats()["deleted"], 6)
+
+    def test_unknown_sizes_read_from_disk(self):
+        """Размер старых скриншотов без file_size берётся с диска."""
+        Screenshot.objects.update(file_size=None)
+        retention = Retention(default={"max_bytes": 250})
+        retention.enforce_camera(0, self.now)
+        self.assertEqual(self.days_left(0), [1, 0])
+        self.assertEqual(list(Screenshot.objects.filter(camera_id=1).values_list("file_size", flat=True)), [None] * 5)
+
+    def test_no_limits(self):
+        """Без лимитов ничего не удаляется и фоновая задача не нужна."""
+        retention = Retention()
+        self.assertFalse(retention.limited)
+        self.assertEqual(retention.enforce(self.now), {})
+        self.assertEqual(Screenshot.objects.count(), 10)
+        self.assertTrue(Retention(cameras={3: {"max_count": 1}}).limited)
+
+    def test_command(self):
+        """Команда enforce_retention применяет лимиты из настроек и из аргументов."""
+        out = io.StringIO()
+        with override_settings(STREAM_RETENTION={"max_count": 4}):
+            call_command("enforce_retention", "--camera", "1", stdout=out)
+        self.assertEqual(Screenshot.objects.filter(camera_id=1).count(), 4)
+        self.assertEqual(Screenshot.objects.filter(camera_id=0).count(), 5)
+        call_command("enforce_retention", "--max-count", "2", stdout=out)
+        self.assertEqual(Screenshot.objects.count(), 4)
+        self.assertIn("screenshots deleted", out.getvalue())
+
+
+class ThumbnailTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(MEDIA_ROOT=self.media_root, STREAM_THUMBNAIL_WIDTH=32)
+        override.enable()
+        self.addCleanup(override.disable)
+        os.makedirs(os.path.join(self.media_root, "screenshots"))
+        image = np.random.randint(0, 255, (120, 160, 3), dtype=np.uint8)
+        cv2.imwrite(os.path.join(self.media_root, "screenshots", "shot.jpg"), image)
+        self.screenshot = Screenshot.objects.create(camera_id=1, file_path="shot.jpg")
+
+    def test_thumbnail_generated_lazily_and_cached(self):
+        """Миниатюра создаётся при первом запросе в шардированном каталоге, повторный запрос получает 304."""
+        url = f"/screenshots/{self.screenshot.id}/thumbnail/"
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        path = thumbnail_path("shot.jpg")
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(os.path.relpath(path, self.media_root).count(os.sep), 3)  # thumbnails/ab/cd/<hash>.jpg
+        self.assertEqual(cv2.imread(path).shape[1], 32)
+
+        etag = response.headers["ETag"]
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        last_modified = response.headers["Last-Modified"]
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+    def test_delete_evicts_thumbnail(self):
+        """Удаление скриншота удаляет и миниатюру."""
+        path = ensure_thumbnail("shot.jpg")
+        self.client.post(f"/delete_screenshot/{self.screenshot.id}/")
+        self.assertFalse(os.path.exists(path))
+
+    def test_missing_screenshot_file(self):
+        """Для скриншота без файла миниатюры нет."""
+        screenshot = Screenshot.objects.create(camera_id=1, file_path="gone.jpg")
+        self.assertEqual(self.client.get(f"/screenshots/{screenshot.id}/thumbnail/").status_code, 404)
+
+    def test_build_thumbnails_command(self):
+        """Команда build_thumbnails создаёт миниатюры для существующих скриншотов."""
+        Screenshot.objects.create(camera_id=1, file_path="gone.jpg")
+        out = io.StringIO()
+        call_command("build_thumbnails", workers=2, stdout=out)
+        self.assertTrue(os.path.exists(thumbnail_path("shot.jpg")))
+        self.assertIn("1 thumbnails ready, 1 screenshots without a file", out.getvalue())
+
+
+class CameraDiscoveryTests(TestCase):
+    def test_probes_concurrently_with_timeout(self):
+        """Устройства опрашиваются параллельно, зависшая проба не задерживает результат."""
+        def probe(index):
+            if index == 3:
+                time.sleep(5)  # Зависшее устройство
+            else:
+                time.sleep(0.1)
+            return index in (1, 3, 4)
+
+        discovery = CameraDiscovery(probe, indices=range(6), probe_timeout=0.5)
+        started = time.monotonic()
+        self.assertEqual(discovery.cameras(), [1, 4])
+        self.assertLess(time.monotonic() - started, 1.5)
+
+    def test_skips_cameras_in_use(self):
+        """Камеры, которые уже транслируются, не открываются повторно и считаются подключёнными."""
+        probed = []
+        discovery = CameraDiscovery(lambda index: probed.append(index) or False, indices=range(4), in_use=lambda: [2])
+        self.assertEqual(discovery.cameras(), [2])
+        self.assertNotIn(2, probed)
+
+    def test_cached_with_background_refresh(self):
+        """Результат кэшируется на TTL, затем обновляется в фоне, а запрос получает кэш сразу."""
+        connected = {0}
+        discovery = CameraDiscovery(lambda index: index in connected, indices=range(3), ttl=60)
+        self.assertEqual(discovery.cameras(), [0])
+        connected.add(1)
+        self.assertEqual(discovery.cameras(), [0])
+        self.assertEqual(discovery.refreshes, 1)
+
+        discovery.ttl = 0
+        self.assertEqual(discovery.cameras(), [0])  # Устаревший кэш, обновление запущено в фоне
+        discovery.refresh()
+        self.assertEqual(discovery.cameras(), [0, 1])
+
+    def test_refresh_endpoint(self):
+        """Ручное обновление списка камер."""
+        self.assertEqual(self.client.get("/cameras/refresh/").status_code, 405)
+        response = self.client.post("/cameras/refresh/")
+        self.assertEqual(response.json()["status"], "success")
+
+
+class MosaicTests(TestCase):
+    class StubWorker:
+        def __init__(self, value):
+            self.latest = Frame(1, np.full((60, 80, 3), value, dtype=np.uint8), (), 0.0)
+
+    def test_compose_tiles(self):
+        """Кадры камер раскладываются по плиткам, сетка задаётся числом колонок."""
+        tiles = [(0, self.StubWorker(50)), (1, self.StubWorker(100)), (2, self.StubWorker(150))]
+        mosaic = Mosaic(tiles, cols=2, tile_width=40, tile_height=30)
+        self.assertEqual(mosaic.canvas.shape, (60, 80, 3))
+        self.assertTrue(mosaic.compose())
+        self.assertEqual(mosaic.canvas[29, 0, 0], 50)  # Низ плитки, подпись туда не попадает
+        self.assertEqual(mosaic.canvas[29, 79, 0], 100)
+        self.assertEqual(mosaic.canvas[59, 0, 0], 150)
+        self.assertEqual(mosaic.canvas[59, 79, 0], 0)  # Пустая ячейка
+
+    def test_compose_only_redraws_new_frames(self):
+        """Если новых кадров нет, мозаика не перерисовывается."""
+        worker = self.StubWorker(50)
+        mosaic = Mosaic([(0, worker), (1, worker)], cols=2, tile_width=40, tile_height=30)
+        self.assertTrue(mosaic.compose())
+        self.assertFalse(mosaic.compose())
+        worker.latest = Frame(2, worker.latest.image, (), 0.0)
+        self.assertTrue(mosaic.compose())
+
+    def test_mosaic_feed_validates_parameters(self):
+        """Некорректные параметры мозаики возвращают 400."""
+        self.assertEqual(self.client.get("/video_feed/mosaic/").status_code, 400)
+        self.assertEqual(self.client.get("/video_feed/mosaic/?cameras=0,x").status_code, 400)
+        self.assertEqual(self.client.get("/video_feed/mosaic/?cameras=0&tile=big").status_code, 400)
+        self.assertEqual(self.client.get("/async/video_feed/mosaic/?cameras=0&tile=big").status_code, 400)
+
+    def test_async_mosaic_releases_cameras(self):
+        """Асинхронная мозаика отдаёт кадры, а после отключения клиента отпускает камеры."""
+        capture = FakeCapture()
+        worker = CaptureWorker(0, capture)
+        worker.start()
+        self.addCleanup(worker.stop)
+        capture.gate.release()
+        self.assertIsNotNone(worker.wait_for_frame(0, timeout=2))
+
+        async def watch():
+            feed = views.agen_mosaic([0, 1], 2, 40, 30, 30)
+            chunk = await feed.__anext__()
+            self.assertEqual(views.camera_registry.leases(0), 2)  # Обе мок-камеры — одно устройство
+            await feed.aclose()  # Клиент отключился
+            return chunk
+
+        with mock.patch.object(views.camera_registry, "grace", 0), mock.patch(
+            "stream.views.start_capture_worker", return_value=worker
+        ):
+            chunk = asyncio.run(watch())
+        self.assertTrue(chunk.startswith(MULTIPART_HEADER))
+        self.assertEqual(views.camera_registry.leases(0), 0)
+        self.assertFalse(worker.running)
+
+
+class CascadePoolTests(TestCase):
+    def test_classifier_per_thread(self):
+        """Каждый поток получает собственный классификатор, внутри потока он переиспользуется."""
+        pool = get_cascade_pool()
+        name = pool.names[0]
+        mine = pool.get(name)
+        self.assertIs(mine, pool.get(name))
+        self.assertFalse(mine.empty())
+
+        other = []
+        thread = threading.Thread(target=lambda: other.append(pool.get(name)))
+        thread.start()
+        thread.join()
+        self.assertIsNot(mine, other[0])
+
+    def test_detect_on_blank_frame(self):
+        """Детекция на пустом кадре не находит котов."""
+        pool = get_cascade_pool()
+        gray = np.zeros((240, 320), dtype=np.uint8)
+        self.assertEqual(len(pool.detect(gray, pool.names[0])), 0)
+
+    def test_invalid_cascade_rejected_up_front(self):
+        """Битый XML отклоняется при загрузке пула, а не на первом кадре."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with open(os.path.join(directory, "broken.xml"), "w") as f:
+            f.write("<?xml version=\"1.0\"?><opencv_storage></opencv_storage>")
+        with self.assertRaises(ImproperlyConfigured):
+            CascadePool(directory)
+
+    def test_multiple_cascades(self):
+        """Пул загружает все XML-файлы из каталога."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        source = os.path.join(settings.BASE_DIR, "cascades", "haarcascade_frontalcatface.xml")
+        shutil.copy(source, os.path.join(directory, "cat_a.xml"))
+        shutil.copy(source, os.path.join(directory, "cat_b.xml"))
+        self.assertEqual(CascadePool(directory).names, ["cat_a", "cat_b"])
+
+class DetectionEngineTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.engine = DetectionEngine(os.path.join(settings.BASE_DIR, "cascades"), processes=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.engine.close()
+        super().tearDownClass()
+
+    def test_same_boxes_as_in_process(self):
+        """Процессы-детекторы находят то же, что и пул каскадов в текущем процессе."""
+        pool = get_cascade_pool()
+        gray = np.random.default_rng(0).integers(0, 255, (240, 320), dtype=np.uint8)
+        params = {"minNeighbors": 1, "minSize": (24, 24)}
+        self.assertEqual(sorted(self.engine.detect_all(gray, pool.names, **params)), sorted(pool.detect_all(gray, pool.names, **params)))
+
+    def test_concurrent_cameras(self):
+        """Кадры нескольких камер проходят через слоты общей памяти, слоты освобождаются."""
+        pool = get_cascade_pool()
+        gray = np.zeros((120, 160), dtype=np.uint8)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.engine.detect_all(gray, pool.names))) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [[]] * 10)
+        stats = self.engine.stats()
+        self.assertEqual(stats["free_slots"], stats["slots"])
+        self.assertEqual(stats["submitted"], stats["completed"])
+
+    def test_frame_too_large(self):
+        """Кадр больше слота отклоняется сразу."""
+        with self.assertRaises(ValueError):
+            self.engine.detect_all(np.zeros((2000, 2000), dtype=np.uint8), ["cat"])
+
+    def test_processes_that_cannot_start(self):
+        """Если процессы не запускаются (под uWSGI sys.executable — не python), детекция остаётся в потоках."""
+        with override_settings(STREAM_DETECT_PROCESSES=1, STREAM_DETECT_PYTHON="/bin/false", STREAM_DETECT_START_TIMEOUT=1), mock.patch(
+            "stream.engine._engine", None
+        ), mock.patch("stream.engine._engine_failed", False), self.assertLogs("stream.engine", "ERROR"):
+            self.assertIsNone(get_detection_engine())
+            self.assertIsNone(get_detection_engine())  # Второй раз не пробует
+            self.assertIsInstance(get_detector(0).pool, CascadePool)
+
+
+class FakeNet:
+    """Заглушка сети cv2.dnn: для каждого кадра пакета одна рамка кота, плюс рамки, которые надо отбросить."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.batches = []
+
+    def setInput(self, blob):
+        self.blob = blob
+
+    def forward(self):
+        time.sleep(self.delay)
+        count = self.blob.shape[0]
+        self.batches.append(self.blob.shape)
+        rows = [[i, 8, 0.9, 0.1, 0.2, 0.5, 0.6] for i in range(count)]
+        rows += [[0, 8, 0.2, 0.1, 0.1, 0.2, 0.2], [0, 3, 0.9, 0.1, 0.1, 0.2, 0.2], [-1, 0, 0, 0, 0, 0, 0]]
+        return np.array(rows, dtype=np.float32).reshape(1, 1, -1, 7)
+
+
+class DetectorBackendTests(TestCase):
+    def test_dnn_boxes(self):
+        """Рамки сети переводятся в координаты кадра; чужие классы и низкая уверенность отбрасываются."""
+        detector = DnnDetector(FakeNet(), input_size=(64, 48), classes=[8], confidence=0.5)
+        self.addCleanup(detector.close)
+        frame = np.zeros((480, 640, 3), dtype=np.uint8)
+        prepared = detector.prepare(frame)
+        self.assertEqual(prepared[0].shape, (48, 64, 3))
+        self.assertEqual(detector.detect(prepared), [(64, 96, 256, 192)])
+        self.assertEqual(detector.net.batches, [(1, 3, 48, 64)])
+
+    def test_dnn_batches_cameras(self):
+        """Кадры нескольких камер, пришедшие одновременно, идут в сеть одним пакетом."""
+        net = FakeNet(delay=0.05)
+        detector = DnnDetector(net, input_size=(64, 48), classes=[8], max_batch=8, max_wait=0.2)
+        self.addCleanup(detector.close)
+        frames = [np.full((120, 160, 3), i, dtype=np.uint8) for i in range(6)]
+        results = [None] * len(frames)
+
+        def camera(i):
+            results[i] = detector.detect(detector.prepare(frames[i]))
+
+        threads = [threading.Thread(target=camera, args=(i,)) for i in range(len(frames))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [[(16, 24, 64, 48)]] * len(frames))
+        self.assertLess(len(net.batches), len(frames))
+        self.assertEqual(sum(shape[0] for shape in net.batches), len(frames))
+        self.assertEqual(detector.stats()["frames"], len(frames))
+
+    def test_dnn_failure_reaches_caller(self):
+        """Ошибка сети передаётся камерам пакета, поток вывода продолжает работать."""
+        net = FakeNet()
+        detector = DnnDetector(net, input_size=(64, 48), classes=[8])
+        self.addCleanup(detector.close)
+        frame = np.zeros((48, 64, 3), dtype=np.uint8)
+        with mock.patch.object(net, "forward", side_effect=cv2.error("broken")):
+            with self.assertRaises(cv2.error):
+                detector.detect(detector.prepare(frame))
+        self.assertEqual(len(detector.detect(detector.prepare(frame))), 1)
+
+    def test_backend_per_camera(self):
+        """Бэкенд выбирается для каждой камеры отдельно."""
+        dnn = DnnDetector(FakeNet(), input_size=(64, 48), classes=[8])
+        self.addCleanup(dnn.close)
+        with override_settings(STREAM_CAMERA_DETECTORS={3: "dnn"}), mock.patch(
+            "stream.detectors.get_dnn_detector", return_value=dnn
+        ):
+            self.assertIs(FrameProcessor(3).detector, dnn)
+            self.assertIsInstance(FrameProcessor(4).detector, CascadeDetector)
+            processor = FrameProcessor(3)
+            frame = np.zeros((48, 64, 3), dtype=np.uint8)
+            with mock.patch("stream.processing.get_detection_writer"):
+                self.assertEqual(processor(frame), [(6, 10, 26, 19)])
+        with override_settings(STREAM_DETECTOR="yolo"), self.assertRaises(ImproperlyConfigured):
+            get_detector(0)
+
+    def test_failing_detector_keeps_camera_running(self):
+        """Ошибка детектора не останавливает камеру: кадры идут дальше с последними рамками."""
+        processor = FrameProcessor(0)
+        processor.cadence = DetectionCadence(every_n_frames=1, adaptive=False)
+        processor.detector = mock.Mock(prepare_stage="gray")
+        processor.detector.detect.side_effect = [[(1, 2, 3, 4)], cv2.error("broken"), [(5, 6, 7, 8)]]
+        capture = FakeCapture(frames=10)  # Больше, чем кадров в тесте: камера не кончается сама
+        worker = CaptureWorker(0, capture, process=processor)
+        worker.start()
+        self.addCleanup(worker.stop)
+        seq = 0
+        boxes = []
+        with mock.patch("stream.processing.get_detection_writer"), self.assertLogs("stream.processing", "ERROR"):
+            for _ in range(3):
+                capture.gate.release()
+                frame = worker.wait_for_frame(seq, timeout=2)
+                seq = frame.seq
+                boxes.append(list(processor.boxes))
+        self.assertTrue(worker.running)
+        self.assertEqual(boxes, [[(1, 2, 3, 4)], [(1, 2, 3, 4)], [(5, 6, 7, 8)]])
+
+    def test_failing_prepare_keeps_camera_running(self):
+        """Кадр, который детектор не может подготовить, пропускается, камера продолжает работать."""
+        processor = FrameProcessor(0)
+        processor.cadence = DetectionCadence(every_n_frames=1, adaptive=False)
+        processor.detector = mock.Mock(prepare_stage="gray")
+        processor.detector.prepare.side_effect = [cv2.error("unexpected shape"), "prepared"]
+        processor.detector.detect.return_value = [(1, 2, 3, 4)]
+        frame = np.zeros((48, 64, 3), dtype=np.uint8)
+        with mock.patch("stream.processing.get_detection_writer"), self.assertLogs("stream.processing", "ERROR"):
+            self.assertEqual(processor(frame), [])
+        with mock.patch("stream.processing.get_detection_writer"):
+            self.assertEqual(processor(frame), [(1, 2, 3, 4)])
+
+    def test_dnn_needs_a_model(self):
+        """Без файла модели бэкенд dnn не настроен."""
+        with override_settings(STREAM_DNN={"model": None}), mock.patch("stream.detectors._dnn", None):
+            with self.assertRaises(ImproperlyConfigured):
+                get_dnn_detector()
+
+
+class DetectionSchedulerTests(TestCase):
+    def setUp(self):
+        self.frame = np.zeros((48, 64), dtype=np.uint8)
+
+    def test_round_robin(self):
+        """Свободный поток берёт камеру, которая дольше всех ждёт обслуживания."""
+        scheduler = DetectionScheduler(threads=1)
+        cameras = [scheduler.register(camera_id, lambda frame: []) for camera_id in range(3)]
+        for now, camera in enumerate(cameras):
+            camera.submit(self.frame, now=now)
+        order = []
+        with scheduler._condition:
+            for _ in range(2):
+                camera, _ = scheduler._take()
+                camera.busy = False
+                order.append(camera.camera_id)
+        cameras[0].submit(self.frame, now=10)  # Первая камера снова в очереди, но её уже обслужили
+        with scheduler._condition:
+            while scheduler._ready():
+                camera, _ = scheduler._take()
+                camera.busy = False
+                order.append(camera.camera_id)
+        self.assertEqual(order, [0, 1, 2, 0])
+
+    def test_priority(self):
+        """В режиме priority камера с большим приоритетом идёт первой."""
+        scheduler = DetectionScheduler(threads=1, policy="priority")
+        normal = scheduler.register(1, lambda frame: [])
+        important = scheduler.register(2, lambda frame: [], priority=5)
+        normal.submit(self.frame, now=0)
+        important.submit(self.frame, now=1)
+        with scheduler._condition:
+            camera, _ = scheduler._take()
+        self.assertIs(camera, important)
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ImproperlyConfigured):
+            DetectionScheduler(policy="random")
+
+    def test_sheds_older_frame(self):
+        """Новый кадр вытесняет ожидающий, очередь не растёт; частота ограничена target_fps."""
+        scheduler = DetectionScheduler(threads=1)
+        camera = scheduler.register(1, lambda frame: [], target_fps=5)
+        newer = self.frame.copy()
+        camera.submit(self.frame, now=0)
+        self.assertFalse(camera.due(0.1))
+        self.assertTrue(camera.due(0.2))
+        camera.submit(newer, now=0.2)
+        self.assertEqual((camera.submitted, camera.shed), (2, 1))
+        self.assertGreater(camera.stats()["degradation"], 0)
+        self.assertIs(camera.pending[0], newer)
+
+    def test_detects_in_scheduler_thread(self):
+        """Рамки находятся в потоке планировщика и попадают в статистику камеры."""
+        scheduler = DetectionScheduler(threads=2)
+        scheduler.start()
+        self.addCleanup(scheduler.stop)
+        done = threading.Event()
+
+        def detect(frame):
+            done.set()
+            return [(1, 2, 3, 4)]
+
+        camera = scheduler.register(7, detect)
+        camera.submit(self.frame)
+        self.assertTrue(done.wait(2))
+        for _ in range(100):
+            if camera.detections:
+                break
+            time.sleep(0.01)
+        self.assertEqual(camera.boxes, [(1, 2, 3, 4)])
+        stats = scheduler.stats()["cameras"][7]
+        self.assertEqual(stats["detections"], 1)
+        self.assertIsNotNone(stats["latency_ms"])
+        camera.close()
+        self.assertEqual(scheduler.stats()["cameras"], {})
+
+    def test_processor_submits_to_scheduler(self):
+        """С планировщиком обработчик кадров не детектирует сам, а рисует рамки планировщика."""
+        scheduler = DetectionScheduler(threads=1)  # Не запущен: кадр остаётся в очереди
+        with mock.patch("stream.processing.get_detection_scheduler", return_value=scheduler):
+            processor = FrameProcessor(3)
+        processor.scheduled.boxes = [(5, 5, 20, 20)]
+        frame = np.zeros((48, 64, 3), dtype=np.uint8)
+        self.assertEqual(processor(frame), [(5, 5, 20, 20)])
+        self.assertEqual(processor.scheduled.pending[0].shape, (48, 64))
+        self.assertEqual(processor.cadence.detections, 0)
+        self.assertEqual(tuple(frame[5, 5]), (255, 0, 0))
+        processor.close()
+        self.assertEqual(scheduler.stats()["cameras"], {})
+
+
+class DetectionCadenceTests(TestCase):
+    def test_every_n_frames(self):
+        """Без адаптации детекция выполняется на первом кадре и затем на каждом N-м."""
+        cadence = DetectionCadence(every_n_frames=3, adaptive=False)
+        due = []
+        for i in range(7):
+            due.append(cadence.due(now=i * 0.04))
+            if due[-1]:
+                cadence.record(0.001, now=i * 0.04)
+        self.assertEqual(due, [True, False, False, True, False, False, True])
+
+    def test_every_ms(self):
+        """В режиме по времени детекция выполняется не чаще, чем раз в T мс."""
+        cadence = DetectionCadence(every_ms=100, adaptive=False)
+        due = []
+        for i in range(6):
+            now = i * 0.04
+            due.append(cadence.due(now=now))
+            if due[-1]:
+                cadence.record(0.001, now=now)
+        self.assertEqual(due, [True, False, False, True, False, False])
+
+    def test_adaptive_interval_grows_under_load(self):
+        """Дорогая детекция растягивает интервал, дешёвая возвращает его к базовому."""
+        cadence = DetectionCadence(every_n_frames=2, cpu_budget=0.5, max_every_n_frames=10)
+        now = 0.0
+        for _ in range(20):
+            now += 0.04  # 25 fps
+            if cadence.due(now=now):
+                cadence.record(0.1, now=now)  # 100 мс на детекцию
+        self.assertEqual(cadence.interval_frames, 5)
+        for _ in range(100):
+            now += 0.04
+            if cadence.due(now=now):
+                cadence.record(0.001, now=now)
+        self.assertEqual(cadence.interval_frames, 2)
+
+    def test_adaptive_interval_is_capped(self):
+        """Интервал не превышает max_every_n_frames."""
+        cadence = DetectionCadence(every_n_frames=1, cpu_budget=0.1, max_every_n_frames=4)
+        now = 0.0
+        for _ in range(50):
+            now += 0.04
+            if cadence.due(now=now):
+                cadence.record(1.0, now=now)
+        self.assertEqual(cadence.interval_frames, 4)
+
+    def test_detect_scaled_maps_boxes_back(self):
+        """Рамки, найденные на уменьшенном кадре, масштабируются обратно."""
+
+        class StubPool:
+            def detect_all(self, gray, names, **params):
+                self.shape, self.params = gray.shape, params
+                return [(10, 20, 30, 40)]
+
+        pool = StubPool()
+        boxes = detect_scaled(pool, np.zeros((480, 640), dtype=np.uint8), ["cat"], scale=0.5)
+        self.assertEqual(pool.shape, (240, 320))
+        self.assertEqual(pool.params["minSize"], (38, 38))
+        self.assertEqual(boxes, [(20, 40, 60, 80)])
+
+    def test_processor_reuses_boxes_between_detections(self):
+        """Между детекциями процессор рисует последние известные рамки."""
+        processor = FrameProcessor()
+        processor.cadence = DetectionCadence(every_n_frames=2, adaptive=False)
+        frame = np.zeros((240, 320, 3), dtype=np.uint8)
+        processor(frame)
+        processor.boxes = [(5, 5, 20, 20)]
+        self.assertEqual(processor(frame.copy()), [(5, 5, 20, 20)])
+        self.assertEqual(processor.cadence.detections, 1)
+
 # Create your tests here.
@@ -0,0 +1,88 @@
+import hashlib
+import os
+import threading
+
+import cv2
+from django.conf import settings
+
+from .capture import resize_to_width
+
+
+def screenshot_path(file_path):
+    """Absolute path of a screenshot stored as `file_path` in the Screenshot table."""
+    return os.path.join(settings.MEDIA_ROOT, "screenshots", file_path)
+
+
+def thumbnail_path(file_path):
+    """Cache location of a screenshot's thumbnail.
+
+    Thumbnails are sharded into two levels of directories by a hash of the screenshot
+    path (thumbnails/ab/cd/abcd....jpg), so no directory ever holds more than a few
+    hundred files however many screenshots there are.
+    """
+    digest = hashlib.sha1(file_path.encode()).hexdigest()
+    return os.path.join(settings.MEDIA_ROOT, "thumbnails", digest[:2], digest[2:4], f"{digest}.jpg")
+
+
+def write_thumbnail(file_path, image):
+    """Downscale an image already in memory and store it as the thumbnail of `file_path`."""
+    path = thumbnail_path(file_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    thumbnail = resize_to_width(image, getattr(settings, "STREAM_THUMBNAIL_WIDTH", 320))
+    quality = getattr(settings, "STREAM_THUMBNAIL_QUALITY", 80)
+    success, buffer = cv2.imencode(".jpg", thumbnail, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not success:
+        raise OSError(f"Could not encode thumbnail {path}")
+    # Write next to the final name and rename, so a concurrent request never serves a half-written file
+    temporary = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    with open(temporary, "wb") as f:
+        f.write(buffer)
+    os.replace(temporary, path)
+    return path
+
+
+def ensure_thumbnail(file_path, force=False):
+    """Return the thumbnail path of a screenshot, generating it if it is missing or stale.
+
+    Returns None if the screenshot itself doesn't exist.
+    """
+    original = screenshot_path(file_path)
+    path = thumbnail_path(file_path)
+    try:
+        original_mtime = os.stat(original).st_mtime
+    except FileNotFoundError:
+        return None
+    if not force:
+        try:
+            if os.stat(path).st_mtime >= original_mtime:
+                return path
+        except FileNotFoundError:
+            pass
+    image = cv2.imread(original)
+    if image is None:
+        return None
+    return write_thumbnail(file_path, image)
+
+
+def remove_thumbnail(file_path):
+    try:
+        os.remove(thumbnail_path(file_path))
+    except FileNotFoundError:
+        pass
+
+
+def remove_screenshot_file(file_path):
+    """Remove a screenshot's file and cached thumbnail, and its shard directories once they are empty."""
+    try:
+        os.remove(screenshot_path(file_path))
+    except FileNotFoundError:
+        pass
+    remove_thumbnail(file_path)
+    # camera_3/2024-05-01/name.jpg: the day directory, then the camera directory, if nothing is left in them
+    directory = os.path.dirname(file_path)
+    while directory:
+        try:
+            os.rmdir(screenshot_path(directory))
+        except OSError:  # Not empty, or already gone
+            break
+        directory = os.path.dirname(directory)
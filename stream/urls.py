@@ -6,8 +6,27 @@ from django.conf.urls.static import static
 urlpatterns = [
     path("", views.index, name="index"),
     path("video_feed/<int:camera_id>/", views.video_feed, name="video_feed"),
+    path("video_feed/mosaic/", views.mosaic_feed, name="mosaic_feed"),
+    path("async/video_feed/<int:camera_id>/", views.video_feed_async, name="video_feed_async"),
+    path("async/video_feed/mosaic/", views.mosaic_feed_async, name="mosaic_feed_async"),
+    path("stream_stats/", views.stream_stats, name="stream_stats"),
+    path("metrics", views.metrics_view, name="metrics"),
+    path("cameras/refresh/", views.refresh_cameras, name="refresh_cameras"),
     path("release_camera/<int:camera_id>/", views.release_camera, name="release_camera"),
     path("save_screenshot/<int:camera_id>/", views.save_screenshot, name="save_screenshot"),
+    path("screenshot_status/<str:job_id>/", views.screenshot_status, name="screenshot_status"),
+    path("export_clip/<int:camera_id>/", views.export_clip, name="export_clip"),
+    path("recording/<int:camera_id>/start/", views.start_recording, name="start_recording"),
+    path("recording/<int:camera_id>/stop/", views.stop_recording, name="stop_recording"),
+    path("recording/<int:camera_id>/frame/", views.recording_frame, name="recording_frame"),
+    path("recording/<int:camera_id>/play/", views.recording_playback, name="recording_playback"),
+    path("async/recording/<int:camera_id>/play/", views.recording_playback_async, name="recording_playback_async"),
+    path("recording/<int:camera_id>/export/", views.export_recording_clip, name="export_recording_clip"),
+    path("screenshots/<int:screenshot_id>/thumbnail/", views.screenshot_thumbnail, name="screenshot_thumbnail"),
     path("delete_screenshot/<int:screenshot_id>/", views.delete_screenshot, name="delete_screenshot"),
     path("screenshots/", views.screenshots_list, name="screenshots_list"),
+    path("api/screenshots/", views.screenshots_api, name="screenshots_api"),
+    path("api/screenshots/delete/", views.delete_screenshots, name="delete_screenshots"),
+    path("api/screenshots/export/", views.export_screenshots, name="export_screenshots"),
+    path("api/detections/", views.detections_api, name="detections_api"),
 ]
\ No newline at end of file
@@ -1,44 +1,204 @@
-from django.http import StreamingHttpResponse, JsonResponse
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse, JsonResponse
 from django.shortcuts import render
+from django.urls import reverse
+import asyncio
 import cv2
+import datetime
 import os
+import queue
 import threading
-from .models import Screenshot
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .models import Detection, Screenshot
 from django.core.files.storage import default_storage
 from django.utils.timezone import now
 from django.conf import settings
 from django.shortcuts import render
+from django.db import transaction
 from django.views.decorators.csrf import csrf_exempt
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from .capture import CaptureWorker, DEFAULT_PROFILES, FRAME_TIMEOUT, MULTIPART_HEADER, encode_multipart
+from .discovery import CameraDiscovery
+from .mosaic import Mosaic
+from . import metrics
+from .metrics import FRAME_LATENCY
+from .motion import MotionGate
+from .persistence import get_screenshot_remover, get_screenshot_writer
+from .screenshots import FILTERS, filter_screenshots, keyset_page, parse_page_size, parse_time, screenshot_file_name, zip_screenshots
+from .thumbnails import ensure_thumbnail, remove_screenshot_file
+from .processing import FrameProcessor
+from .recording import CameraRecorder, export_recording, find_frame, get_recording_writer, iter_recording
+from .registry import CameraRegistry
+from .scheduling import get_detection_scheduler
+from .sources import open_source
 
 # Set to True for mock testing, False for real multiple cameras
 USE_MOCK = True
 
 # Mock settings
 mock_camera_ids = [0, 1, 2, 3, 4, 5, 6]  # Simulating two cameras with the same physical camera
-physical_camera = None  # Will be initialized if USE_MOCK is True
 
+# Size/quality profiles video_feed can serve, e.g. a small one for the dashboard grid
+stream_profiles = getattr(settings, "STREAM_PROFILES", DEFAULT_PROFILES)
 
+# Connected camera discovery for real mode. Devices that are already streaming are not opened again
+camera_discovery = CameraDiscovery(
+    indices=range(10),  # TODO: Replace with logic to find connected cameras instead of hardcoded 10 cameras
+    ttl=getattr(settings, "STREAM_DISCOVERY_TTL", 60),
+    probe_timeout=getattr(settings, "STREAM_DISCOVERY_PROBE_TIMEOUT", 2),
+    in_use=lambda: camera_registry.in_use(),  # camera_registry is created below
+)
 
-# Shared dictionary for camera instances
-camera_instances = {}
-lock = threading.Lock() # To ensure thread safety. Do not fully understand why this is needed, but it better be safe than sorry
+# Bounded thread pool for the blocking OpenCV calls of the async feed (opening devices, JPEG encoding),
+# so the event loop never blocks and the number of threads doesn't grow with the number of viewers
+async_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, "STREAM_ASYNC_EXECUTOR_WORKERS", 4), thread_name_prefix="stream-async"
+)
+
+# Mosaic feed limits: how many cameras one mosaic may tile and the JPEG quality of the composed frame
+MOSAIC_MAX_CAMERAS = 16
+MOSAIC_QUALITY = 75
+
+# Capture workers with leases: every viewer or screenshot holds one, and a device closes only
+# STREAM_CAMERA_GRACE_SECONDS after its last lease ends, so flipping between cards doesn't reopen it.
+# All mock cameras use the same physical camera, so they map to device 0 and share one worker
+camera_registry = CameraRegistry(
+    lambda device_id: start_capture_worker(device_id),
+    device_for=lambda camera_id: 0 if USE_MOCK else camera_id,
+    grace=getattr(settings, "STREAM_CAMERA_GRACE_SECONDS", 10),
+)
+
+# Shared dictionary of capture workers, one per camera ID (mock cameras all point to the same worker)
+camera_instances = camera_registry.cameras
+lock = camera_registry.lock # To ensure thread safety. Do not fully understand why this is needed, but it better be safe than sorry
 # Code inside the 'with lock:' block is executed by one thread at a time. This guarantees that camera creation and deletion are thread-safe.
 
+# Leases taken through create_camera_instance, given back by release_camera_instance
+held_leases = {}
+
+# Cameras recorded continuously: camera id -> (lease keeping the camera open, its CameraRecorder)
+recordings = {}
+recordings_lock = threading.Lock()
+
 
 def index(request):
     """Render the main page."""
     connected_cameras = list_connected_cameras()
-    context = {"connected_cameras": connected_cameras}
+    # Under an ASGI server the dashboard can use the async feed, which doesn't pin a worker per viewer
+    feed_prefix = "/async/video_feed/" if getattr(settings, "STREAM_ASYNC_FEED", False) else "/video_feed/"
+    # Clips are cut from the in-memory frame history, which is off unless STREAM_HISTORY_SECONDS is set
+    clips_enabled = bool(getattr(settings, "STREAM_HISTORY_SECONDS", 0))
+    context = {"connected_cameras": connected_cameras, "feed_prefix": feed_prefix, "clips_enabled": clips_enabled}
     return render(request, "index.html", context)
 
+def screenshots_page(request):
+    """Filter and paginate screenshots from the query string. Returns (screenshots, next_cursor)."""
+    screenshots = filter_screenshots(request.GET)
+    return keyset_page(screenshots, request.GET.get("cursor"), parse_page_size(request.GET.get("page_size")))
+
+@metrics.timed("screenshots_list")
 def screenshots_list(request):
-    """Render the page to view and search screenshots."""
+    """Render one page of screenshots, newest first, with camera and time filters."""
     query = request.GET.get("search", "")
-    screenshots = Screenshot.objects.all()
-    if query:
-        screenshots = screenshots.filter(camera_id__icontains=query)
-    context = {"screenshots": screenshots, "query": query}
-    return render(request, "screenshots_list.html", context)
+    try:
+        screenshots, next_cursor = screenshots_page(request)
+        error = None
+    except ValueError as e:
+        screenshots, next_cursor, error = [], None, str(e)
+
+    # Link to the next page keeps the current filters
+    next_query = None
+    if next_cursor:
+        params = request.GET.copy()
+        params["cursor"] = next_cursor
+        next_query = params.urlencode()
+
+    # The current filters without the page, for the ZIP download and the bulk delete
+    filters = request.GET.copy()
+    filters.pop("cursor", None)
+    filters.pop("page_size", None)
+
+    context = {
+        "screenshots": screenshots,
+        "query": query,
+        "since": request.GET.get("since", ""),
+        "until": request.GET.get("until", ""),
+        "next_query": next_query,
+        "filter_query": filters.urlencode(),
+        "filtered": any(request.GET.get(name) for name in FILTERS),
+        "error": error,
+    }
+    return render(request, "screenshots_list.html", context, status=400 if error else 200)
+
+@metrics.timed("screenshots_api")
+def screenshots_api(request):
+    """JSON version of the screenshot list: same filters, ?cursor= and ?page_size= for paging."""
+    try:
+        screenshots, next_cursor = screenshots_page(request)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    results = [
+        {
+            "id": screenshot.id,
+            "camera_id": screenshot.camera_id,
+            "timestamp": screenshot.timestamp.isoformat(),
+            "file_path": screenshot.file_path,
+            "url": f"{settings.MEDIA_URL}screenshots/{screenshot.file_path}",
+            "thumbnail_url": reverse("screenshot_thumbnail", args=[screenshot.id]),
+        }
+        for screenshot in screenshots
+    ]
+    return JsonResponse({"results": results, "next_cursor": next_cursor})
+
+def delete_screenshots(request):
+    """Delete every screenshot matching the gallery filters with one query; the files are removed in the background.
+
+    The filters come in the POST body and the request needs the CSRF token: another site must
+    not be able to make an operator's browser wipe the gallery.
+    """
+    if request.method != "POST":
+        return JsonResponse({"status": "error", "message": "Invalid request method"}, status=405)
+    params = request.POST
+    if not any(params.get(name) for name in FILTERS):
+        return JsonResponse({"error": f"At least one filter is required: {', '.join(FILTERS)}"}, status=400)
+    try:
+        with transaction.atomic():
+            screenshots = filter_screenshots(params)
+            file_names = list(screenshots.values_list("file_path", flat=True))
+            deleted, _ = screenshots.delete()
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    get_screenshot_remover().remove(file_names)
+    return JsonResponse({"status": "success", "deleted": deleted})
+
+def export_screenshots(request):
+    """Download the screenshots matching the gallery filters as a ZIP archive, streamed while it is built."""
+    try:
+        screenshots = filter_screenshots(request.GET).order_by("timestamp", "id")
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    response = StreamingHttpResponse(zip_screenshots(screenshots), content_type="application/zip")
+    response.headers["Content-Disposition"] = f'attachment; filename="screenshots_{now().strftime("%Y-%m-%d_%H-%M-%S")}.zip"'
+    return response
+
+def detections_api(request):
+    """Recorded detections, newest first, with the screenshot filters (?camera=3&since=...&until=...) and ?cursor= paging."""
+    try:
+        detections = filter_screenshots(request.GET, Detection.objects.all())
+        detections, next_cursor = keyset_page(detections, request.GET.get("cursor"), parse_page_size(request.GET.get("page_size")))
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    results = [
+        {
+            "id": detection.id,
+            "camera_id": detection.camera_id,
+            "timestamp": detection.timestamp.isoformat(),
+            "box": [detection.x, detection.y, detection.width, detection.height],
+        }
+        for detection in detections
+    ]
+    return JsonResponse({"results": results, "next_cursor": next_cursor})
 
 
 def list_connected_cameras():
@@ -46,133 +206,569 @@ def list_connected_cameras():
     if USE_MOCK:
         return mock_camera_ids
     else:
-        connected_cameras = []
-        for index in range(10):  # TODO: Replace with logic to find connected cameras instead of hardcoded 10 cameras
-            cap = cv2.VideoCapture(index, cv2.CAP_DSHOW)
-            if cap.isOpened():
-                connected_cameras.append(
-                    index
-                )  # TODO: Maybe add names of cameras instead of IDs
-                cap.release()
-        return connected_cameras
+        # Probed concurrently and cached, so the dashboard renders from memory
+        return camera_discovery.cameras()  # TODO: Maybe add names of cameras instead of IDs
+
+@csrf_exempt
+def refresh_cameras(request):
+    """API endpoint to probe the camera devices again right now."""
+    if request.method != "POST":
+        return JsonResponse({"status": "error", "message": "Invalid request method"}, status=405)
+    cameras = mock_camera_ids if USE_MOCK else camera_discovery.refresh()
+    return JsonResponse({"status": "success", "cameras": cameras})
+
+
+def start_capture_worker(device_id):
+    """Open the device (or the configured stand-in source) and start a capture worker that reads and processes its frames."""
+    motion = None
+    if getattr(settings, "STREAM_MOTION_GATE", True):
+        # Frames of a static scene skip detection and encoding
+        motion = MotionGate(
+            threshold=getattr(settings, "STREAM_MOTION_THRESHOLD", 0.01),
+            keepalive=getattr(settings, "STREAM_MOTION_KEEPALIVE", 1.0),
+        )
+    worker = CaptureWorker(
+        device_id,
+        open_source(device_id),
+        process=FrameProcessor(device_id),
+        profiles=stream_profiles,
+        history_seconds=getattr(settings, "STREAM_HISTORY_SECONDS", 0),
+        history_max_bytes=getattr(settings, "STREAM_HISTORY_MAX_BYTES", None),
+        motion=motion,
+    )
+    worker.start()
+    return worker
 
 
 def create_camera_instance(camera_id):
-    """Create a camera instance for the given camera ID."""
-    global physical_camera # to make it treated as a global variable, not a local variable
+    """Take a lease on the camera for the caller and return its capture worker; give it back with release_camera_instance."""
+    lease = camera_registry.acquire(camera_id)
     with lock:
-        if camera_id not in camera_instances:
-            if USE_MOCK:
-                # All mock cameras use the same physical camera
-                if physical_camera is None:
-                    physical_camera = cv2.VideoCapture(0)
-                camera_instances[camera_id] = physical_camera
-            else:
-                # Create a new instance for each real camera
-                camera_instances[camera_id] = cv2.VideoCapture(camera_id)
+        held_leases.setdefault(camera_id, []).append(lease)
+    return lease.worker
 
 def release_camera_instance(camera_id):
-    """Release a camera instance."""
+    """Give back one lease taken by create_camera_instance; the camera closes after the last lease and the grace period."""
     with lock:
-        if camera_id in camera_instances:
-            if USE_MOCK:
-                # Keep the shared physical camera open in mock mode
-                del camera_instances[camera_id]
-                if not camera_instances and physical_camera is not None:
-                    physical_camera.release()
-            else:
-                # Release the specific camera in real mode
-                camera_instances[camera_id].release()
-                del camera_instances[camera_id]
+        leases = held_leases.get(camera_id)
+        lease = leases.pop() if leases else None
+        if not leases:
+            held_leases.pop(camera_id, None)
+    if lease is not None:
+        lease.release()
 
 
+def parse_feed_options(request):
+    """Read ?profile= and ?fps= of a feed request. Returns (profile, max_fps, error_response)."""
+    profile = request.GET.get("profile", "full")
+    if profile not in stream_profiles:
+        return None, None, JsonResponse({"error": f"Unknown profile '{profile}'", "profiles": list(stream_profiles)}, status=400)
+    max_fps = request.GET.get("fps")
+    if max_fps is not None:
+        try:
+            max_fps = float(max_fps)
+        except ValueError:
+            max_fps = 0
+        if not 0 < max_fps <= 60:
+            return None, None, JsonResponse({"error": "fps must be a number between 0 and 60"}, status=400)
+    return profile, max_fps, None
+
 def video_feed(request, camera_id):
-    """Stream the video feed for a specific camera."""
+    """Stream the video feed for a specific camera, in the profile given by ?profile= and capped at ?fps= frames per second."""
+    profile, max_fps, error = parse_feed_options(request)
+    if error:
+        return error
     return StreamingHttpResponse(
-        gen_frames(int(camera_id)),
+        gen_frames(int(camera_id), profile, max_fps),
         content_type="multipart/x-mixed-replace; boundary=frame", # HTTP content type used to stream video frames continuously as part of a single HTTP response
     )
 
-def release_camera(request, camera_id):
-    """API endpoint to release a camera."""
-    release_camera_instance(int(camera_id))
-    return JsonResponse({"status": "released", "camera_id": camera_id})
+async def video_feed_async(request, camera_id):
+    """Async video feed for ASGI servers: viewers wait on the event loop instead of each holding a worker thread."""
+    profile, max_fps, error = parse_feed_options(request)
+    if error:
+        return error
+    return StreamingHttpResponse(
+        agen_frames(int(camera_id), profile, max_fps),
+        content_type="multipart/x-mixed-replace; boundary=frame",
+    )
+
+def parse_mosaic_options(request):
+    """Read ?cameras=, ?cols=, ?tile= and ?fps= of a mosaic request. Returns (options, error_response)."""
+    try:
+        camera_ids = [int(camera_id) for camera_id in request.GET.get("cameras", "").split(",") if camera_id]
+        cols = int(request.GET.get("cols", 3))
+        tile_width, tile_height = (int(size) for size in request.GET.get("tile", "320x180").split("x"))
+        fps = float(request.GET.get("fps", 10))
+    except ValueError:
+        return None, JsonResponse({"error": "Expected cameras=0,1,2&cols=3&tile=320x180&fps=10"}, status=400)
+    if not camera_ids or len(camera_ids) > MOSAIC_MAX_CAMERAS:
+        return None, JsonResponse({"error": f"Pick between 1 and {MOSAIC_MAX_CAMERAS} cameras"}, status=400)
+    if cols < 1 or not (16 <= tile_width <= 1920 and 16 <= tile_height <= 1080) or not 0 < fps <= 60:
+        return None, JsonResponse({"error": "cols must be >= 1, tile between 16x16 and 1920x1080, fps between 0 and 60"}, status=400)
+    return (camera_ids, cols, tile_width, tile_height, fps), None
 
+def mosaic_feed(request):
+    """Stream several cameras tiled into one feed, e.g. ?cameras=0,1,2&cols=3&tile=320x180&fps=10."""
+    options, error = parse_mosaic_options(request)
+    if error:
+        return error
+    return StreamingHttpResponse(
+        gen_mosaic(*options),
+        content_type="multipart/x-mixed-replace; boundary=frame",
+    )
+
+async def mosaic_feed_async(request):
+    """Async mosaic feed for ASGI servers, the counterpart of mosaic_feed as video_feed_async is of video_feed."""
+    options, error = parse_mosaic_options(request)
+    if error:
+        return error
+    return StreamingHttpResponse(
+        agen_mosaic(*options),
+        content_type="multipart/x-mixed-replace; boundary=frame",
+    )
+
+def stream_stats(request):
+    """API endpoint with per-camera viewer counts, each viewer's delivered/dropped frames, motion scores,
+    device open/close counts, recording progress and, with the detection scheduler on, how far each camera
+    falls short of its detection fps."""
+    with lock:
+        workers = dict(camera_instances)
+    cameras = {}
+    for camera_id, worker in workers.items():
+        cameras[camera_id] = {
+            "running": worker.running,
+            "frames": worker.latest.seq if worker.latest else 0,
+            "viewers": worker.subscription_stats(),
+            "static_skipped": worker.static_skipped,
+            "motion": worker.motion.stats() if worker.motion is not None else None,
+        }
+    scheduler = get_detection_scheduler()
+    with recordings_lock:
+        recorders = {camera_id: recorder for camera_id, (_, recorder) in recordings.items()}
+    return JsonResponse({
+        "cameras": cameras,
+        "devices": camera_registry.stats(),
+        "detection": scheduler.stats() if scheduler is not None else None,
+        "recording": {
+            "cameras": {camera_id: recorder.stats() for camera_id, recorder in recorders.items()},
+            "writer": get_recording_writer().stats() if recorders else None,
+        },
+    })
 
-def gen_frames(camera_id):
-    """Generate video frames for a specific camera."""
-    create_camera_instance(camera_id)  # On init call function to create camera instance
-    camera = camera_instances[camera_id]  # Get the camera instance
+def metrics_view(request):
+    """Pipeline metrics in the Prometheus text format: per-stage timings, per-camera frames and latency, view timings."""
+    if not metrics.ENABLED:
+        return JsonResponse({"status": "error", "message": "Metrics are disabled (STREAM_METRICS)"}, status=404)
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
 
-    while True:  # Infinite loop to keep the video feed running
-        success, frame = camera.read()
-        if not success:  # success is True if a frame was read successfully
-            break
-        else:
-            # Detect cats in the frame
-            gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)  # Convert to grayscale for detection
-            cascade_path = os.path.join(settings.BASE_DIR, "cascades", "haarcascade_frontalcatface.xml")
-            cat_cascade = cv2.CascadeClassifier(cascade_path)
-            cats = cat_cascade.detectMultiScale(gray_frame, scaleFactor=1.1, minNeighbors=5, minSize=(75, 75))
+def collect_viewers():
+    with lock:
+        workers = dict(camera_instances)
+    return {(camera_id,): worker.viewer_count for camera_id, worker in workers.items()}
+
+def collect_devices():
+    return {(device_id,): device["leases"] for device_id, device in camera_registry.stats()["devices"].items()}
+
+# Read when /metrics is scraped, nothing is recorded on the hot path for these
+metrics.gauge("stream_viewers", "Current viewers of each camera", ["camera"], collect_viewers)
+metrics.gauge("stream_device_leases", "Leases held on each open capture device", ["device"], collect_devices)
+
+def release_camera(request, camera_id):
+    """API endpoint reporting how many leases are still held on a camera.
+
+    A viewer's lease ends with its stream connection (the dashboard closes a card's feed
+    before removing it), so nothing is torn down here: other viewers keep streaming and
+    the device closes by itself after the grace period.
+    """
+    return JsonResponse({"status": "released", "camera_id": camera_id, "leases": camera_registry.leases(int(camera_id))})
 
-            if cat_cascade.empty():
-                raise Exception(f"Error loading cat cascade. Check if the file exists at {cascade_path}")
 
-            # Draw rectangles around detected cats
-            for (x, y, w, h) in cats:
-                cv2.rectangle(frame, (x, y), (x + w, y + h), (255, 0, 0), 2)
+def gen_frames(camera_id, profile="full", max_fps=None):
+    """Generate video frames for a specific camera in the given profile."""
+    lease = camera_registry.acquire(camera_id)  # Opens the camera, or reuses the running (or idle but still open) one
+    worker = lease.worker
+    subscription = worker.subscribe(max_fps)  # Newest-frame mailbox, a slow viewer drops frames instead of lagging
+
+    try:
+        while True:  # Infinite loop to keep the video feed running
+            frame = subscription.get(timeout=FRAME_TIMEOUT)
+            if frame is None:  # Worker stopped or the camera stalled
+                break
 
-            # Encode the frame to JPEG format
-            ret, buffer = cv2.imencode(".jpg", frame)
-            frame = buffer.tobytes()
+            # The frame is encoded to JPEG once per profile and the same multipart chunk is sent to every viewer
+            chunk = worker.encoded.get(frame, profile)
+            if chunk is None:
+                continue
 
             # Yield the frame in byte format
-            yield (b"--frame\r\n" b"Content-Type: image/jpeg\r\n\r\n" + frame + b"\r\n")
+            FRAME_LATENCY.observe(time.time() - frame.timestamp, camera_id)
+            yield chunk
+    finally:  # Runs when the browser disconnects, too
+        subscription.close()
+        lease.release()
+
+
+async def agen_frames(camera_id, profile="full", max_fps=None):
+    """Async version of gen_frames; blocking OpenCV calls run in the bounded async_executor."""
+    loop = asyncio.get_running_loop()
+    lease = await loop.run_in_executor(async_executor, camera_registry.acquire, camera_id)  # Opening a device blocks
+    worker = lease.worker
+    subscription = worker.subscribe(max_fps)
+
+    try:
+        while True:
+            frame = await subscription.get_async(timeout=FRAME_TIMEOUT)
+            if frame is None:  # Worker stopped or the camera stalled
+                break
+
+            # Usually another viewer already encoded the frame, otherwise encode it off the event loop
+            chunk = worker.encoded.peek(frame, profile)
+            if chunk is None:
+                chunk = await loop.run_in_executor(async_executor, worker.encoded.get, frame, profile)
+            if chunk is None:
+                continue
+
+            FRAME_LATENCY.observe(time.time() - frame.timestamp, camera_id)
+            yield chunk
+    finally:
+        subscription.close()
+        await loop.run_in_executor(async_executor, lease.release)  # Closing the device right away (no grace period) blocks
+
+
+def gen_mosaic(camera_ids, cols, tile_width, tile_height, fps):
+    """Generate tiled frames of several cameras, composed from each camera's latest processed frame."""
+    leases = [camera_registry.acquire(camera_id) for camera_id in camera_ids]
+    tiles = [(lease.camera_id, lease.worker) for lease in leases]
+    mosaic = Mosaic(tiles, cols, tile_width, tile_height)
+    interval = 1 / fps
+
+    try:
+        while any(worker.running for _, worker in tiles):  # Keep going while at least one camera is alive
+            started = time.monotonic()
+            # Only tiles with a new frame are redrawn, and nothing is encoded if no camera produced one
+            if mosaic.compose():
+                chunk = encode_multipart(mosaic.canvas, quality=MOSAIC_QUALITY)
+                if chunk is not None:
+                    yield chunk
+            time.sleep(max(0.0, interval - (time.monotonic() - started)))
+    finally:
+        for lease in leases:
+            lease.release()
+
+
+async def agen_mosaic(camera_ids, cols, tile_width, tile_height, fps):
+    """Async version of gen_mosaic; opening the cameras, composing and encoding run in the bounded async_executor."""
+    loop = asyncio.get_running_loop()
+    leases = []
+    try:
+        for camera_id in camera_ids:
+            leases.append(await loop.run_in_executor(async_executor, camera_registry.acquire, camera_id))
+        tiles = [(lease.camera_id, lease.worker) for lease in leases]
+        mosaic = Mosaic(tiles, cols, tile_width, tile_height)
+        interval = 1 / fps
+
+        def render():
+            if not mosaic.compose():
+                return None
+            return encode_multipart(mosaic.canvas, quality=MOSAIC_QUALITY)
+
+        while any(worker.running for _, worker in tiles):
+            started = loop.time()
+            chunk = await loop.run_in_executor(async_executor, render)
+            if chunk is not None:
+                yield chunk
+            await asyncio.sleep(max(0.0, interval - (loop.time() - started)))
+    finally:  # Runs when the client disconnects, too
+        for lease in leases:
+            await loop.run_in_executor(async_executor, lease.release)
+
+
+def latest_camera_frame(camera_id):
+    """Return the newest processed frame of a camera, opening the camera for one frame if nobody streams it."""
+    # The lease keeps the camera open through the grace period, so a burst of screenshots opens it once
+    with camera_registry.acquire(camera_id) as lease:
+        if lease.worker.latest is not None:
+            return lease.worker.latest  # Already captured and analysed for the live stream, nothing to do
+        return lease.worker.wait_for_frame(0, timeout=FRAME_TIMEOUT)
 
 
 @csrf_exempt
+@metrics.timed("save_screenshot")
 def save_screenshot(request, camera_id):
-    """Save a screenshot to the server with detected cats highlighted and record metadata in the database."""
+    """Queue a screenshot with detected cats highlighted; the background writer saves the file and the database row."""
     try:
-        # Generate file name and path
-        formatted_time = now().strftime("%Y-%m-%d_%H-%M-%S")
-        file_name = f"camera_{camera_id}_screenshot_{formatted_time}.jpg"
+        # Generate file name, in the camera's directory for the day
+        file_name = screenshot_file_name(camera_id)
         
-        # Get upload directory and file path
-        upload_dir = os.path.join(settings.MEDIA_ROOT, "screenshots")
-        file_path = os.path.join(upload_dir, file_name)
-        os.makedirs(upload_dir, exist_ok=True)
-        
-        # Capture the frame from the camera instance
-        camera = camera_instances[camera_id]
-        success, frame = camera.read()
-        if not success:
+        # Take the latest frame from the camera's ring buffer, cats are already detected and highlighted on it
+        frame = latest_camera_frame(camera_id)
+        if frame is None:
             return JsonResponse({"error": "Failed to capture frame"}, status=500)
         
-        # Detect cats in the frame
-        gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)  # Convert to grayscale for detection
-        cascade_path = os.path.join(settings.BASE_DIR, "cascades", "haarcascade_frontalcatface.xml")
-        cat_cascade = cv2.CascadeClassifier(cascade_path)
-        
-        if cat_cascade.empty():
-            raise Exception(f"Error loading cat cascade. Check if the file exists at {cascade_path}")
-        
-        # Detect cats and draw rectangles
-        cats = cat_cascade.detectMultiScale(gray_frame, scaleFactor=1.1, minNeighbors=5, minSize=(75, 75))
-        for (x, y, w, h) in cats:
-            cv2.rectangle(frame, (x, y), (x + w, y + h), (255, 0, 0), 2)
-        
-        # Save the frame with rectangles as an image file
-        cv2.imwrite(file_path, frame)
-        
-        # Save metadata to the database
-        Screenshot.objects.create(camera_id=camera_id, file_path=file_name)
+        # Encoding, writing the file and inserting the row happen in the background, poll screenshot_status for the result
+        try:
+            captured_at = datetime.datetime.fromtimestamp(frame.timestamp, datetime.timezone.utc)
+            job = get_screenshot_writer().submit(camera_id, frame.image, file_name, captured_at)
+        except queue.Full:
+            return JsonResponse({"error": "Too many screenshots are waiting to be saved, try again later"}, status=503)
         
-        return JsonResponse({"status": "success", "file_path": file_name})
+        return JsonResponse({"status": "queued", "job_id": job.id, "file_path": file_name, "detections": len(frame.boxes)}, status=202)
     except Exception as e:
         return JsonResponse({"error": str(e)}, status=500)
 
 
+def screenshot_status(request, job_id):
+    """API endpoint to poll a queued screenshot: queued, saved (with its id), duplicate (with the id of the
+    nearly identical screenshot kept instead) or failed."""
+    status = get_screenshot_writer().status(job_id)
+    if status is None:
+        return JsonResponse({"status": "error", "message": "Unknown job"}, status=404)
+    return JsonResponse(status)
+
+
+@csrf_exempt
+def export_clip(request, camera_id):
+    """Save the last ?seconds= of a streaming camera, kept in its ring buffer, as a video clip."""
+    if request.method != "POST":
+        return JsonResponse({"status": "error", "message": "Invalid request method"}, status=405)
+    try:
+        seconds = float(request.GET.get("seconds", 5))
+    except ValueError:
+        return JsonResponse({"error": "seconds must be a number"}, status=400)
+
+    with lock:
+        worker = camera_instances.get(camera_id)
+    frames = worker.history.last(seconds) if worker is not None else []
+    if not frames:
+        return JsonResponse(
+            {"error": "Nothing buffered for this camera, it has to be streaming with STREAM_HISTORY_SECONDS set"}, status=404
+        )
+
+    # Generate file name and path
+    formatted_time = now().strftime("%Y-%m-%d_%H-%M-%S")
+    file_name = f"camera_{camera_id}_clip_{formatted_time}.avi"
+    upload_dir = os.path.join(settings.MEDIA_ROOT, "clips")
+    os.makedirs(upload_dir, exist_ok=True)
+
+    # Play the clip back at the rate the frames were actually captured
+    duration = frames[-1].timestamp - frames[0].timestamp
+    fps = (len(frames) - 1) / duration if duration > 0 else 1.0
+    height, width = frames[0].image.shape[:2]
+    writer = cv2.VideoWriter(os.path.join(upload_dir, file_name), cv2.VideoWriter_fourcc(*"MJPG"), fps, (width, height))
+    try:
+        for frame in frames:
+            writer.write(frame.image)
+    finally:
+        writer.release()
+
+    return JsonResponse({"status": "success", "file_path": f"clips/{file_name}", "frames": len(frames), "seconds": round(duration, 2)})
+
+
+@csrf_exempt
+def start_recording(request, camera_id):
+    """Start recording the camera continuously into segments; the recording keeps the camera open until stop_recording."""
+    if request.method != "POST":
+        return JsonResponse({"status": "error", "message": "Invalid request method"}, status=405)
+    with recordings_lock:
+        if camera_id in recordings:
+            return JsonResponse({"status": "recording", "camera_id": camera_id})
+        lease = camera_registry.acquire(camera_id)
+        if not lease.worker.running:
+            # Died between being handed out and now (or failed to open); the registry replaces a dead worker on acquire
+            lease.release()
+            lease = camera_registry.acquire(camera_id)
+            if not lease.worker.running:
+                lease.release()
+                return JsonResponse({"status": "error", "message": "Camera is not running, try again"}, status=503)
+        recorder = CameraRecorder(
+            camera_id,
+            lease.worker.encoded,
+            get_recording_writer(),
+            fps=getattr(settings, "STREAM_RECORD_FPS", 10),
+            profile=getattr(settings, "STREAM_RECORD_PROFILE", "full"),
+            on_stop=schedule_recording_restart,
+        )
+        lease.worker.add_recorder(recorder)  # Records the frames the worker already captures for streaming
+        recordings[camera_id] = (lease, recorder)
+    return JsonResponse({"status": "recording", "camera_id": camera_id}, status=201)
+
+
+def schedule_recording_restart(recorder):
+    """Called in the capture thread of a recorded camera that stopped on its own; reopens it a bit later."""
+    timer = threading.Timer(getattr(settings, "STREAM_RECORD_RESTART_SECONDS", 5), restart_recording, args=(recorder,))
+    timer.daemon = True
+    timer.start()
+
+
+def restart_recording(recorder):
+    """Give back the lease on the dead worker and move the recording to a freshly opened one.
+
+    Without this the recording's lease would keep the dead worker registered, and every new
+    viewer or screenshot of the camera would get it until the recording is stopped.
+    """
+    camera_id = recorder.camera_id
+    with recordings_lock:
+        lease, current = recordings.get(camera_id, (None, None))
+        if current is not recorder:  # Stopped, or restarted already, in the meantime
+            return
+        lease.release()
+        lease = camera_registry.acquire(camera_id)
+        recorder.encoded = lease.worker.encoded
+        lease.worker.add_recorder(recorder)
+        recordings[camera_id] = (lease, recorder)
+        restarted = lease.worker.running
+        if restarted:
+            recorder.restarts += 1
+        else:
+            lease.worker.remove_recorder(recorder)
+    if not restarted:
+        # Other leases still hold the dead worker, or the device failed again right away: try again later
+        schedule_recording_restart(recorder)
+
+
+@csrf_exempt
+def stop_recording(request, camera_id):
+    """Stop recording the camera; its last segment is closed once the queued frames are written."""
+    if request.method != "POST":
+        return JsonResponse({"status": "error", "message": "Invalid request method"}, status=405)
+    with recordings_lock:
+        lease, recorder = recordings.pop(camera_id, (None, None))
+    if recorder is None:
+        return JsonResponse({"status": "error", "message": "Camera is not being recorded"}, status=404)
+    lease.worker.remove_recorder(recorder)
+    recorder.close()
+    lease.release()
+    return JsonResponse({"status": "stopped", "camera_id": camera_id, "frames": recorder.frames})
+
+
+def recording_frame(request, camera_id):
+    """The recorded frame the camera showed at ?at= (ISO datetime), found through the segment index."""
+    try:
+        at = parse_time(request.GET.get("at", ""))
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    found = find_frame(camera_id, at)
+    if found is None:
+        return JsonResponse({"status": "error", "message": "Nothing recorded at that time"}, status=404)
+    timestamp, jpeg = found
+    response = HttpResponse(jpeg, content_type="image/jpeg")
+    response.headers["X-Frame-Time"] = timestamp.isoformat()
+    return response
+
+
+def parse_playback_options(request):
+    """Read ?start=, ?end= and ?speed= of a playback request. Returns (start, end, speed, error_response)."""
+    try:
+        start = parse_time(request.GET.get("start", ""))
+        end = parse_time(request.GET["end"]) if request.GET.get("end") else None
+        speed = float(request.GET.get("speed", 1))
+    except ValueError as e:
+        return None, None, None, JsonResponse({"error": str(e)}, status=400)
+    if not 0 < speed <= 16:
+        return None, None, None, JsonResponse({"error": "speed must be between 0 and 16"}, status=400)
+    return start, end, speed, None
+
+
+def recording_playback(request, camera_id):
+    """Play the recording back from ?start= (until ?end=, if given) at ?speed= times real time."""
+    start, end, speed, error = parse_playback_options(request)
+    if error:
+        return error
+    return StreamingHttpResponse(
+        gen_recording(camera_id, start, end, speed),
+        content_type="multipart/x-mixed-replace; boundary=frame",
+    )
+
+
+async def recording_playback_async(request, camera_id):
+    """Async playback for ASGI servers, the counterpart of recording_playback."""
+    start, end, speed, error = parse_playback_options(request)
+    if error:
+        return error
+    return StreamingHttpResponse(
+        agen_recording(camera_id, start, end, speed),
+        content_type="multipart/x-mixed-replace; boundary=frame",
+    )
+
+
+def playback_delay(previous, timestamp, speed):
+    """Seconds to wait between two recorded frames; pauses in the recording (the camera was closed,
+    or the scene was static) last at most a second."""
+    if previous is None:
+        return 0.0
+    return min((timestamp - previous).total_seconds() / speed, 1.0)
+
+
+def gen_recording(camera_id, start, end, speed):
+    """Generate recorded frames as a multipart stream, paced by their capture times."""
+    previous = None
+    for timestamp, jpeg in iter_recording(camera_id, start, end):
+        time.sleep(playback_delay(previous, timestamp, speed))
+        previous = timestamp
+        yield b"".join((MULTIPART_HEADER, jpeg, b"\r\n"))
+
+
+async def agen_recording(camera_id, start, end, speed):
+    """Async version of gen_recording; the segment lookups (database queries) and reads run in the async_executor."""
+    loop = asyncio.get_running_loop()
+    frames = iter_recording(camera_id, start, end)
+    previous = None
+    try:
+        while True:
+            item = await loop.run_in_executor(async_executor, next, frames, None)
+            if item is None:
+                break
+            timestamp, jpeg = item
+            await asyncio.sleep(playback_delay(previous, timestamp, speed))
+            previous = timestamp
+            yield b"".join((MULTIPART_HEADER, jpeg, b"\r\n"))
+    finally:
+        frames.close()  # Unmaps the open segment
+
+
+@csrf_exempt
+def export_recording_clip(request, camera_id):
+    """Save ?seconds= of the recording from ?start= as a video clip."""
+    if request.method != "POST":
+        return JsonResponse({"status": "error", "message": "Invalid request method"}, status=405)
+    try:
+        start = parse_time(request.GET.get("start", ""))
+        seconds = float(request.GET.get("seconds", 60))
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    file_name = f"camera_{camera_id}_recording_{start.strftime('%Y-%m-%d_%H-%M-%S')}.avi"
+    upload_dir = os.path.join(settings.MEDIA_ROOT, "clips")
+    os.makedirs(upload_dir, exist_ok=True)
+    frames = export_recording(camera_id, start, start + datetime.timedelta(seconds=seconds), os.path.join(upload_dir, file_name))
+    if not frames:
+        return JsonResponse({"status": "error", "message": "Nothing recorded in that time"}, status=404)
+    return JsonResponse({"status": "success", "file_path": f"clips/{file_name}", "frames": frames})
+
+
+def screenshot_thumbnail(request, screenshot_id):
+    """Serve a screenshot's cached thumbnail, generating it on first request; repeat visits get a 304."""
+    try:
+        screenshot = Screenshot.objects.get(id=screenshot_id)
+    except Screenshot.DoesNotExist:
+        return JsonResponse({"status": "error", "message": "Screenshot not found"}, status=404)
+    path = ensure_thumbnail(screenshot.file_path)
+    if path is None:
+        return JsonResponse({"status": "error", "message": "Screenshot file not found"}, status=404)
+
+    stat = os.stat(path)
+    etag = quote_etag(f"{screenshot.id}-{stat.st_mtime_ns:x}-{stat.st_size:x}")
+    last_modified = int(stat.st_mtime)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = FileResponse(open(path, "rb"), content_type="image/jpeg")
+    response.headers["ETag"] = etag
+    response.headers["Last-Modified"] = http_date(last_modified)
+    response.headers["Cache-Control"] = "private, max-age=3600"
+    return response
+
+
 @csrf_exempt
 def delete_screenshot(request, screenshot_id):
     if request.method == "POST":
@@ -180,10 +776,8 @@ def delete_screenshot(request, screenshot_id):
             # Get the screenshot from the database
             screenshot = Screenshot.objects.get(id=screenshot_id) 
             
-            # Delete the file from the server
-            file_path = os.path.join(settings.MEDIA_ROOT, "screenshots", screenshot.file_path) 
-            if os.path.exists(file_path):
-                os.remove(file_path)
+            # Delete the file, its cached thumbnail and its directory for the day if that was the last one
+            remove_screenshot_file(screenshot.file_path)
             
             # Delete the screenshot entry from the database
             screenshot.delete() 